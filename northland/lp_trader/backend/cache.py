@@ -0,0 +1,304 @@
+from django.conf import settings
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from typing import *
+from urllib.parse import urlsplit
+
+from .metrics import *
+from .scheduler import *
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import requests
+import time
+import uuid
+
+"""
+On-disk HTTP response cache with conditional request support.
+
+CachingHTTPAdapter can be mounted on any requests session (including the one used by the ESI client).
+Fresh responses (according to Expires/Cache-Control) are served from disk without touching the network,
+and stale responses are revalidated with If-None-Match/If-Modified-Since, so an unchanged payload only
+costs a 304. fetch() additionally memoizes the parsed result of a response, so a 304 also skips re-parsing.
+Bodies are written to disk as they are downloaded, and streamed requests (stream=True) read them back from disk,
+so large dumps never have to be held in memory. Requests carrying an Authorization header are never cached, and
+responses are only reused for requests matching the headers named in their Vary header.
+Requests that do go out are scheduled (and retried) by the process-wide RequestScheduler in scheduler.py.
+"""
+
+CACHE_VERSION_HEADER = "X-Local-Cache-Version"
+# Headers that describe the encoded body on the wire, which no longer apply to the decoded body on disk
+_SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+def _get_endpoint(url: str) -> Tuple[str, str]:
+    """
+    Returns the host and path of a URL, with numeric path segments (i.e. corp or character IDs) replaced by {id}
+    so that requests to the same endpoint share their metrics
+    """
+    url = urlsplit(url)
+    path = "/".join("{id}" if segment.isdigit() else segment for segment in url.path.split("/"))
+    return url.hostname or "", path
+
+
+def _parse_expiry(headers: Mapping) -> float:
+    """
+    Returns the timestamp at which a response expires according to its Cache-Control/Expires headers (0 if not cacheable)
+    """
+    cache_control = headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    if max_age:
+        return time.time() + int(max_age.group(1))
+    try:
+        return parsedate_to_datetime(headers["Expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+class ResponseCache():
+    """
+    Stores response bodies, their validators and parsed results on disk, keyed by request method and URL.
+    Authenticated requests must not be stored (see is_cacheable())
+
+    Args:
+        cache_dir (str): Directory to store cached responses in. Defaults to settings.HTTP_CACHE_DIR
+    """
+    def __init__(self, cache_dir: str | None = None):
+        self.cache_dir = cache_dir or getattr(settings, "HTTP_CACHE_DIR", os.path.join(settings.BASE_DIR, "http_cache"))
+
+    @staticmethod
+    def get_key(method: str, url: str) -> str:
+        return hashlib.sha256(f"{method} {url}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(request: requests.PreparedRequest) -> bool:
+        # Authenticated responses (wallets, loyalty points) are private to a character, and must never be written
+        # to disk or served to another character requesting the same URL
+        return request.method == "GET" and "Authorization" not in request.headers
+
+    @staticmethod
+    def matches_vary(meta: dict, request: requests.PreparedRequest) -> bool:
+        return all(request.headers.get(name) == value for name, value in meta.get("vary", {}).items())
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{suffix}")
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_meta(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key, "json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def open_body(self, key: str) -> BinaryIO | None:
+        try:
+            return open(self._path(key, "body"), "rb")
+        except OSError:
+            return None
+
+    def store(self, key: str, request: requests.PreparedRequest, response: requests.Response) -> dict | None:
+        """
+        Store a 200 response, returning its cache metadata (None if the response must not be cached).
+        The body is written to disk chunk by chunk as it is downloaded
+        """
+        vary = [name.strip() for name in response.headers.get("Vary", "").split(",") if name.strip()]
+        if "*" in vary:
+            return None
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _SKIPPED_HEADERS}
+        meta = {
+            "url": response.url,
+            "version": uuid.uuid4().hex,
+            "headers": headers,
+            "vary": {name: request.headers.get(name) for name in vary},
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires": _parse_expiry(response.headers)
+        }
+        os.makedirs(self.cache_dir, exist_ok=True)
+        body_path = self._path(key, "body")
+        tmp_path = f"{body_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+        os.replace(tmp_path, body_path)
+        self._write(self._path(key, "json"), json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def revalidated(self, key: str, meta: dict, response: requests.Response) -> dict:
+        """
+        Refresh the metadata of a cached response after the server answered 304 Not Modified
+        """
+        meta["headers"].update({k: v for k, v in response.headers.items() if k.lower() not in _SKIPPED_HEADERS})
+        meta["expires"] = _parse_expiry(meta["headers"])
+        self._write(self._path(key, "json"), json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def get_parsed(self, key: str, version: str, parser: str) -> Tuple[bool, Any]:
+        try:
+            with open(self._path(key, f"{parser}.parsed"), "rb") as f:
+                parsed_version, parsed = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return False, None
+        return parsed_version == version, parsed
+
+    def store_parsed(self, key: str, version: str, parser: str, parsed: Any):
+        self._write(self._path(key, f"{parser}.parsed"), pickle.dumps((version, parsed)))
+
+
+class CachingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that serves GET requests from a ResponseCache, revalidating stale entries with conditional requests.
+    Responses served from the cache have a from_cache attribute set to True. Streamed responses of cached requests
+    read their body from the file on disk (response.raw)
+
+    Args:
+        cache (ResponseCache): The cache to store responses in
+        **kwargs: Passed on to HTTPAdapter (i.e. pool_maxsize, max_retries)
+    """
+    def __init__(self, cache: ResponseCache | None = None, **kwargs):
+        self.cache = cache or ResponseCache()
+        super().__init__(**kwargs)
+
+    def _build_cached_response(
+        self,
+        request: requests.PreparedRequest,
+        meta: dict,
+        body: BinaryIO,
+        stream: bool = False,
+        from_cache: bool = True
+    ) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response.headers[CACHE_VERSION_HEADER] = meta["version"]
+        response.encoding = get_encoding_from_headers(response.headers)
+        if stream:
+            response.raw = body
+        else:
+            with body:
+                response._content = body.read()
+        response.from_cache = from_cache
+        return response
+
+    def _send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        # All requests go through the process-wide scheduler, and transient errors are retried with backoff
+        host, endpoint = _get_endpoint(request.url)
+        attempt = 0
+        while True:
+            with scheduler.slot(host):
+                start = time.perf_counter()
+                try:
+                    response = super().send(request, **kwargs)
+                except Exception as e:
+                    metrics.inc("lp_trader_http_requests_total", host=host, endpoint=endpoint, status=type(e).__name__)
+                    raise e
+                metrics.observe("lp_trader_http_request_duration_seconds", time.perf_counter() - start, host=host, endpoint=endpoint)
+                metrics.inc("lp_trader_http_requests_total", host=host, endpoint=endpoint, status=str(response.status_code))
+                scheduler.record_response(host, response)
+
+            delay = scheduler.get_retry_delay(host, response, attempt)
+            if delay is None:
+                return response
+            print(f"Retrying {request.method} {request.url} in {delay:.1f}s (status {response.status_code})")
+            metrics.inc("lp_trader_http_retries_total", host=host, status=str(response.status_code))
+            # Reading the body first lets the connection go back to the pool instead of being closed
+            response.content
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if not self.cache.is_cacheable(request):
+            response = self._send(request, **kwargs)
+            response.from_cache = False
+            return response
+
+        stream = kwargs.get("stream", False)
+        key = self.cache.get_key(request.method, request.url)
+        meta = self.cache.get_meta(key)
+        if meta is not None and not self.cache.matches_vary(meta, request):
+            meta = None
+        body = self.cache.open_body(key) if meta else None
+        if meta and body is not None:
+            if meta["expires"] > time.time():
+                metrics.inc("lp_trader_http_cache_total", result="hit")
+                return self._build_cached_response(request, meta, body, stream)
+            if meta["etag"]:
+                request.headers["If-None-Match"] = meta["etag"]
+            if meta["last_modified"]:
+                request.headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self._send(request, **kwargs)
+        except Exception as e:
+            if body is not None:
+                body.close()
+            raise e
+        if response.status_code == 304 and meta and body is not None:
+            metrics.inc("lp_trader_http_cache_total", result="revalidated")
+            meta = self.cache.revalidated(key, meta, response)
+            response.close()
+            return self._build_cached_response(request, meta, body, stream)
+        if body is not None:
+            body.close()
+        metrics.inc("lp_trader_http_cache_total", result="miss")
+        response.from_cache = False
+        if response.status_code == 200:
+            stored = self.cache.store(key, request, response)
+            response.close()
+            if stored is not None:
+                return self._build_cached_response(request, stored, self.cache.open_body(key), stream, from_cache=False)
+        return response
+
+
+def fetch(session: requests.Session, url: str, params: dict | None = None, parse: Callable | None = None) -> Tuple[int, Any]:
+    """
+    Perform a GET request through a session with a CachingHTTPAdapter mounted, memoizing the parsed result.
+    If the response was served from the cache (fresh or revalidated with a 304), the memoized result is
+    returned without parsing the body again
+
+    Args:
+        session (requests.Session): The session to send the request with
+        url (str): The URL to request
+        params (dict): Query parameters
+        parse (Callable): Function turning the response into the parsed result. Defaults to response.json()
+
+    Returns:
+        A tuple of the status code and parsed result
+    """
+    parse = parse or requests.Response.json
+    response = session.get(url, params=params)
+    version = response.headers.get(CACHE_VERSION_HEADER)
+    if version is None or response.status_code != 200:
+        return response.status_code, parse(response)
+
+    adapter = session.get_adapter(response.url)
+    key = adapter.cache.get_key("GET", response.url)
+    parser = f"{parse.__module__}.{parse.__qualname__}"
+    if getattr(response, "from_cache", False):
+        is_valid, parsed = adapter.cache.get_parsed(key, version, parser)
+        if is_valid:
+            metrics.inc("lp_trader_parse_cache_total", result="hit")
+            return response.status_code, parsed
+    metrics.inc("lp_trader_parse_cache_total", result="miss")
+    parsed = parse(response)
+    adapter.cache.store_parsed(key, version, parser, parsed)
+    return response.status_code, parsed
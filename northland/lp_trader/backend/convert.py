@@ -1,6 +1,11 @@
+from django.conf import settings
+
 from ..models import *
 from .data import *
 from .endpoints import *
+from .engine import *
+from .industry import *
+from .prices import *
 
 
 
@@ -14,7 +19,9 @@ class LPConverter():
     Corporations involved with factional warfare, Triglavian Invasion or any of the pirate factions: No conversion rate
 
     Functions:
-
+        calculate_isk_per_lp(corp): Returns the offers of a corp sorted by ISK/LP rate
+        get_profitable_trades(): Returns the 10 best offers of every corp
+        get_top_offers(k, ...): Returns the k best offers across all corps, with optional filters
     """
     def __init__(self, char: Character):
         self.concord_lp = char.loyalty_points["CONCORD"]
@@ -38,13 +45,11 @@ class LPConverter():
             for input_item in required_inputs:
                 quantity, type_id = list(map(int, input_item.values()))
                 try:
-                    item = Item.objects.filter(item_id=type_id)[0]
-                    item_sell_price = item.market_price["sell"]
-                    final_cost += quantity * int(item_sell_price)
-                except IndexError as ie:
-                    # Item probably doesnt exist (i.e. blueprints) due to SDE filtering
-                    print(f"Item ID {type_id} skipped as item is not found in DB")
-                    return 0
+                    market_price = price_index.get(type_id)
+                    if not market_price or "sell" not in market_price:
+                        # Item probably doesnt exist (i.e. blueprints) due to SDE filtering, or has not been priced yet
+                        return 0
+                    final_cost += quantity * int(market_price["sell"])
                 except Exception as e:
                     # Some other exception that we didnt catch
                     print(f"Input cost calculation exception: {e}")
@@ -54,13 +59,11 @@ class LPConverter():
         def _get_received_item_profits(received_items: dict) -> int:
             quantity, type_id = list(map(int, received_items.values()))
             try:
-                item = Item.objects.filter(item_id=type_id)[0]
-                item_sell_price = item.market_price["sell"]
-                return quantity * int(item_sell_price)
-            except IndexError as ie:
-                # Item probably doesnt exist (i.e. blueprints) due to SDE filtering
-                print(f"Item ID {type_id} skipped as item is not found in DB")
-                return 0
+                market_price = price_index.get(type_id)
+                if not market_price or "sell" not in market_price:
+                    # Item probably doesnt exist (i.e. blueprints) due to SDE filtering, or has not been priced yet
+                    return 0
+                return quantity * int(market_price["sell"])
             except Exception as e:
                 # Some other exception that we didnt catch
                 print(f"Profit cost calculation exception: {e}")
@@ -72,6 +75,7 @@ class LPConverter():
             
         if _force_update or check_for_item_update():
             update_sde_prices()
+        price_index.ensure_fresh()
 
         offers = corp.offers
         calculated_offers = {}
@@ -92,15 +96,76 @@ class LPConverter():
             calculated_offers[id] = isk_per_lp_rate
         return _reparse_output(calculated_offers)
     
-    def get_profitable_trades(self):
-        corps = Corp.objects.all()
+    def get_profitable_trades(self, _force_update: bool = False):
+        """
+        Calculate the 10 best offers of every corp in a single vectorized pass over all LP stores
+
+        Args:
+            _force_update (bool): Force the SDE price update regardless of last_updated status (only for dev use)
+
+        Returns:
+            list[dict] of {offer_id: isk_per_lp}, grouped by corp
+        """
+        if _force_update or check_for_item_update():
+            update_sde_prices()
+
+        engine = OfferEngine().compile()
+        isk_per_lp = engine.evaluate(engine.build_price_vector())
         collated_exchange_rates = []
-        for corp in corps:
-            print(corp)
-            res = self.calculate_isk_per_lp(corp)[:10]
+        for res in engine.rank_per_corp(isk_per_lp, limit=10):
             collated_exchange_rates.extend(res)
         return collated_exchange_rates
 
+    def get_top_offers(
+        self,
+        k: int = 10,
+        min_isk_per_lp: float | None = None,
+        corp_ids: list[int] | None = None,
+        exclude_inputs: list[int] | None = None,
+        max_isk_outlay: float | None = None,
+        smoothing_window: int | None = None,
+        _force_update: bool = False
+    ) -> list[OfferRecord]:
+        """
+        Returns the k best offers across all corps, ranked against each other
+
+        Args:
+            k (int): Max. number of offers to return
+            min_isk_per_lp (float): Only return offers with at least this ISK/LP rate
+            corp_ids (list[int]): Only return offers from these corps
+            exclude_inputs (list[int]): Leave out offers requiring any of these type IDs as an input
+            max_isk_outlay (float): Only return offers whose ISK cost plus input cost is at most this amount
+            smoothing_window (int): Rank against the rolling price of this many price history snapshots instead of
+                the current prices (0 to disable). Defaults to settings.PRICE_SMOOTHING_WINDOW
+            _force_update (bool): Force the SDE price update regardless of last_updated status (only for dev use)
+
+        Returns:
+            list[OfferRecord], best offers first
+        """
+        if _force_update or check_for_item_update():
+            update_sde_prices()
+
+        if smoothing_window is None:
+            smoothing_window = getattr(settings, "PRICE_SMOOTHING_WINDOW", 0)
+
+        engine = OfferEngine().compile()
+        if smoothing_window:
+            prices = engine.build_smoothed_price_vector(
+                window = smoothing_window,
+                method = getattr(settings, "PRICE_SMOOTHING_METHOD", "median"),
+                blueprints = build_cost_engine
+            )
+        else:
+            prices = engine.build_price_vector(blueprints=build_cost_engine)
+        return engine.top_k(
+            prices,
+            k = k,
+            min_isk_per_lp = min_isk_per_lp,
+            corp_ids = corp_ids,
+            exclude_inputs = exclude_inputs,
+            max_isk_outlay = max_isk_outlay
+        )
+
 
     
 
@@ -1,34 +1,41 @@
+from django.conf import settings
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
 from esi.models import Token
-from tqdm import tqdm
 
 from ..models import *
 from .endpoints import *
+from .history import *
+from .industry import *
+from .jobs import *
+from .metrics import *
+from .names import *
+from .orderbook import *
+from .prices import *
+from .rankings import *
+from .sde import *
 
-import numpy as np
-import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import hashlib
+import json
 import time
 
 def temp():
     chars = Character.objects.all()
+    store_names = set()
     for char in chars:
         print(f"Checking LP list for {char}")
-        lp_list = char.loyalty_points
-        for store, _ in lp_list.items():
-            print(f"Attempting to add/update LP store for {store}")
-            store_id = post_names_to_ids([store])["corporations"][0]["id"]
-            _ = update_corp_loyalty_store(store_id)
+        store_names.update(char.loyalty_points.keys())
+    print(f"Attempting to add/update LP stores for {len(store_names)} corps")
+    store_ids = resolve_names_to_ids(list(store_names), category="corporation")
+    _ = update_corp_loyalty_stores(list(store_ids.values()))
     print("All stores updated successfully")
     return False
 
 
 def check_for_character_update():
-    chars = Character.objects.all()
-    for char in chars:
-        if not char.was_recently_updated():
-            token = Token.objects.filter(character_id=char.char_id)[0]
-            _ = update_character_db(token)
+    update_characters()
     return False
 
 def check_for_item_update():
@@ -48,32 +55,102 @@ def update_character_db(token: Token, force: bool = False) -> bool:
     Returns:
         bool
     """
+    return update_characters([token], force=force)
+
+def update_characters(
+    tokens: list[Token] | None = None,
+    force: bool = False,
+    max_workers: int = 8,
+    progress: ProgressReporter | None = None
+) -> bool:
+    """
+    Updates the wallets and LP of multiple characters in parallel.
+    Tokens and characters are loaded in one query each, wallets and LP of every character are fetched
+    concurrently, the corp names of all LP entries are resolved in a single call, and all Character rows
+    are committed in one transaction
+
+    Args:
+        tokens (list[Token]): The tokens of the characters to update. Defaults to all tokens
+        force (bool): Update regardless of was_recently_updated status
+        max_workers (int): Max. number of concurrent ESI requests
+        progress (ProgressReporter): Reporter to publish progress to
+
+    Returns:
+        bool: All characters were updated successfully
+    """
+    progress = progress or ProgressReporter()
+    if tokens is None:
+        tokens = Token.objects.order_by("created")
+    # Characters can have several tokens, so only the most recent one of each is used
+    tokens = {token.character_id: token for token in tokens}
+    chars = {char.char_id: char for char in Character.objects.filter(char_id__in=tokens.keys())}
+    tokens = {
+        char_id: token for char_id, token in tokens.items()
+        if force or char_id not in chars or not chars[char_id].was_recently_updated()
+    }
+    if not tokens:
+        return True
+
+    def _fetch(token: Token) -> Tuple[dict, list[dict]]:
+        try:
+            return get_character_wallet_balance(token, token.character_id), get_loyalty_points(token, raw=True)
+        finally:
+            # Token refreshes write to the database from this worker thread
+            connection.close()
+
+    print(f"Updating data for {len(tokens)} characters...")
+    start = time.time()
+    progress.start("character refresh", total=len(tokens))
+    results, success = {}, True
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch, token): char_id for char_id, token in tokens.items()}
+        for future in as_completed(futures):
+            char_id = futures[future]
+            try:
+                results[char_id] = future.result()
+            except Exception as e:
+                print(f"Exception {e} (character ID {char_id})")
+                success = False
+            progress.advance()
+    progress.finish()
+
+    corp_ids = list(dict.fromkeys(entry["corporation_id"] for _, lp in results.values() for entry in lp))
     try:
-        char = Character.objects.get(char_id=token.character_id)
-        if not char.was_recently_updated() or force:
-            # Update character data
-            print(f"Updating data for {char.char_name}...")
-            char.wallet = get_character_wallet_balance(token, char.char_id)
-            char.loyalty_points = get_loyalty_points(token, raw=False)
-            char.last_updated = timezone.now()
-            char.save()
-            print("Character data updated!")
-            print(f"Last updated: {char.last_updated}")
-    except Character.DoesNotExist as dne:
-        print(f"Creating new character...")
-        new_char = Character(
-            char_name = token.character_name,
-            char_id = token.character_id,
-            wallet = get_character_wallet_balance(token, token.character_id),
-            loyalty_points = get_loyalty_points(token),
-            last_updated = timezone.now()
-        )
-        new_char.save()
-        print(f"New character ({token.character_name}) created!")
+        corp_names = resolve_ids_to_names(corp_ids) if corp_ids else {}
     except Exception as e:
-        print(f"Exception: {e}")
-        raise e
-    return True
+        print(f"Exception {e} while resolving loyalty point corp names")
+        corp_names = {}
+    unresolved = [corp_id for corp_id in corp_ids if corp_id not in corp_names]
+    if unresolved:
+        # Loyalty points of unresolved corps are kept under the raw corp ID, instead of failing every character
+        print(f"Corp names of {len(unresolved)} loyalty point entries not resolved: {unresolved}")
+        success = False
+    last_updated = timezone.now()
+    to_update, to_create = [], []
+    for char_id, (wallet, lp) in results.items():
+        loyalty_points = {
+            corp_names.get(entry["corporation_id"], entry["corporation_id"]): entry["loyalty_points"] for entry in lp
+        }
+        if char_id in chars:
+            char = chars[char_id]
+            char.wallet, char.loyalty_points, char.last_updated = wallet, loyalty_points, last_updated
+            to_update.append(char)
+        else:
+            to_create.append(Character(
+                char_name = tokens[char_id].character_name,
+                char_id = char_id,
+                wallet = wallet,
+                loyalty_points = loyalty_points,
+                last_updated = last_updated
+            ))
+    with transaction.atomic():
+        Character.objects.bulk_update(to_update, ["wallet", "loyalty_points", "last_updated"])
+        Character.objects.bulk_create(to_create)
+    metrics.observe("lp_trader_refresh_duration_seconds", time.time() - start, refresh="characters")
+    metrics.inc("lp_trader_refresh_rows_total", len(to_update), refresh="characters", operation="updated")
+    metrics.inc("lp_trader_refresh_rows_total", len(to_create), refresh="characters", operation="created")
+    print(f"Data updated for {len(to_update)} characters, {len(to_create)} new characters created! (runtime: {time.time() - start})")
+    return success
 
 def update_corp_loyalty_store(corp_id: int) -> bool:
     """
@@ -86,65 +163,201 @@ def update_corp_loyalty_store(corp_id: int) -> bool:
     Returns:
         bool
     """
+    return update_corp_loyalty_stores([corp_id])
+
+
+def update_corp_loyalty_stores(corp_ids: list[int], max_workers: int = 8, progress: ProgressReporter | None = None) -> bool:
+    """
+    Updates the loyalty store offers of multiple corporations in parallel.
+    Offers are fetched concurrently, names of new corporations are resolved in a single call,
+    and all Corp rows are committed in one transaction
+
+    Args:
+        corp_ids (list[int]): The corporation IDs to update offers for
+        max_workers (int): Max. number of concurrent loyalty store requests
+        progress (ProgressReporter): Reporter to publish progress to
+
+    Returns:
+        bool: All loyalty stores were updated successfully
+    """
+    progress = progress or ProgressReporter()
+    corp_ids = list(dict.fromkeys(corp_ids))
+    print(f"Fetching offers for {len(corp_ids)} loyalty stores...")
+    start = time.time()
+    progress.start("store refresh", total=len(corp_ids))
+    offers, success = {}, True
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_loyalty_store_offers, corp_id): corp_id for corp_id in corp_ids}
+        for future in as_completed(futures):
+            corp_id = futures[future]
+            try:
+                offers[corp_id] = future.result()
+            except Exception as e:
+                print(f"Exception {e} (corp ID {corp_id})")
+                success = False
+            progress.advance()
+    progress.finish()
+
     try:
-        corp_store = Corp.objects.get(corp_id=corp_id)
-        print(f"Updating offers for {corp_store.corp_name}...")
-        corp_store.offers = get_loyalty_store_offers(corp_id)
-        corp_store.save()
-        print(f"Offers updated!")
-    except Corp.DoesNotExist as dne:
-        print(f"Creating new loyalty store entry...")
-        corp_name = post_ids_to_names(corp_id)[0]["name"]
-        new_store = Corp(
-            corp_name = corp_name, 
-            corp_id = corp_id, 
-            offers = get_loyalty_store_offers(corp_id)
-        )
-        new_store.save()
-        print(f"New entry for corp {corp_name} created!")
+        existing = {corp.corp_id: corp for corp in Corp.objects.filter(corp_id__in=offers.keys())}
+        new_ids = [corp_id for corp_id in offers if corp_id not in existing]
+        corp_names = {}
+        if new_ids:
+            print(f"Creating {len(new_ids)} new loyalty store entries...")
+            corp_names = resolve_ids_to_names(new_ids)
+
+        for corp_id, corp_store in existing.items():
+            corp_store.offers = offers[corp_id]
+        unresolved = [corp_id for corp_id in new_ids if corp_id not in corp_names]
+        if unresolved:
+            # Stores whose corp name cannot be resolved are skipped, instead of failing every other store
+            print(f"Skipping {len(unresolved)} loyalty stores with unresolved corp names: {unresolved}")
+            success = False
+        new_stores = [
+            Corp(corp_name = corp_names[corp_id], corp_id = corp_id, offers = offers[corp_id])
+            for corp_id in new_ids if corp_id in corp_names
+        ]
+        with transaction.atomic():
+            Corp.objects.bulk_update(existing.values(), ["offers"])
+            Corp.objects.bulk_create(new_stores)
+            offer_count = update_offer_tables([*existing.values(), *new_stores])
+        metrics.observe("lp_trader_refresh_duration_seconds", time.time() - start, refresh="stores")
+        metrics.inc("lp_trader_refresh_rows_total", len(existing), refresh="stores", operation="updated")
+        metrics.inc("lp_trader_refresh_rows_total", len(new_stores), refresh="stores", operation="created")
+        metrics.inc("lp_trader_refresh_rows_total", offer_count, refresh="offers", operation="created")
+        print(f"Offers updated for {len(existing)} stores, {len(new_stores)} new stores created!")
     except Exception as e:
         print(f"Exception {e}")
         return False
-    return True
+    rebuild_rankings()
+    return success
+
+
+def update_offer_tables(corps: list[Corp]) -> int:
+    """
+    Rebuilds the normalized Offer/OfferInput rows of a list of corps from their Corp.offers JSON.
+    Should be called inside the same transaction that saves the corps
+
+    Args:
+        corps (list[Corp]): The (saved) corps to rebuild offers for
+
+    Returns:
+        int: Number of offers written
+    """
+    Offer.objects.filter(corp__in=corps).delete()
+    offers, inputs = [], []
+    for corp in corps:
+        for offer_id, details in corp.offers.items():
+            offer = Offer(
+                corp = corp,
+                offer_id = int(offer_id),
+                lp_cost = details["lp_cost"],
+                isk_cost = details["isk_cost"],
+                type_id = details["received_items"]["type_id"],
+                quantity = details["received_items"]["quantity"]
+            )
+            offers.append(offer)
+            inputs.extend((offer, entry) for entry in details["required_items"])
+    Offer.objects.bulk_create(offers, batch_size=1000)
+    OfferInput.objects.bulk_create([
+        OfferInput(offer = offer, type_id = entry["type_id"], quantity = entry["quantity"]) for offer, entry in inputs
+    ], batch_size=1000)
+    return len(offers)
+
 
+def _get_sde_checksum(entry: dict) -> str:
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
-def update_sde() -> bool:
+
+def update_sde(batch_size: int = 2000, progress: ProgressReporter | None = None, offline: bool | None = None) -> bool:
     """
     Update the static database using the Fuzzworks' SDE library.
     Price data should not be populated together with the SDE as it will take quite a long time
     using the get_item_prices() endpoint function
 
+    The sync is incremental: rows streamed from the SDE dump are diffed against the current items by typeID and
+    a checksum of the row, and only new, changed or removed items are written (with batched bulk operations).
+    Existing market prices are kept. All changes are applied in a single transaction, so readers switch
+    from the old to the new data atomically
+
+    In offline mode the rows are read from the local SDE dump (settings.SDE_SNAPSHOT_PATH, the bundled data.json
+    by default) through its binary cache, without any network access. Prices are not refreshed in offline mode
+
     Args:
-        None
+        batch_size (int): Number of rows to write per query
+        progress (ProgressReporter): Reporter to publish progress to
+        offline (bool): Load the SDE from the local dump. Defaults to settings.SDE_OFFLINE
 
     Returns:
         bool
     """
+    progress = progress or ProgressReporter()
+    if offline is None:
+        offline = getattr(settings, "SDE_OFFLINE", False)
+    records = offline_sde.stream_static_data() if offline else stream_static_data()
+    print("Obtaining new data and updating database...")
+    start = time.time()
+    current = {item_id: (pk, checksum) for pk, item_id, checksum in Item.objects.values_list("id", "item_id", "checksum")}
+    # The size of the current SDE is a good estimate for the size of the new one
+    progress.start("sde import", total=len(current) or None)
+    seen = set()
+    created, updated, rows = 0, 0, 0
     try:
-        print("Clearing current database...")
-        Item.objects.all().delete() # Try to delete all the items in the Item model
-        print("Database cleared!")
-    except Exception as e:
-        # Do nothing
-        pass
+        with transaction.atomic():
+            last_updated = timezone.now()
+            to_create, to_update = [], []
+            for entry in records:
+                rows += 1
+                progress.advance()
+                item_id, checksum = int(entry["typeID"]), _get_sde_checksum(entry)
+                seen.add(item_id)
+                if item_id not in current:
+                    to_create.append(Item(
+                        item_name = entry["typeName"],
+                        item_id = item_id,
+                        checksum = checksum,
+                        market_price = {},
+                        last_updated = last_updated
+                    ))
+                elif current[item_id][1] != checksum:
+                    to_update.append(Item(
+                        id = current[item_id][0],
+                        item_name = entry["typeName"],
+                        checksum = checksum
+                    ))
 
-    data = get_static_data()
-    print("New data obtained, updating database with new data...")
+                if len(to_create) >= batch_size:
+                    Item.objects.bulk_create(to_create, batch_size=batch_size)
+                    created += len(to_create)
+                    to_create = []
+                if len(to_update) >= batch_size:
+                    Item.objects.bulk_update(to_update, ["item_name", "checksum"], batch_size=batch_size)
+                    updated += len(to_update)
+                    to_update = []
+            Item.objects.bulk_create(to_create, batch_size=batch_size)
+            Item.objects.bulk_update(to_update, ["item_name", "checksum"], batch_size=batch_size)
+            created += len(to_create)
+            updated += len(to_update)
 
-    try:
-        for entry in tqdm(data):
-            new_item = Item(
-                item_name = entry["typeName"],
-                item_id = entry["typeID"],
-                market_price = {},
-                last_updated = timezone.now()
-            )
-            new_item.save()
-        print("All items updated!")
+            to_delete = [pk for item_id, (pk, _) in current.items() if item_id not in seen]
+            for i in range(0, len(to_delete), batch_size):
+                Item.objects.filter(id__in=to_delete[i:i + batch_size]).delete()
+        progress.finish()
+        runtime = time.time() - start
+        metrics.observe("lp_trader_refresh_duration_seconds", runtime, refresh="sde")
+        metrics.inc("lp_trader_refresh_rows_total", created, refresh="sde", operation="created")
+        metrics.inc("lp_trader_refresh_rows_total", updated, refresh="sde", operation="updated")
+        metrics.inc("lp_trader_refresh_rows_total", len(to_delete), refresh="sde", operation="deleted")
+        print(f"All items updated! ({created} created, {updated} updated, {len(to_delete)} deleted)")
+        print(f"{rows} rows synced in {runtime:.2f}s ({rows / max(runtime, 1e-9):.0f} rows/s)")
     except Exception as e:
         print(f"Exception thrown: {e}")
         raise e
-    update_sde_prices()
+    finally:
+        price_index.invalidate()
+    # Prices always come from the network, so offline loads keep the existing prices
+    if not offline:
+        update_sde_prices(progress=progress)
     return True
 
 
@@ -153,47 +366,209 @@ def update_sde_blueprints() -> bool:
     Update the SDE for blueprints specifically using the Fuzzworks SDE library
     Has to be done separately to update_sde as blueprints do not have a marketTypeID, and will be filtered out by the SDE data endpoint
 
+    Materials and products of every blueprint are grouped in memory, and all Blueprint rows are replaced in a single transaction
+
     Args:
         None
     
     Returns:
         bool
     """
+    start = time.time()
     bp_static_data = get_blueprint_static_data()
+    bp_product_data = get_blueprint_product_static_data()
     print("Writing BP data to DB...")
-    for entry in tqdm(bp_static_data):
-        try:
-            blueprint = Blueprint.objects.filter(item_name=entry["typeID"])[0]
-            blueprint.input_materials[entry["materialTypeID"]] = entry["quantity"]
-            blueprint.save()
-        except Blueprint.DoesNotExist as dne:
-            new_blueprint = Blueprint(
-                item_id
-            )
 
+    materials = {}
+    for entry in bp_static_data:
+        materials.setdefault(int(entry["typeID"]), {})[str(int(entry["materialTypeID"]))] = int(entry["quantity"])
+    products = {int(entry["typeID"]): (int(entry["productTypeID"]), int(entry["quantity"])) for entry in bp_product_data}
+    item_names = dict(Item.objects.filter(item_id__in=materials.keys()).values_list("item_id", "item_name"))
+
+    blueprints = []
+    for bp_id, input_materials in materials.items():
+        product_id, product_quantity = products.get(bp_id, (None, 1))
+        blueprints.append(Blueprint(
+            item_name = item_names.get(bp_id, f"Blueprint {bp_id}"),
+            item_id = bp_id,
+            product_id = product_id,
+            product_quantity = product_quantity,
+            input_materials = input_materials
+        ))
+    with transaction.atomic():
+        Blueprint.objects.all().delete()
+        Blueprint.objects.bulk_create(blueprints, batch_size=1000)
+    build_cost_engine.load()
+    metrics.observe("lp_trader_refresh_duration_seconds", time.time() - start, refresh="blueprints")
+    metrics.inc("lp_trader_refresh_rows_total", len(blueprints), refresh="blueprints", operation="created")
+    print(f"{len(blueprints)} blueprints updated!")
+    return True
+
+
+def _write_item_prices(items: list[Item]):
+    """
+    Writes the market_price, hub_prices and last_updated fields of a list of items back to the DB.
+
+    bulk_update() builds a CASE/WHEN expression per row and field, which made it dominate price refreshes
+    (about 7s per 10k rows). A single parameterised UPDATE run through executemany() keeps the write linear
+    and cheap, so refreshes stay bound by network throughput
+
+    Args:
+        items (list[Item]): The items to write
+
+    Returns:
+        None
+    """
+    fields = [Item._meta.get_field(name) for name in ["market_price", "hub_prices", "last_updated"]]
+    quote = connection.ops.quote_name
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote(Item._meta.db_table),
+        ", ".join(f"{quote(field.column)} = %s" for field in fields),
+        quote(Item._meta.pk.column)
+    )
+    params = [
+        [field.get_db_prep_save(getattr(item, field.attname), connection) for field in fields] + [item.pk]
+        for item in items
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def update_sde_prices(
+    max_workers: int = 8,
+    chunk_size: int = 1000,
+    progress: ProgressReporter | None = None,
+    type_ids: list[int] | None = None
+) -> dict:
+    """
+    Update the internal pricings for items using the get_item_prices endpoint, in every market hub of
+    settings.MARKET_HUBS. Max. 5000 items per request
+
+    Chunks of every hub are fetched concurrently over the pooled endpoint session, and all prices are written back
+    with a single executemany() in one transaction (see _write_item_prices()). Item.market_price keeps the prices of the primary (first) hub,
+    and Item.hub_prices the prices of every hub. A chunk that fails is skipped, and its items keep their last
+    prices in that hub
+
+    A full refresh rebuilds the Ranking table. A partial refresh (of only some type IDs, e.g. the inputs used by
+    the most offers) only re-ranks the offers affected by the prices that changed, and is not added to the price
+    history, as a snapshot of a few items would skew the rolling prices of the rest
+
+    Args:
+        max_workers (int): Max. number of concurrent price requests
+        chunk_size (int): Number of items to query per request
+        progress (ProgressReporter): Reporter to publish progress to
+        type_ids (list[int]): Only refresh the prices of these type IDs. Defaults to every item
 
-def update_sde_prices() -> bool:
+    Returns:
+        A dictionary of primary hub prices keyed by type ID, in the format returned by get_item_prices()
     """
-    Update the internal pricings for items using the get_item_prices endpoint.
-    Max. 5000 items per request
+    queryset = Item.objects.only("id", "item_id", "market_price", "hub_prices")
+    if type_ids is not None:
+        queryset = queryset.filter(item_id__in=type_ids)
+    items = {}
+    for item in queryset:
+        items.setdefault(item.item_id, item)
+    item_ids = list(items.keys())
+    hubs = get_market_hubs()
+    primary_hub = next(iter(hubs))
+    request_inputs = [
+        (hub, item_ids[i:i + chunk_size]) for hub in hubs for i in range(0, len(item_ids), chunk_size)
+    ]
+
+    progress = progress or ProgressReporter()
+    print(f"Querying for data ({len(request_inputs)} chunks across {len(hubs)} hubs)... ")
+    progress.start("price fetch", total=len(item_ids) * len(hubs))
+    start = time.time()
+    res_by_hub = {hub: {} for hub in hubs}
+    failed, failed_chunks = set(), 0 # (hub, type ID) pairs of failed chunks
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(get_item_prices, item_list, regionId=hubs[hub]): (hub, item_list)
+            for hub, item_list in request_inputs
+        }
+        for future in as_completed(futures):
+            hub, item_list = futures[future]
+            try:
+                _, chunk_res = future.result()
+            except Exception as e:
+                # Skip the chunk, so the prices of every other chunk are still written
+                print(f"Exception {e} (price chunk of {len(item_list)} items in {hub})")
+                failed.update((hub, type_id) for type_id in item_list)
+                failed_chunks += 1
+                continue
+            finally:
+                progress.advance(len(item_list))
+            res_by_hub[hub].update(chunk_res)
+    progress.finish()
+    end = time.time()
+    print(f"Data queried successfully! (runtime: {end - start}, {failed_chunks} failed chunks)")
+
+    res = res_by_hub[primary_hub]
+    last_updated = timezone.now()
+    to_update, changed = [], []
+    for type_id, item in items.items():
+        hub_prices = {
+            hub: hub_res[str(type_id)] for hub, hub_res in res_by_hub.items() if str(type_id) in hub_res
+        }
+        if not hub_prices:
+            continue
+        # Hubs whose chunk failed keep their last price of the item
+        hub_prices.update({
+            hub: price for hub, price in item.hub_prices.items() if (hub, type_id) in failed and hub not in hub_prices
+        })
+        if hub_prices != item.hub_prices:
+            changed.append(type_id)
+        # Items missing from the primary hub keep their last primary price
+        item.market_price = res.get(str(type_id), item.market_price)
+        item.hub_prices = hub_prices
+        item.last_updated = last_updated
+        to_update.append(item)
+    _write_item_prices(to_update)
+    metrics.observe("lp_trader_refresh_duration_seconds", time.time() - start, refresh="prices")
+    metrics.inc("lp_trader_refresh_rows_total", len(to_update), refresh="prices", operation="updated")
+    print(f"Prices updated for {len(to_update)} items!")
+    price_index.update(res)
+    hub_price_matrix.update({item.item_id: item.hub_prices for item in to_update})
+    if type_ids is None:
+        price_history.append(res, timestamp=last_updated.timestamp())
+        rebuild_rankings()
+    else:
+        update_rankings(changed)
+
+    return res
+
+
+def update_order_books(max_workers: int = 8, progress: ProgressReporter | None = None) -> dict:
     """
+    Fetch the full order book of the region of every market hub in settings.MARKET_HUB_REGIONS, and save the orders
+    in each hub's solar system as sorted cumulative-depth arrays for depth-aware pricing. Pages are streamed and
+    reduced to arrays as they arrive, so a regional order book is never held in memory as JSON
+
+    Args:
+        max_workers (int): Max. number of concurrent page requests
+        progress (ProgressReporter): Reporter to publish progress to
 
-    request_inputs = []
-    items = Item.objects.all()
-    queryset_len = len(items)
-    request_inputs = np.array_split(items, math.ceil(queryset_len / 1000))
-    for item_list in request_inputs:
-        item_inputs = [n.item_id for n in item_list]
-        print("Querying for data... ")
-        start = time.time()
-        _, res = get_item_prices(item_inputs)
-        end = time.time()
-        print(f"Data queried successfully! (runtime: {end - start})")
+    Returns:
+        A dictionary of the number of orders kept per hub
+    """
+    hubs = get_market_hubs()
+    regions = getattr(settings, "MARKET_HUB_REGIONS", {"Jita": 10000002})
+    hubs = {hub: system_id for hub, system_id in hubs.items() if hub in regions}
 
-        for key, value in res.items():
-            item = Item.objects.filter(item_id=key)[0]
-            item.market_price = value
-            item.last_updated = timezone.now()
-            item.save()
+    progress = progress or ProgressReporter()
+    progress.start("order book fetch", total=len(hubs))
+    start = time.time()
+    res = {}
+    for hub, system_id in hubs.items():
+        print(f"Fetching {hub} order book...")
+        book = OrderBook.from_orders(stream_market_orders(regions[hub], max_workers=max_workers), system_id=system_id)
+        order_books.save(hub, book)
+        res[hub] = sum(len(book.sides[side]["prices"]) for side in ORDER_SIDES)
+        print(f"{res[hub]} {hub} orders saved!")
+        progress.advance()
+    progress.finish()
+    metrics.observe("lp_trader_refresh_duration_seconds", time.time() - start, refresh="orders")
+    metrics.inc("lp_trader_refresh_rows_total", sum(res.values()), refresh="orders", operation="updated")
+    rebuild_rankings()
 
-    return res
\ No newline at end of file
+    return res
@@ -1,12 +1,67 @@
 from django.conf import settings
-from esi.clients import EsiClientProvider
+from esi.clients import CachingHttpFuture, EsiClientProvider
 from esi.models import Token
+from esi import app_settings as esi_settings
 from typing import *
 
+from .cache import *
+from .tokens import *
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import csv
+import functools
+import io
 import pandas as pd
 import requests
 
-esi = EsiClientProvider(app_info_text="lp-trader v0.0")
+
+class SchedulerRetryHttpFuture(CachingHttpFuture):
+    """
+    CachingHttpFuture which never retries server errors itself. The CachingHTTPAdapter's scheduler already retries
+    them with backoff, and retrying in both layers would multiply the requests (and error budget) spent per call
+    """
+    def _result_with_retries(self, **kwargs):
+        kwargs["retries"] = 0
+        return super()._result_with_retries(**kwargs)
+
+
+def _request_without_client_retries(request: Callable, *args, **kwargs) -> SchedulerRetryHttpFuture:
+    future = request(*args, **kwargs)
+    return SchedulerRetryHttpFuture(future.future, future.response_adapter, future.operation, future.request_config)
+
+
+class CachingEsiClientProvider(EsiClientProvider):
+    """
+    EsiClientProvider which mounts a CachingHTTPAdapter on the ESI client's session, so that expired ESI responses
+    are revalidated with their ETag instead of being downloaded again. Requests return SchedulerRetryHttpFutures,
+    so server errors are only retried by the adapter's scheduler, whatever ESI_SERVER_ERROR_MAX_RETRIES is set to
+    """
+    @property
+    def client(self):
+        if self._client is None:
+            client = super().client
+            http_client = client.swagger_spec.http_client
+            adapter = CachingHTTPAdapter(
+                pool_maxsize=esi_settings.ESI_CONNECTION_POOL_MAXSIZE,
+                max_retries=esi_settings.ESI_CONNECTION_ERROR_MAX_RETRIES
+            )
+            http_client.session.mount("https://", adapter)
+            http_client.session.mount("http://", adapter)
+            http_client.request = functools.partial(_request_without_client_retries, http_client.request)
+        return self._client
+
+
+esi = CachingEsiClientProvider(app_info_text="lp-trader v0.0")
+
+# Pooled HTTP session for the non-ESI endpoints, sized so that concurrent price fetches can reuse connections
+session = requests.Session()
+session.mount("https://", CachingHTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("http://", CachingHTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Base URLs of the Fuzzworks SDE dumps and market aggregates, which can be pointed at the stand-in server for load tests
+FUZZWORK_DUMP_URL = getattr(settings, "FUZZWORK_DUMP_URL", "https://www.fuzzwork.co.uk/dump/latest").rstrip("/")
+FUZZWORK_MARKET_URL = getattr(settings, "FUZZWORK_MARKET_URL", "https://market.fuzzwork.co.uk").rstrip("/")
 
 """
 Try to use these endpoint functions sparingly, as they take a while to run and can be
@@ -66,17 +121,23 @@ def get_loyalty_points(token: Token, raw: bool = True) -> dict:
         A dictionary of LP type (in ID/text form) and quantity
     """
     def reparse_data(op):
-        new = {}
-        for entry in op:
-            lp_type, lp_quantity = entry.values()
-            corp_name = post_ids_to_names(lp_type)[0]["name"]
-            new[corp_name] = lp_quantity
-        return new
+        # Imported here, as the name cache is built on top of these endpoints
+        from .names import resolve_ids_to_names
+        try:
+            corp_names = resolve_ids_to_names([entry["corporation_id"] for entry in op]) if op else {}
+        except Exception as e:
+            print(f"Exception {e} while resolving loyalty point corp names")
+            corp_names = {}
+        unresolved = [entry["corporation_id"] for entry in op if entry["corporation_id"] not in corp_names]
+        if unresolved:
+            # Keyed by the raw corp ID instead, so one unresolved name does not fail the whole lookup
+            print(f"Corp names of {len(unresolved)} loyalty point entries not resolved: {unresolved}")
+        return {corp_names.get(entry["corporation_id"], entry["corporation_id"]): entry["loyalty_points"] for entry in op}
     
     character_id = token.character_id
     op = esi.client.Loyalty.get_characters_character_id_loyalty_points(
         character_id = character_id,
-        token = token.valid_access_token()
+        token = get_access_token(token)
     ).results()
     if not raw:
         op = reparse_data(op)
@@ -97,7 +158,7 @@ def get_corporation_divisions(token: Token, corp_id: int = 98750824) -> list[dic
     """
     op = esi.client.Corporation.get_corporations_corporation_id_divisions(
         corporation_id = corp_id,
-        token = token.valid_access_token()
+        token = get_access_token(token)
     ).results()
     hangar, wallet = op["hangar"], op["wallet"]
     return hangar, wallet
@@ -115,7 +176,7 @@ def get_corporation_wallet_balance(token: Token, corp_id: int = 98750824) -> dic
     """
     op = esi.client.Wallet.get_corporations_corporation_id_wallets(
         corporation_id = corp_id,
-        token = token.valid_access_token()
+        token = get_access_token(token)
     ).results()
     return op
 
@@ -168,6 +229,62 @@ def get_loyalty_store_offers(corp_id: int) -> dict:
         }
     return res
 
+def _get_market_orders_page(region_id: int, page: int, order_type: str = "all", type_id: int | None = None) -> Tuple[list[dict], int]:
+    operation = esi.client.Market.get_markets_region_id_orders(
+        region_id = region_id,
+        order_type = order_type,
+        page = page,
+        **({"type_id": type_id} if type_id is not None else {})
+    )
+    operation.request_config.also_return_response = True
+    orders, response = operation.result()
+    return orders, int(response.headers.get("X-Pages", 1))
+
+def stream_market_orders(
+    region_id: int,
+    order_type: str = "all",
+    type_id: int | None = None,
+    max_workers: int = 8
+) -> Iterator[list[dict]]:
+    """
+    Streams the order book of a region from ESI page by page (max. 1000 orders per page), so that a full
+    regional order book never has to be held in memory as JSON. The first page is fetched on its own to learn
+    the number of pages, and the remaining pages are then fetched concurrently and yielded as they complete
+
+    Args:
+        region_id (int): The region to fetch orders for, e.g. 10000002 (The Forge)
+        order_type (str): "buy", "sell" or "all"
+        type_id (int): Only fetch orders of this type ID
+        max_workers (int): Max. number of concurrent page requests
+
+    Yields:
+        list[dict] of orders
+
+        Sample order:
+        {
+            "order_id": 6739238516,
+            "type_id": 34,
+            "is_buy_order": False,
+            "price": 4.95,
+            "volume_remain": 1000000,
+            "system_id": 30000142,
+            "location_id": 60003760,
+            ...
+        }
+    """
+    orders, total_pages = _get_market_orders_page(region_id, 1, order_type, type_id)
+    yield orders
+    if total_pages <= 1:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_get_market_orders_page, region_id, page, order_type, type_id)
+            for page in range(2, total_pages + 1)
+        ]
+        for future in as_completed(futures):
+            orders, _ = future.result()
+            yield orders
+
 def get_character_wallet_balance(token: Token, char_id: int) -> dict:
     """
     Returns the wallet balance of a character
@@ -181,11 +298,23 @@ def get_character_wallet_balance(token: Token, char_id: int) -> dict:
     """
     op = esi.client.Wallet.get_characters_character_id_wallet(
         character_id = char_id,
-        token = token.valid_access_token()
+        token = get_access_token(token)
     ).results()
     return op
 
 
+def _parse_static_data(file: BinaryIO) -> Iterator[dict]:
+    # csv.reader rather than line splitting, as descriptions contain quoted line breaks
+    for row in csv.DictReader(io.TextIOWrapper(file, encoding="utf-8", newline="")):
+        if row["published"] in ("0", "False"):
+            continue
+        yield {"typeID": int(row["typeID"]), "groupID": int(row["groupID"]), "typeName": row["typeName"]}
+
+def _parse_blueprint_static_data(response: requests.Response) -> list[dict]:
+    data = pd.read_csv(io.BytesIO(response.content))
+    data.drop(data[data["activityID"] != 1].index, inplace=True)
+    return data.to_dict(orient="records")
+
 def get_static_data() -> list[dict]:
     """
     Returns the latest static data from Fuzzworks
@@ -196,12 +325,25 @@ def get_static_data() -> list[dict]:
     Returns:
         A list object
     """
-    data = pd.read_csv("https://www.fuzzwork.co.uk/dump/latest/invTypes.csv")
-    data.drop(data[data["published"] == False].index, inplace=True)
-    #data = data[data["typeName"].str.contains("SKIN") == False]
-    to_exclude = ["description","mass","volume","capacity","portionSize","raceID","basePrice","published","marketGroupID","iconID","soundID","graphicID"]
-    data.drop(labels=to_exclude, inplace=True, axis=1)
-    return data.to_dict(orient="records")
+    return list(stream_static_data())
+
+def stream_static_data() -> Iterator[dict]:
+    """
+    Streams the latest static data from Fuzzworks row by row. The dump is kept on disk by the HTTP cache and
+    parsed from there as it is read, so the whole table is never held in memory
+
+    Args:
+        None
+
+    Returns:
+        An iterator of dict rows
+    """
+    with session.get(f"{FUZZWORK_DUMP_URL}/invTypes.csv", stream=True) as response:
+        response.raise_for_status()
+        if hasattr(response.raw, "decode_content"):
+            # Not stored by the cache (e.g. Vary: *), so the body is read from the connection and must be decoded
+            response.raw.decode_content = True
+        yield from _parse_static_data(response.raw)
 
 def get_blueprint_static_data() -> list[dict]:
     """
@@ -213,9 +355,21 @@ def get_blueprint_static_data() -> list[dict]:
     Returns:
         A list object
     """
-    data = pd.read_csv("https://www.fuzzwork.co.uk/dump/latest/industryActivityMaterials.csv")
-    data.drop(data[data["activityID"] != 1].index, inplace=True)
-    return data.to_dict(orient="records")
+    _, records = fetch(session, f"{FUZZWORK_DUMP_URL}/industryActivityMaterials.csv", parse=_parse_blueprint_static_data)
+    return records
+
+def get_blueprint_product_static_data() -> list[dict]:
+    """
+    Returns the latest blueprint manufacturing products from Fuzzworks
+
+    Args:
+        None
+
+    Returns:
+        A list object
+    """
+    _, records = fetch(session, f"{FUZZWORK_DUMP_URL}/industryActivityProducts.csv", parse=_parse_blueprint_static_data)
+    return records
 
 def get_blueprint_build_cost(bp_ids: int | list[int]):
     """
@@ -242,7 +396,7 @@ def get_blueprint_build_cost(bp_ids: int | list[int]):
         "facilityTax": 0,
         "industryStructureType": "Station"
     }
-    req = requests.get(target, params=params)
+    req = session.get(target, params=params)
     statcode, body = req.status_code, req.json()
     return statcode, body
 
@@ -269,15 +423,16 @@ def get_item_prices(typeIds: list[int] = [44992], regionId: int = 30000142) -> T
         }
     """
     typeIds_parsed = typeIds if len(typeIds) == 1 else ",".join(list(map(str, typeIds)))
-    target = "https://market.fuzzwork.co.uk/aggregates/"
+    target = f"{FUZZWORK_MARKET_URL}/aggregates/"
     params = {
         'region': regionId,
         'types': typeIds_parsed
     }
-    req = requests.get(target, params=params)
-    statcode, body = req.status_code, req.json()
+    return fetch(session, target, params=params, parse=_parse_item_prices)
+
+def _parse_item_prices(response: requests.Response) -> dict:
     res = {}
-    for key, value in body.items():
+    for key, value in response.json().items():
         buy, sell = float(value["buy"]["max"]), float(value["sell"]["min"])
         split = (buy + sell) / 2
         new_item = {
@@ -286,4 +441,4 @@ def get_item_prices(typeIds: list[int] = [44992], regionId: int = 30000142) -> T
             "sell": sell
         }
         res[key] = new_item
-    return statcode, res
\ No newline at end of file
+    return res
\ No newline at end of file
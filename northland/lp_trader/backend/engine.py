@@ -0,0 +1,544 @@
+from typing import *
+
+from ..models import *
+from .history import *
+from .industry import *
+from .orderbook import *
+from .prices import *
+
+import numpy as np
+
+
+class OfferRecord(NamedTuple):
+    """
+    A single evaluated LP store offer, as returned by OfferEngine.top_k()
+    """
+    corp_id: int
+    corp_name: str
+    offer_id: int
+    type_id: int
+    quantity: int
+    lp_cost: int
+    isk_cost: float
+    input_cost: float
+    profit: float
+    isk_per_lp: float
+
+
+class OfferEngine():
+    """
+    Vectorized ISK/LP evaluator for the LP store offers of every corp.
+
+    compile() flattens every Corp.offers JSON blob into NumPy arrays (one entry per offer), with the
+    required inputs of each offer stored as a sparse CSR matrix (offers x item types). evaluate() can then
+    calculate the ISK/LP rate of every offer in the universe from a single price vector in one batched operation.
+
+    Offer arrays:
+        offer_corp: Index of the offer's corp into corp_ids/corp_names/exchange_rates
+        offer_ids: The LP store offer ID
+        lp_cost, isk_cost: The LP and ISK cost of the offer
+        received_type, received_qty: Index into type_ids of the received item, and its quantity
+        inputs_indptr, inputs_indices, inputs_data: CSR matrix of required inputs (index into type_ids, quantity)
+
+    Reverse index:
+        dependents_indptr, dependents_rows: CSR index from every type_ids column to the offers that consume or
+            produce it, so that a price change only has to re-evaluate the offers it affects
+
+    Functions:
+        compile(corps): Compile the offers of a list of corps (defaults to all corps)
+        get_dependent_offers(type_ids): Returns the offers that consume or produce any of the items
+        get_input_usage(): Returns the number of offers consuming each item
+        subset(rows): Returns an engine holding only some of the compiled offers
+        build_price_vector(index, price_type): Returns a price vector aligned to type_ids
+        build_smoothed_price_vector(history, window, method): Returns a price vector of rolling mean/median prices
+        build_hub_price_vectors(matrix, price_type): Returns the cheapest input prices and best received item prices across hubs
+        evaluate(prices): Returns the ISK/LP rate of every compiled offer
+        get_depth_costs(books, ...): Returns input costs and profits filled against the order books of every hub,
+            and which offers cannot be filled
+        evaluate_depth(books, ...): Returns the ISK/LP rate of every compiled offer at order book execution prices
+        rank_per_corp(isk_per_lp, limit): Returns the best offers of each corp
+        top_k(prices, k, ...): Returns the k best offers across all corps, with optional filters
+    """
+    def __init__(self):
+        self.corp_ids = np.empty(0, dtype=np.int64)
+        self.corp_names = []
+        self.exchange_rates = np.empty(0, dtype=np.float64)
+        self.type_ids = np.empty(0, dtype=np.int64)
+
+        self.offer_corp = np.empty(0, dtype=np.int64)
+        self.offer_ids = np.empty(0, dtype=np.int64)
+        self.lp_cost = np.empty(0, dtype=np.float64)
+        self.isk_cost = np.empty(0, dtype=np.float64)
+        self.received_type = np.empty(0, dtype=np.int64)
+        self.received_qty = np.empty(0, dtype=np.float64)
+
+        self.inputs_indptr = np.zeros(1, dtype=np.int64)
+        self.inputs_indices = np.empty(0, dtype=np.int64)
+        self.inputs_data = np.empty(0, dtype=np.float64)
+
+        self.dependents_indptr = np.zeros(1, dtype=np.int64)
+        self.dependents_rows = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offer_ids)
+
+    def compile(self, corps: list[Corp] | None = None):
+        """
+        Compile the LP store offers of a list of corps into NumPy arrays
+
+        Args:
+            corps (list[Corp]): The corps to compile offers for. Defaults to all corps in the DB
+
+        Returns:
+            OfferEngine (self)
+        """
+        if corps is None:
+            corps = Corp.objects.all()
+
+        corp_ids, corp_names, exchange_rates = [], [], []
+        offer_corp, offer_ids, lp_cost, isk_cost, received_type, received_qty = [], [], [], [], [], []
+        inputs_indptr, inputs_type, inputs_data = [0], [], []
+
+        for corp_index, corp in enumerate(corps):
+            corp_ids.append(corp.corp_id)
+            corp_names.append(corp.corp_name)
+            exchange_rates.append(corp.lp_exchange_rate)
+            for offer_id, details in corp.offers.items():
+                offer_corp.append(corp_index)
+                offer_ids.append(int(offer_id))
+                lp_cost.append(details["lp_cost"])
+                isk_cost.append(details["isk_cost"])
+                received_type.append(details["received_items"]["type_id"])
+                received_qty.append(details["received_items"]["quantity"])
+                for input_item in details["required_items"]:
+                    inputs_type.append(input_item["type_id"])
+                    inputs_data.append(input_item["quantity"])
+                inputs_indptr.append(len(inputs_type))
+
+        self.corp_ids = np.array(corp_ids, dtype=np.int64)
+        self.corp_names = corp_names
+        self.exchange_rates = np.array(exchange_rates, dtype=np.float64)
+
+        self.offer_corp = np.array(offer_corp, dtype=np.int64)
+        self.offer_ids = np.array(offer_ids, dtype=np.int64)
+        self.lp_cost = np.array(lp_cost, dtype=np.float64)
+        self.isk_cost = np.array(isk_cost, dtype=np.float64)
+        self.received_qty = np.array(received_qty, dtype=np.float64)
+        self.inputs_indptr = np.array(inputs_indptr, dtype=np.int64)
+        self.inputs_data = np.array(inputs_data, dtype=np.float64)
+
+        # Map every type ID onto a dense column index, so prices can be passed around as a flat vector
+        received_type = np.array(received_type, dtype=np.int64)
+        inputs_type = np.array(inputs_type, dtype=np.int64)
+        self.type_ids = np.unique(np.concatenate([received_type, inputs_type]))
+        self.received_type = np.searchsorted(self.type_ids, received_type)
+        self.inputs_indices = np.searchsorted(self.type_ids, inputs_type)
+        self._build_dependents()
+        return self
+
+    def _build_dependents(self):
+        input_rows = np.repeat(np.arange(len(self)), np.diff(self.inputs_indptr))
+        columns = np.concatenate([self.received_type, self.inputs_indices])
+        rows = np.concatenate([np.arange(len(self)), input_rows])
+        order = np.lexsort((rows, columns))
+        columns, rows = columns[order], rows[order]
+        # An offer consuming the same item twice (or consuming what it produces) is only listed once
+        unique = np.ones(len(rows), dtype=bool)
+        unique[1:] = (columns[1:] != columns[:-1]) | (rows[1:] != rows[:-1])
+        columns, rows = columns[unique], rows[unique]
+        self.dependents_indptr = np.searchsorted(columns, np.arange(len(self.type_ids) + 1)).astype(np.int64)
+        self.dependents_rows = rows.astype(np.int64)
+
+    def get_dependent_offers(self, type_ids: Iterable[int]) -> np.ndarray:
+        """
+        Returns the offers that consume or produce any of the items, using the reverse index instead of a scan
+        over every offer
+
+        Args:
+            type_ids (Iterable[int]): The type IDs of the items
+
+        Returns:
+            np.ndarray of sorted offer rows (indices into offer_ids)
+        """
+        type_ids = np.unique(np.fromiter((int(type_id) for type_id in type_ids), dtype=np.int64))
+        columns = np.searchsorted(self.type_ids, type_ids)
+        found = columns < len(self.type_ids)
+        found[found] = self.type_ids[columns[found]] == type_ids[found]
+        columns = columns[found]
+
+        starts = self.dependents_indptr[columns]
+        counts = self.dependents_indptr[columns + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        entries = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        return np.unique(self.dependents_rows[entries])
+
+    def get_input_usage(self) -> np.ndarray:
+        """
+        Returns the number of offers consuming each item as a required input
+
+        Returns:
+            np.ndarray aligned to type_ids
+        """
+        return np.bincount(self.inputs_indices, minlength=len(self.type_ids))
+
+    def subset(self, rows: np.ndarray) -> "OfferEngine":
+        """
+        Returns an engine holding only some of the compiled offers, sharing the corps and type_ids of this engine
+        so that the same price vectors can be used to evaluate it
+
+        Args:
+            rows (np.ndarray): The offer rows (indices into offer_ids) to keep
+
+        Returns:
+            OfferEngine
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        subset = OfferEngine()
+        subset.corp_ids, subset.corp_names, subset.exchange_rates = self.corp_ids, self.corp_names, self.exchange_rates
+        subset.type_ids = self.type_ids
+        for name in ["offer_corp", "offer_ids", "lp_cost", "isk_cost", "received_type", "received_qty"]:
+            setattr(subset, name, getattr(self, name)[rows])
+
+        counts = np.diff(self.inputs_indptr)[rows]
+        subset.inputs_indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        entries = np.repeat(self.inputs_indptr[rows] - subset.inputs_indptr[:-1], counts) + np.arange(subset.inputs_indptr[-1])
+        subset.inputs_indices = self.inputs_indices[entries]
+        subset.inputs_data = self.inputs_data[entries]
+        subset._build_dependents()
+        return subset
+
+    def build_price_vector(
+        self,
+        index: PriceIndex = price_index,
+        price_type: str = "sell",
+        blueprints: BuildCostEngine | None = None
+    ) -> np.ndarray:
+        """
+        Returns a price vector aligned to type_ids. Items that do not exist in the DB or have not been priced yet
+        (i.e. fresh from an SDE import) are set to NaN, unless they are blueprints that can be valued by a BuildCostEngine
+
+        Args:
+            index (PriceIndex): The price index to read prices from
+            price_type (str): The price to use, one of "buy", "split" or "sell"
+            blueprints (BuildCostEngine): If given, value blueprint copies at the profit of one manufacturing run
+
+        Returns:
+            np.ndarray
+        """
+        index.ensure_fresh()
+        prices = np.full(len(self.type_ids), np.nan)
+        missing = []
+        for column, type_id in enumerate(self.type_ids):
+            market_price = index.get(type_id)
+            price = None if market_price is None else market_price.get(price_type)
+            if price is not None:
+                prices[column] = price
+            else:
+                missing.append(column)
+
+        if blueprints is not None and missing:
+            def _get_price(type_id: int) -> float | None:
+                market_price = index.get(type_id)
+                return None if market_price is None else market_price.get(price_type)
+
+            bp_values = blueprints.get_blueprint_values(self.type_ids[missing], _get_price)
+            for column in missing:
+                value = bp_values.get(int(self.type_ids[column]))
+                if value is not None:
+                    prices[column] = value
+        return prices
+
+    def build_smoothed_price_vector(
+        self,
+        history: PriceHistory = price_history,
+        window: int = 24,
+        method: str = "median",
+        index: PriceIndex = price_index,
+        price_type: str = "sell",
+        blueprints: BuildCostEngine | None = None
+    ) -> np.ndarray:
+        """
+        Returns a price vector aligned to type_ids using the rolling mean/median of the price history, so that
+        short price spikes do not move the rankings. Items without history fall back to their current price,
+        and items that do not exist in the DB are set to NaN (unless they are blueprints valued by a BuildCostEngine)
+
+        Args:
+            history (PriceHistory): The price history to aggregate
+            window (int): Number of snapshots to aggregate
+            method (str): "mean" or "median"
+            index (PriceIndex): The price index to read current prices from
+            price_type (str): The price to use, one of "buy", "split" or "sell"
+            blueprints (BuildCostEngine): If given, value blueprint copies at the profit of one manufacturing run
+
+        Returns:
+            np.ndarray
+        """
+        prices = self.build_price_vector(index, price_type, blueprints)
+        history_ids, history_prices = history.get_rolling(price_type, window, method)
+        order = np.argsort(history_ids)
+        history_ids, history_prices = history_ids[order], history_prices[order]
+
+        positions = np.minimum(np.searchsorted(history_ids, self.type_ids), max(len(history_ids) - 1, 0))
+        has_history = np.zeros(len(self.type_ids), dtype=bool)
+        if len(history_ids):
+            has_history = (history_ids[positions] == self.type_ids) & ~np.isnan(history_prices[positions])
+        # Items missing from the DB stay NaN, even if they still have history
+        has_history &= ~np.isnan(prices)
+        prices[has_history] = history_prices[positions[has_history]]
+        return prices
+
+    def build_hub_price_vectors(
+        self,
+        matrix: HubPriceMatrix = hub_price_matrix,
+        price_type: str = "sell",
+        blueprints: BuildCostEngine | None = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns price vectors aligned to type_ids across every market hub: required inputs are priced at the cheapest
+        hub, and received items at the hub they sell best in. Items that are not priced in any hub are set to NaN,
+        unless they are blueprints that can be valued by a BuildCostEngine
+
+        Args:
+            matrix (HubPriceMatrix): The hub prices to read from
+            price_type (str): The price to use, one of "buy", "split" or "sell"
+            blueprints (BuildCostEngine): If given, value blueprint copies at the profit of one manufacturing run
+
+        Returns:
+            A tuple of the input price vector, the received item price vector and the index (into matrix.hubs)
+            of the hub each received item sells best in (-1 if it is not priced anywhere)
+        """
+        matrix.ensure_fresh()
+        hub_prices = matrix.get_prices(self.type_ids, price_type)
+        input_prices, _ = select_hub_prices(hub_prices, cheapest=True)
+        received_prices, received_hubs = select_hub_prices(hub_prices)
+
+        missing = np.flatnonzero(np.isnan(received_prices))
+        if blueprints is not None and len(missing):
+            bp_values = blueprints.get_blueprint_values(
+                self.type_ids[missing],
+                lambda type_id: matrix.get_best_price(type_id, price_type, cheapest=True)
+            )
+            for column in missing:
+                value = bp_values.get(int(self.type_ids[column]))
+                if value is not None:
+                    input_prices[column] = received_prices[column] = value
+        return input_prices, received_prices, received_hubs
+
+    def get_costs(self, prices: np.ndarray, received_prices: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate the input cost and received item value of every compiled offer. Items missing from the DB are
+        valued at 0, and a single missing input zeroes the input cost of the whole offer
+
+        Args:
+            prices (np.ndarray): Price vector aligned to type_ids (NaN for items missing from the DB)
+            received_prices (np.ndarray): Separate price vector for received items. Defaults to prices
+
+        Returns:
+            A tuple of input costs and profits, aligned to offer_ids
+        """
+        received_prices = np.trunc(prices if received_prices is None else received_prices)
+        prices = np.trunc(prices)
+
+        # Sparse (CSR) matrix-vector product of the required inputs against the price vector
+        input_costs = self._sum_input_costs(self.inputs_data * prices[self.inputs_indices])
+
+        received_prices = received_prices[self.received_type]
+        profits = self.received_qty * np.where(np.isnan(received_prices), 0, received_prices)
+        return input_costs, profits
+
+    def _sum_input_costs(self, entry_costs: np.ndarray) -> np.ndarray:
+        """
+        Sums the cost of every required input entry per offer. A single missing (NaN) input zeroes the input cost
+        of the whole offer
+        """
+        n_offers = len(self.offer_ids)
+        input_rows = np.repeat(np.arange(n_offers), np.diff(self.inputs_indptr))
+        input_missing = np.isnan(entry_costs)
+        input_costs = np.bincount(input_rows, weights=np.where(input_missing, 0, entry_costs), minlength=n_offers)
+        has_missing_input = np.bincount(input_rows, weights=input_missing, minlength=n_offers) > 0
+        input_costs[has_missing_input] = 0
+        return input_costs
+
+    def get_depth_costs(
+        self,
+        books: Sequence[OrderBook | None],
+        prices: np.ndarray,
+        received_prices: np.ndarray | None = None,
+        redemptions: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Calculate the input cost and received item value of every compiled offer at realistic execution prices:
+        required inputs are bought from the sell orders of the hub where filling them is cheapest, and received
+        items are sold into the buy orders of the hub that pays the most for them. Items without orders in any
+        hub fall back to their price in the price vectors. Items with orders, but not enough depth in any hub to
+        fill the whole quantity, make the offer unfillable
+
+        Args:
+            books (Sequence[OrderBook]): The order book of every hub (None for hubs without a book), aligned to
+                the hubs of the price vectors
+            prices (np.ndarray): Fallback price vector aligned to type_ids
+            received_prices (np.ndarray): Fallback price vector for received items. Defaults to prices
+            redemptions (int): Number of times each offer is redeemed. Fills are sized for all redemptions,
+                and costs are returned per redemption
+
+        Returns:
+            A tuple of input costs and profits (aligned to offer_ids), the index of the hub each received item
+            was sold in (-1 if it was valued from the fallback prices), and whether each offer is unfillable
+        """
+        received_prices = np.trunc(prices if received_prices is None else received_prices)
+        prices = np.trunc(prices)
+        input_types = self.type_ids[self.inputs_indices]
+        received_types = self.type_ids[self.received_type]
+        empty = lambda n: np.full(n, np.nan)
+
+        input_fills = np.array([
+            book.fill_costs(input_types, self.inputs_data * redemptions, "sell") if book else empty(len(input_types))
+            for book in books
+        ]).reshape(len(books), len(input_types))
+        entry_costs, _ = select_hub_prices(input_fills, cheapest=True)
+        short_inputs = np.isnan(entry_costs) & self._has_orders(books, input_types, "sell")
+        entry_costs = np.where(np.isnan(entry_costs), self.inputs_data * redemptions * prices[self.inputs_indices], entry_costs)
+        input_costs = self._sum_input_costs(entry_costs) / redemptions
+        input_rows = np.repeat(np.arange(len(self)), np.diff(self.inputs_indptr))
+        unfillable = np.bincount(input_rows, weights=short_inputs, minlength=len(self)) > 0
+
+        received_fills = np.array([
+            book.fill_costs(received_types, self.received_qty * redemptions, "buy") if book else empty(len(received_types))
+            for book in books
+        ]).reshape(len(books), len(received_types))
+        profits, received_hubs = select_hub_prices(received_fills)
+        unfillable |= np.isnan(profits) & self._has_orders(books, received_types, "buy")
+        fallback = self.received_qty * redemptions * received_prices[self.received_type]
+        profits = np.where(np.isnan(profits), np.where(np.isnan(fallback), 0, fallback), profits) / redemptions
+        return input_costs, profits, received_hubs, unfillable
+
+    @staticmethod
+    def _has_orders(books: Sequence[OrderBook | None], type_ids: np.ndarray, side: str) -> np.ndarray:
+        has_orders = np.zeros(len(type_ids), dtype=bool)
+        for book in books:
+            if book:
+                has_orders |= book.get_depth(type_ids, side) > 0
+        return has_orders
+
+    def evaluate(self, prices: np.ndarray, received_prices: np.ndarray | None = None) -> np.ndarray:
+        """
+        Calculate the ISK/LP rate of every compiled offer. Mirrors LPConverter.calculate_isk_per_lp:
+        offers with an LP cost of 0 are rated -1, and items missing from the DB are valued at 0
+        (a single missing input zeroes the input cost of the whole offer)
+
+        Args:
+            prices (np.ndarray): Price vector aligned to type_ids (NaN for items missing from the DB)
+            received_prices (np.ndarray): Separate price vector for received items. Defaults to prices
+
+        Returns:
+            np.ndarray of ISK/LP rates, aligned to offer_ids
+        """
+        input_costs, profits = self.get_costs(prices, received_prices)
+        return self._get_isk_per_lp(input_costs, profits)
+
+    def evaluate_depth(
+        self,
+        books: Sequence[OrderBook | None],
+        prices: np.ndarray,
+        received_prices: np.ndarray | None = None,
+        redemptions: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate the ISK/LP rate of every compiled offer at order book execution prices (see get_depth_costs()).
+        Unfillable offers are rated -1, like offers without an LP cost
+
+        Returns:
+            A tuple of ISK/LP rates and the index of the hub each received item was sold in, aligned to offer_ids
+        """
+        input_costs, profits, received_hubs, unfillable = self.get_depth_costs(books, prices, received_prices, redemptions)
+        isk_per_lp = self._get_isk_per_lp(input_costs, profits)
+        isk_per_lp[unfillable] = -1
+        return isk_per_lp, received_hubs
+
+    def _get_isk_per_lp(self, input_costs: np.ndarray, profits: np.ndarray) -> np.ndarray:
+        total_costs = input_costs + self.isk_cost
+        free_offers = self.lp_cost == 0
+        effective_lp = self.lp_cost / self.exchange_rates[self.offer_corp]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            isk_per_lp = (profits - total_costs) / effective_lp
+        isk_per_lp[free_offers] = -1
+        return isk_per_lp
+
+    def rank_per_corp(self, isk_per_lp: np.ndarray, limit: int | None = None) -> list[list[dict]]:
+        """
+        Returns the offers of each corp sorted by ISK/LP rate, in the same format as LPConverter.calculate_isk_per_lp
+
+        Args:
+            isk_per_lp (np.ndarray): ISK/LP rates returned by evaluate()
+            limit (int): Max. number of offers to return per corp
+
+        Returns:
+            A list (aligned to corp_ids) of lists of {offer_id: isk_per_lp} dicts
+        """
+        # Sort by corp, then by descending rate. Stable, so ties keep the original offer order
+        order = np.lexsort((-isk_per_lp, self.offer_corp))
+        bounds = np.searchsorted(self.offer_corp[order], np.arange(len(self.corp_ids) + 1))
+        ranked = []
+        for corp_index in range(len(self.corp_ids)):
+            rows = order[bounds[corp_index]:bounds[corp_index + 1]][:limit]
+            ranked.append([{str(self.offer_ids[row]): float(isk_per_lp[row])} for row in rows])
+        return ranked
+
+    def top_k(
+        self,
+        prices: np.ndarray,
+        k: int = 10,
+        min_isk_per_lp: float | None = None,
+        corp_ids: list[int] | None = None,
+        exclude_inputs: list[int] | None = None,
+        max_isk_outlay: float | None = None
+    ) -> list[OfferRecord]:
+        """
+        Returns the k best offers across all compiled corps, using partial selection instead of a full sort
+
+        Args:
+            prices (np.ndarray): Price vector aligned to type_ids (NaN for items missing from the DB)
+            k (int): Max. number of offers to return
+            min_isk_per_lp (float): Only return offers with at least this ISK/LP rate
+            corp_ids (list[int]): Only return offers from these corps
+            exclude_inputs (list[int]): Leave out offers requiring any of these type IDs as an input
+            max_isk_outlay (float): Only return offers whose ISK cost plus input cost is at most this amount
+
+        Returns:
+            list[OfferRecord], best offers first
+        """
+        input_costs, profits = self.get_costs(prices)
+        isk_per_lp = self._get_isk_per_lp(input_costs, profits)
+
+        mask = ~np.isnan(isk_per_lp)
+        if min_isk_per_lp is not None:
+            mask &= isk_per_lp >= min_isk_per_lp
+        if corp_ids is not None:
+            mask &= np.isin(self.corp_ids, corp_ids)[self.offer_corp]
+        if exclude_inputs:
+            excluded_entries = np.isin(self.type_ids, exclude_inputs)[self.inputs_indices]
+            input_rows = np.repeat(np.arange(len(self)), np.diff(self.inputs_indptr))
+            mask &= np.bincount(input_rows, weights=excluded_entries, minlength=len(self)) == 0
+        if max_isk_outlay is not None:
+            mask &= input_costs + self.isk_cost <= max_isk_outlay
+
+        candidates = np.flatnonzero(mask)
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(-isk_per_lp[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-isk_per_lp[candidates], kind="stable")]
+
+        return [
+            OfferRecord(
+                corp_id = int(self.corp_ids[self.offer_corp[row]]),
+                corp_name = self.corp_names[self.offer_corp[row]],
+                offer_id = int(self.offer_ids[row]),
+                type_id = int(self.type_ids[self.received_type[row]]),
+                quantity = int(self.received_qty[row]),
+                lp_cost = int(self.lp_cost[row]),
+                isk_cost = float(self.isk_cost[row]),
+                input_cost = float(input_costs[row]),
+                profit = float(profits[row]),
+                isk_per_lp = float(isk_per_lp[row])
+            )
+            for row in candidates
+        ]
@@ -0,0 +1,175 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils import timezone
+from typing import *
+
+import glob
+import numpy as np
+import os
+import threading
+import uuid
+import warnings
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where appends are only serialized between the threads of a process
+    fcntl = None
+
+PRICE_TYPES = ["buy", "split", "sell"]
+
+
+class PriceHistory():
+    """
+    Append-only columnar store of price snapshots, kept as NumPy files instead of ORM rows.
+
+    Every update_sde_prices() run appends one snapshot file named by its timestamp in nanoseconds and a sequence
+    number (so snapshots taken at the same time never overwrite each other), holding a float32 array of shape
+    (3, n_columns) (buy/split/sell rows, one column per type ID). The column order is stored in type_ids.npy;
+    new type IDs are appended as new columns, so older (shorter) snapshots are padded with NaN when read.
+    Snapshots are memory-mapped on read, so loading a price type only touches its row.
+
+    Appends hold a file lock on the store, as the price refresh jobs run in separate Celery processes and would
+    otherwise race on the read-modify-write of type_ids.npy.
+
+    Args:
+        history_dir (str): Directory to store snapshots in. Defaults to settings.PRICE_HISTORY_DIR
+
+    Functions:
+        append(prices, timestamp): Append a snapshot of prices keyed by type ID
+        get_timestamps(): Returns the timestamps of all snapshots, oldest first
+        load(price_type, last_n): Returns a (snapshots x type IDs) matrix of one price type
+        get_rolling(price_type, window, method): Returns the rolling mean/median of the last window snapshots
+    """
+    def __init__(self, history_dir: str | None = None):
+        self.history_dir = history_dir or getattr(settings, "PRICE_HISTORY_DIR", os.path.join(settings.BASE_DIR, "price_history"))
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.history_dir, name)
+
+    def _save(self, name: str, array: np.ndarray):
+        os.makedirs(self.history_dir, exist_ok=True)
+        tmp_path = self._path(f"{uuid.uuid4().hex}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, self._path(name))
+
+    def get_type_ids(self) -> np.ndarray:
+        try:
+            return np.load(self._path("type_ids.npy"))
+        except OSError:
+            return np.empty(0, dtype=np.int64)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.history_dir, exist_ok=True)
+            with open(self._path(".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_snapshots(self) -> list[Tuple[int, int, str]]:
+        """
+        Returns the (timestamp in ns, sequence number, path) of all snapshots, oldest first
+        """
+        snapshots = []
+        for path in glob.glob(self._path("snapshot_*.npy")):
+            parts = os.path.basename(path)[len("snapshot_"):-len(".npy")].split("_")
+            if len(parts) == 1:
+                # Snapshots written before nanosecond names were named by their timestamp in seconds
+                snapshots.append((int(parts[0]) * 10 ** 9, 0, path))
+            else:
+                snapshots.append((int(parts[0]), int(parts[1]), path))
+        return sorted(snapshots)
+
+    def get_timestamps(self) -> list[int]:
+        """
+        Returns the unix timestamps of all snapshots, oldest first
+        """
+        return [timestamp // 10 ** 9 for timestamp, _, _ in self._get_snapshots()]
+
+    def append(self, prices: dict, timestamp: int | None = None) -> int:
+        """
+        Append a snapshot of prices to the store
+
+        Args:
+            prices (dict): Prices keyed by type ID, in the format returned by get_item_prices()
+            timestamp (int): Unix timestamp of the snapshot. Defaults to now
+
+        Returns:
+            int: The timestamp of the snapshot
+        """
+        timestamp = timestamp if timestamp is not None else timezone.now().timestamp()
+        timestamp_ns = int(round(timestamp * 10 ** 9))
+        with self._locked():
+            type_ids = self.get_type_ids()
+            new_ids = np.setdiff1d(np.fromiter((int(key) for key in prices), dtype=np.int64, count=len(prices)), type_ids)
+            if len(new_ids):
+                type_ids = np.concatenate([type_ids, new_ids])
+                self._save("type_ids.npy", type_ids)
+
+            columns = {int(type_id): column for column, type_id in enumerate(type_ids)}
+            snapshot = np.full((len(PRICE_TYPES), len(type_ids)), np.nan, dtype=np.float32)
+            for key, value in prices.items():
+                column = columns[int(key)]
+                for row, price_type in enumerate(PRICE_TYPES):
+                    snapshot[row, column] = value[price_type]
+            sequence = 0
+            while os.path.exists(self._path(f"snapshot_{timestamp_ns}_{sequence}.npy")):
+                sequence += 1
+            self._save(f"snapshot_{timestamp_ns}_{sequence}.npy", snapshot)
+        return int(timestamp)
+
+    def load(self, price_type: str = "sell", last_n: int | None = None) -> Tuple[list[int], np.ndarray, np.ndarray]:
+        """
+        Load the history of one price type as a matrix
+
+        Args:
+            price_type (str): The price to load, one of "buy", "split" or "sell"
+            last_n (int): Only load the most recent n snapshots
+
+        Returns:
+            A tuple of the snapshot timestamps, the type IDs (columns) and a float32 (snapshots x type IDs) matrix
+        """
+        row = PRICE_TYPES.index(price_type)
+        type_ids = self.get_type_ids()
+        snapshots = self._get_snapshots()
+        if last_n is not None:
+            snapshots = snapshots[-last_n:]
+        matrix = np.full((len(snapshots), len(type_ids)), np.nan, dtype=np.float32)
+        for i, (_, _, path) in enumerate(snapshots):
+            snapshot = np.load(path, mmap_mode="r")
+            # Snapshots appended after type_ids.npy was read can have more columns, which are left out
+            columns = min(snapshot.shape[1], len(type_ids))
+            matrix[i, :columns] = snapshot[row, :columns]
+        return [timestamp // 10 ** 9 for timestamp, _, _ in snapshots], type_ids, matrix
+
+    def get_rolling(self, price_type: str = "sell", window: int = 24, method: str = "median") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rolling mean or median price of every type ID over the last window snapshots, ignoring gaps
+
+        Args:
+            price_type (str): The price to use, one of "buy", "split" or "sell"
+            window (int): Number of snapshots to aggregate
+            method (str): "mean" or "median"
+
+        Returns:
+            A tuple of the type IDs and their aggregated prices (NaN if there is no history)
+        """
+        _, type_ids, matrix = self.load(price_type, last_n=window)
+        if not len(matrix):
+            return type_ids, np.full(len(type_ids), np.nan)
+        aggregate = {"mean": np.nanmean, "median": np.nanmedian}[method]
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            # All-NaN columns are expected for types without history, and just come out as NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return type_ids, aggregate(matrix, axis=0).astype(np.float64)
+
+
+price_history = PriceHistory()
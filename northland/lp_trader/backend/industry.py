@@ -0,0 +1,179 @@
+from typing import *
+
+from ..models import *
+
+import math
+
+
+class BuildCostEngine():
+    """
+    Local manufacturing cost calculator over the blueprint component graph, replacing per-request evecookbook calls.
+
+    load() reads every Blueprint row into an in-memory adjacency structure (blueprint -> materials, product -> blueprint).
+    Build costs are then evaluated recursively over the component graph: a component is valued at the cheaper of its market
+    price and its own build cost, with every fully resolved type memoized per evaluation, so whole LP stores of BPCs can be
+    valued in bulk. Builds that would loop back into an item already being built are skipped.
+
+    Args:
+        material_efficiency (int): ME level applied to every blueprint (0-10)
+
+    Functions:
+        load(): (Re)load all blueprints from the Blueprint table
+        get_unit_build_costs(type_ids, get_price): Returns the cost to build one unit of each item
+        get_blueprint_values(bp_ids, get_price): Returns the profit of a single run of each blueprint
+        get_dependent_blueprints(type_ids): Returns the blueprints whose value depends on the price of any of the items
+    """
+    def __init__(self, material_efficiency: int = 0):
+        self.material_efficiency = material_efficiency
+        self.materials = None # Blueprint type ID -> [(material type ID, quantity per run)]
+        self.products = {} # Blueprint type ID -> (product type ID, quantity per run)
+        self.blueprint_for = {} # Product type ID -> blueprint type ID
+        self.used_in = {} # Material or product type ID -> blueprint type IDs
+
+    @property
+    def loaded(self) -> bool:
+        return self.materials is not None
+
+    def load(self):
+        """
+        Load every blueprint from the Blueprint table in a single query
+
+        Args:
+            None
+
+        Returns:
+            BuildCostEngine (self)
+        """
+        self.materials, self.products, self.blueprint_for, self.used_in = {}, {}, {}, {}
+        for bp_id, product_id, product_quantity, input_materials in Blueprint.objects.values_list(
+            "item_id", "product_id", "product_quantity", "input_materials"
+        ):
+            self.materials[bp_id] = [(int(material_id), quantity) for material_id, quantity in input_materials.items()]
+            for material_id, _ in self.materials[bp_id]:
+                self.used_in.setdefault(material_id, []).append(bp_id)
+            if product_id is not None:
+                self.products[bp_id] = (product_id, product_quantity)
+                self.blueprint_for.setdefault(product_id, bp_id)
+                self.used_in.setdefault(product_id, []).append(bp_id)
+        return self
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _get_run_quantity(self, quantity: int) -> int:
+        # Material efficiency reduces material requirements per run, but never below 1 unit
+        return max(1, math.ceil(quantity * (1 - self.material_efficiency / 100)))
+
+    def get_unit_build_costs(self, type_ids: Iterable[int], get_price: Callable[[int], float | None]) -> dict[int, float | None]:
+        """
+        Returns the cheapest cost to obtain one unit of each item, by buying it or building it from its blueprint
+        (recursing into the components of the blueprint)
+
+        Args:
+            type_ids (Iterable[int]): The type IDs of the items
+            get_price (Callable): Returns the market price of a type ID, or None if it has no price
+
+        Returns:
+            A dictionary of unit costs keyed by type ID (None if the item can neither be bought nor built)
+        """
+        self.ensure_loaded()
+        memo = {}
+
+        def _get_unit_cost(type_id: int, path: dict) -> Tuple[float | None, float]:
+            # Returns the unit cost, and the depth of the shallowest item on the path whose build had to be skipped
+            # below this item to avoid a cycle (inf if none). Such a cost only holds on the current path, so only
+            # fully resolved items are memoized
+            if type_id in memo:
+                return memo[type_id], math.inf
+            depth = len(path)
+            market_price = get_price(type_id)
+            bp_id = self.blueprint_for.get(type_id)
+            build_cost, cut = None, math.inf
+            if type_id in path:
+                # Building the item again would be a cycle, so only its market price counts on this path
+                cut = path[type_id]
+            elif bp_id is not None:
+                path[type_id] = depth
+                run_cost, cut = _get_run_cost(bp_id, path)
+                del path[type_id]
+                if run_cost is not None:
+                    build_cost = run_cost / self.products[bp_id][1]
+            costs = [cost for cost in (market_price, build_cost) if cost is not None]
+            unit_cost = min(costs) if costs else None
+            if cut >= depth:
+                memo[type_id] = unit_cost
+                cut = math.inf
+            return unit_cost, cut
+
+        def _get_run_cost(bp_id: int, path: dict) -> Tuple[float | None, float]:
+            total, cut = 0, math.inf
+            for material_id, quantity in self.materials.get(bp_id, []):
+                unit_cost, material_cut = _get_unit_cost(material_id, path)
+                cut = min(cut, material_cut)
+                if unit_cost is None:
+                    return None, cut
+                total += self._get_run_quantity(quantity) * unit_cost
+            return total, cut
+
+        return {int(type_id): _get_unit_cost(int(type_id), {})[0] for type_id in type_ids}
+
+    def get_blueprint_values(self, bp_ids: Iterable[int], get_price: Callable[[int], float | None]) -> dict[int, float | None]:
+        """
+        Returns the profit of a single manufacturing run of each blueprint: the market value of its product minus the
+        cheapest cost of its materials. Used to value blueprint copies (BPCs) paid out by LP store offers
+
+        Args:
+            bp_ids (Iterable[int]): The type IDs of the blueprints
+            get_price (Callable): Returns the market price of a type ID, or None if it has no price
+
+        Returns:
+            A dictionary of run profits keyed by blueprint type ID (None if the blueprint cannot be valued)
+        """
+        self.ensure_loaded()
+        bp_ids = [int(bp_id) for bp_id in bp_ids if int(bp_id) in self.products]
+        material_ids = {material_id for bp_id in bp_ids for material_id, _ in self.materials[bp_id]}
+        unit_costs = self.get_unit_build_costs(material_ids, get_price)
+
+        res = {}
+        for bp_id in bp_ids:
+            product_id, product_quantity = self.products[bp_id]
+            product_price = get_price(product_id)
+            material_costs = [unit_costs[material_id] for material_id, _ in self.materials[bp_id]]
+            if product_price is None or None in material_costs:
+                res[bp_id] = None
+                continue
+            run_cost = sum(
+                self._get_run_quantity(quantity) * cost for (_, quantity), cost in zip(self.materials[bp_id], material_costs)
+            )
+            res[bp_id] = product_quantity * product_price - run_cost
+        return res
+
+    def get_dependent_blueprints(self, type_ids: Iterable[int]) -> set[int]:
+        """
+        Returns every blueprint whose run profit depends on the price of any of the items: blueprints producing or
+        consuming them, and (as components are valued at their build cost) blueprints consuming their products
+
+        Args:
+            type_ids (Iterable[int]): The type IDs of the items
+
+        Returns:
+            set[int] of blueprint type IDs
+        """
+        self.ensure_loaded()
+        dependents = set()
+        queue = [int(type_id) for type_id in type_ids]
+        seen = set(queue)
+        while queue:
+            for bp_id in self.used_in.get(queue.pop(), []):
+                if bp_id in dependents:
+                    continue
+                dependents.add(bp_id)
+                product_id = self.products.get(bp_id, (None,))[0]
+                if product_id is not None and product_id not in seen:
+                    seen.add(product_id)
+                    queue.append(product_id)
+        return dependents
+
+
+build_cost_engine = BuildCostEngine()
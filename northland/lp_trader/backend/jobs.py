@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from typing import *
+
+from ..models import *
+from .metrics import *
+
+import threading
+import time
+
+"""
+Bookkeeping for background refresh jobs. Job state lives in the RefreshJob table so that it is shared
+between the web workers and the Celery workers running the jobs. Live progress is also written to the
+Django cache, so it stays visible while a refresh is inside a long transaction and can be read without
+querying the database
+"""
+
+JOB_HEARTBEAT_INTERVAL = 60
+
+def _get_progress_key(job_id) -> str:
+    return f"lp_trader_job_progress_{job_id}"
+
+
+@contextmanager
+def _heartbeat(job: RefreshJob, interval: float = JOB_HEARTBEAT_INTERVAL):
+    """
+    Context manager keeping a heartbeat of a running job in the cache from a background thread, which
+    RefreshJob.is_active() checks. The cache is used as the job's own saves may be held back by the
+    transaction of a long stage
+
+    Args:
+        job (RefreshJob): The running job
+        interval (float): Number of seconds between heartbeats
+
+    Yields:
+        None
+    """
+    stopped = threading.Event()
+
+    def beat():
+        while True:
+            cache.set(job.get_heartbeat_key(), time.time(), 7200)
+            if stopped.wait(interval):
+                return
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def get_job_progress(job: RefreshJob) -> dict:
+    """
+    Returns the latest progress state of a job, preferring the live state in the cache
+
+    Args:
+        job (RefreshJob): The job to get progress for
+
+    Returns:
+        dict
+    """
+    return cache.get(_get_progress_key(job.job_id)) or job.progress
+
+
+def get_active_job(kind: str) -> RefreshJob | None:
+    """
+    Returns the queued or running job of a kind, if there is one
+
+    Args:
+        kind (str): The kind of job (e.g. "items")
+
+    Returns:
+        RefreshJob | None
+    """
+    for job in RefreshJob.objects.filter(kind=kind, status__in=RefreshJob.ACTIVE_STATUSES).order_by("-created_at"):
+        if job.is_active():
+            return job
+    return None
+
+
+def fail_stale_jobs(kind: str):
+    """
+    Marks queued or running jobs of a kind that stopped reporting in (i.e. of crashed workers) as failed,
+    as they would otherwise keep holding the unique_active_job_kind constraint
+
+    Args:
+        kind (str): The kind of job (e.g. "items")
+
+    Returns:
+        None
+    """
+    stale = [job.pk for job in RefreshJob.objects.filter(kind=kind, status__in=RefreshJob.ACTIVE_STATUSES) if not job.is_active()]
+    if stale:
+        RefreshJob.objects.filter(pk__in=stale).update(status=RefreshJob.FAILED, error="Job went stale")
+
+
+def create_job(kind: str) -> Tuple[RefreshJob, bool]:
+    """
+    Creates a new queued job, unless a job of the same kind is already queued or running
+
+    Args:
+        kind (str): The kind of job (e.g. "items")
+
+    Returns:
+        A tuple of the job and whether it was newly created
+    """
+    while True:
+        fail_stale_jobs(kind)
+        job = get_active_job(kind)
+        if job is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                return RefreshJob.objects.create(kind=kind), True
+        except IntegrityError:
+            # Another worker created a job of the same kind between the check and the insert
+            continue
+
+
+def update_job_progress(job: RefreshJob | None, **progress):
+    """
+    Merges progress information (e.g. stage, rows processed) into a job's progress state
+
+    Args:
+        job (RefreshJob | None): The job to update. Does nothing if None
+        **progress: Progress values to set
+
+    Returns:
+        None
+    """
+    if job is None:
+        return
+    job.progress.update(progress)
+    job.save(update_fields=["progress", "updated_at"])
+
+
+@contextmanager
+def run_job(kind: str, job_id: str | None = None):
+    """
+    Context manager marking a job as running, and as succeeded or failed once the block exits.
+    Jobs started without a job ID (i.e. by Celery beat) create their own job record, and are skipped
+    by yielding None if a job of the same kind is already active
+
+    Args:
+        kind (str): The kind of job (e.g. "items")
+        job_id (str): ID of the job created by create_job()
+
+    Yields:
+        RefreshJob | None
+    """
+    if job_id is None:
+        job, created = create_job(kind)
+        if not created:
+            print(f"Skipping {kind} refresh, job {job.job_id} is already active")
+            yield None
+            return
+    else:
+        job = RefreshJob.objects.get(job_id=job_id)
+
+    job.status = RefreshJob.RUNNING
+    job.save(update_fields=["status", "updated_at"])
+    try:
+        with _heartbeat(job):
+            yield job
+    except Exception as e:
+        job.status = RefreshJob.FAILED
+        job.error = str(e)
+        job.save(update_fields=["status", "error", "updated_at"])
+        raise e
+    finally:
+        # Publish the metrics of the job right away, as the worker may sit idle until the next job
+        metrics.flush(force=True)
+    job.status = RefreshJob.SUCCESS
+    job.save(update_fields=["status", "updated_at"])
+
+
+class ProgressReporter():
+    """
+    Tracks the progress of a refresh stage (rows processed, throughput and ETA) and publishes it to the cache.
+    Saves are throttled to at most one every min_interval seconds, so reporting every row is cheap. The state is
+    also saved to the job's progress field at the start and end of each stage. Without a job, progress is only
+    tracked locally
+
+    Args:
+        job (RefreshJob | None): The job to report progress to
+        min_interval (float): Min. number of seconds between saves
+
+    Functions:
+        start(stage, total): Start a new stage, resetting the row count
+        advance(rows): Mark rows as processed
+        finish(): Mark the current stage as done
+    """
+    def __init__(self, job: RefreshJob | None = None, min_interval: float = 0.25):
+        self.job = job
+        self.min_interval = min_interval
+        self.stage = None
+        self.total = None
+        self.processed = 0
+        self._started = 0
+        self._last_saved = 0
+
+    def get_state(self) -> dict:
+        elapsed = time.time() - self._started
+        throughput = self.processed / elapsed if elapsed > 0 else 0
+        eta = None
+        if self.total is not None and throughput > 0:
+            eta = max(self.total - self.processed, 0) / throughput
+        return {
+            "stage": self.stage,
+            "processed": self.processed,
+            "total": self.total,
+            "elapsed": round(elapsed, 2),
+            "throughput": round(throughput, 2),
+            "eta": None if eta is None else round(eta, 2)
+        }
+
+    def _save(self, force: bool = False):
+        now = time.time()
+        if self.job is None or (not force and now - self._last_saved < self.min_interval):
+            return
+        self._last_saved = now
+        state = self.get_state()
+        cache.set(_get_progress_key(self.job.job_id), {**self.job.progress, **state}, 3600)
+        if force:
+            update_job_progress(self.job, **state)
+
+    def start(self, stage: str, total: int | None = None):
+        self.stage = stage
+        self.total = total
+        self.processed = 0
+        self._started = time.time()
+        self._save(force=True)
+
+    def advance(self, rows: int = 1):
+        self.processed += rows
+        self._save()
+
+    def finish(self):
+        self._save(force=True)
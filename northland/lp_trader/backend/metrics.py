@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db import connection
+from typing import *
+
+import math
+import os
+import socket
+import threading
+import time
+
+"""
+Counters and histograms for the refresh and ranking hot paths, rendered in the Prometheus text format.
+
+Metrics are recorded in memory by each process, and every process periodically publishes a snapshot of its
+metrics to the Django cache (the same cache that carries job progress between the web and Celery workers).
+The metrics endpoint merges the snapshots of all processes, so refreshes running in Celery workers show up
+next to the requests served by the web workers.
+"""
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+METRICS_INDEX_KEY = "lp_trader_metrics_index"
+SNAPSHOT_TIMEOUT = 86400
+
+METRICS = {
+    "lp_trader_http_requests_total": ("counter", "HTTP requests sent to ESI and Fuzzworks, by host, endpoint and status"),
+    "lp_trader_http_request_duration_seconds": ("histogram", "Latency of HTTP requests sent to ESI and Fuzzworks (network only)"),
+    "lp_trader_http_retries_total": ("counter", "Retries of transient HTTP errors (5xx and 420), by host and status"),
+    "lp_trader_scheduler_wait_seconds": ("histogram", "Time requests were held back by the request scheduler, by host"),
+    "lp_trader_http_cache_total": ("counter", "HTTP response cache lookups, by result (hit, revalidated or miss)"),
+    "lp_trader_parse_cache_total": ("counter", "Parsed response cache lookups, by result (hit or miss)"),
+    "lp_trader_api_cache_total": ("counter", "Rankings API response cache lookups, by result (hit or miss)"),
+    "lp_trader_refresh_duration_seconds": ("histogram", "Duration of refresh passes, by refresh"),
+    "lp_trader_refresh_rows_total": ("counter", "Rows written by refreshes, by refresh and operation"),
+    "lp_trader_ranking_duration_seconds": ("histogram", "Duration of ranking passes, by mode (full or incremental)"),
+    "lp_trader_ranking_queries": ("histogram", "ORM queries per ranking pass, by mode"),
+    "lp_trader_ranking_rows_total": ("counter", "Ranking rows written by ranking passes, by mode")
+}
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsRegistry():
+    """
+    In-process store of counters and histograms, published to the cache as a per-process snapshot
+
+    Args:
+        flush_interval (float): Min. number of seconds between snapshot publishes
+
+    Functions:
+        inc(name, value, **labels): Increment a counter
+        observe(name, value, buckets, **labels): Record an observation in a histogram
+        time(name, **labels): Context manager recording the duration of its block in a histogram
+        flush(force): Publish this process' snapshot to the cache
+        render(): Returns the merged metrics of all processes in the Prometheus text format
+    """
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self.counters = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> [buckets, bucket counts, sum, count]
+        self._lock = threading.Lock()
+        self._last_flushed = 0
+        self._key = None
+
+    @property
+    def snapshot_key(self) -> str:
+        # Resolved lazily, as Celery workers fork after import
+        if self._key is None or not self._key.endswith(f":{os.getpid()}"):
+            self._key = f"lp_trader_metrics:{socket.gethostname()}:{os.getpid()}"
+        return self._key
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.flush()
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [tuple(buckets), [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+        self.flush()
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {key: [value[0], list(value[1]), value[2], value[3]] for key, value in self.histograms.items()}
+            }
+
+    def flush(self, force: bool = False):
+        """
+        Publishes this process' snapshot to the cache, at most once every flush_interval seconds unless forced.
+        Failures are only printed, so an unreachable cache never breaks the code being measured
+        """
+        now = time.time()
+        if not force and now - self._last_flushed < self.flush_interval:
+            return
+        self._last_flushed = now
+        try:
+            cache.set(self.snapshot_key, self.get_snapshot(), SNAPSHOT_TIMEOUT)
+            # Re-registering on every flush heals registrations lost to concurrent index updates
+            index = cache.get(METRICS_INDEX_KEY) or []
+            if self.snapshot_key not in index:
+                cache.set(METRICS_INDEX_KEY, [*index, self.snapshot_key], None)
+        except Exception as e:
+            print(f"Metrics flush failed: {e}")
+
+    def collect(self) -> dict:
+        """
+        Returns the merged snapshots of all processes
+        """
+        self.flush(force=True)
+        index = cache.get(METRICS_INDEX_KEY) or []
+        snapshots = cache.get_many(index)
+        if len(snapshots) != len(index):
+            # Drop the index entries of processes whose snapshots expired
+            cache.set(METRICS_INDEX_KEY, [key for key in index if key in snapshots], None)
+
+        merged = {"counters": {}, "histograms": {}}
+        for snapshot in snapshots.values():
+            for key, value in snapshot["counters"].items():
+                merged["counters"][key] = merged["counters"].get(key, 0) + value
+            for key, (buckets, counts, total, count) in snapshot["histograms"].items():
+                histogram = merged["histograms"].setdefault(key, [buckets, [0] * len(buckets), 0.0, 0])
+                if histogram[0] != buckets:
+                    continue
+                histogram[1] = [a + b for a, b in zip(histogram[1], counts)]
+                histogram[2] += total
+                histogram[3] += count
+        return merged
+
+    def render(self) -> str:
+        """
+        Returns the merged metrics of all processes in the Prometheus text exposition format
+        """
+        merged = self.collect()
+        series = {} # name -> [(labels, lines)]
+        for (name, labels), value in merged["counters"].items():
+            series.setdefault(name, []).append((labels, [f"{name}{_format_labels(labels)} {_format_value(value)}"]))
+        for (name, labels), (buckets, counts, total, count) in merged["histograms"].items():
+            lines = []
+            series.setdefault(name, []).append((labels, lines))
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels([*labels, ('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels([*labels, ('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name in sorted(series):
+            kind, description = METRICS.get(name, ("untyped", ""))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            for _, lines in sorted(series[name]):
+                output.extend(lines)
+        return "\n".join(output) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def count_queries():
+    """
+    Context manager counting the ORM queries run on the default connection inside its block (in this thread).
+    Unlike CaptureQueriesContext, the SQL itself is not kept, so it is cheap enough to use in production
+
+    Yields:
+        A dict whose "count" is updated as queries run
+    """
+    counter = {"count": 0}
+
+    def _wrapper(execute, sql, params, many, context):
+        counter["count"] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(_wrapper):
+        yield counter
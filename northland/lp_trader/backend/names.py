@@ -0,0 +1,73 @@
+
+from ..models import *
+from .endpoints import *
+
+"""
+Cached ID/name resolution. Names of corps and types never change, so every resolution is persisted in the
+EsiName table and only cache misses are sent to ESI, batched into a single call
+"""
+
+# post_universe_ids groups results by plural category, post_universe_names uses the singular form
+_ID_CATEGORIES = {
+    "agents": "character",
+    "alliances": "alliance",
+    "characters": "character",
+    "constellations": "constellation",
+    "corporations": "corporation",
+    "factions": "faction",
+    "inventory_types": "inventory_type",
+    "regions": "region",
+    "stations": "station",
+    "systems": "solar_system"
+}
+
+def _cache_entries(entries: list[EsiName]):
+    EsiName.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def resolve_ids_to_names(ids: list[int] | int) -> dict[int, str]:
+    """
+    Converts a list of IDs to names, using the EsiName cache. Uncached IDs are resolved with a single post_ids_to_names call
+
+    Args:
+        ids (list[int] | int): A list of IDs to be converted to names
+
+    Returns:
+        A dictionary of names keyed by ID
+    """
+    if type(ids) == int:
+        ids = [ids]
+    ids = list(dict.fromkeys(map(int, ids)))
+    res = dict(EsiName.objects.filter(esi_id__in=ids).values_list("esi_id", "name"))
+    misses = [esi_id for esi_id in ids if esi_id not in res]
+    if misses:
+        op = post_ids_to_names(misses)
+        _cache_entries([EsiName(esi_id=entry["id"], name=entry["name"], category=entry["category"]) for entry in op])
+        res.update({entry["id"]: entry["name"] for entry in op})
+    return res
+
+
+def resolve_names_to_ids(names: list[str], category: str = "corporation") -> dict[str, int]:
+    """
+    Converts a list of names in a single category to IDs, using the EsiName cache. Uncached names are resolved with a
+    single post_names_to_ids call
+
+    Args:
+        names (list[str]): A list of names to be converted to IDs
+        category (str): The category of the names (as returned by post_universe_names, e.g. "corporation")
+
+    Returns:
+        A dictionary of IDs keyed by name. Names that could not be resolved are left out
+    """
+    names = list(dict.fromkeys(names))
+    res = dict(EsiName.objects.filter(name__in=names, category=category).values_list("name", "esi_id"))
+    misses = [name for name in names if name not in res]
+    if misses:
+        op = post_names_to_ids(misses)
+        entries = []
+        for key, values in op.items():
+            for entry in values:
+                entries.append(EsiName(esi_id=entry["id"], name=entry["name"], category=_ID_CATEGORIES.get(key, key)))
+        _cache_entries(entries)
+        res.update({entry.name: entry.esi_id for entry in entries if entry.category == category})
+    return res
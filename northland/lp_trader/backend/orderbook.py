@@ -0,0 +1,204 @@
+from django.conf import settings
+from typing import *
+
+import numpy as np
+import os
+import threading
+import time
+import uuid
+
+"""
+Depth-aware pricing from full regional order books.
+
+An OrderBook keeps the orders of one market hub as sorted cumulative-depth arrays, one CSR-style segment per type ID
+and side. Sell orders are sorted cheapest first and buy orders highest first, so walking a segment from its start
+is the order in which a trade of any size would fill. The cost of filling a quantity is then found by binary search
+over the cumulative volume, instead of multiplying the quantity by the top-of-book price.
+"""
+
+ORDER_SIDES = ["sell", "buy"]
+ORDER_BOOK_ARRAYS = ["type_ids", "indptr", "prices", "cum_volume", "cum_cost"]
+
+
+class OrderBook():
+    """
+    Sorted cumulative-depth arrays of the buy and sell orders of a single market hub
+
+    Arrays per side:
+        type_ids: Sorted type IDs that have orders on this side
+        indptr: Start of the segment of each type ID (CSR indptr, len(type_ids) + 1 entries)
+        prices: Order prices, best first within each segment
+        cum_volume: Cumulative volume over all segments, with a leading 0 (int64, so it stays exact)
+        cum_cost: Cost of all orders before each order within its segment
+
+    Args:
+        sides (dict): The arrays of each side, keyed by side and array name
+        fetched_at (float): Unix timestamp of the orders
+
+    Functions:
+        from_orders(pages, system_id): Build an order book from pages of ESI orders
+        fill_costs(type_ids, quantities, side): Returns the cost of filling a list of quantities
+        fill_cost(type_id, quantity, side): Returns the cost of filling a single quantity, or None if it cannot be filled
+        get_depth(type_ids, side): Returns the total volume on a side of the book
+    """
+    def __init__(self, sides: dict | None = None, fetched_at: float | None = None):
+        self.sides = sides or {side: self._build_side(np.empty((0, 3))) for side in ORDER_SIDES}
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    @staticmethod
+    def _build_side(orders: np.ndarray, descending: bool = False) -> dict:
+        type_ids = orders[:, 0].astype(np.int64)
+        prices, volumes = orders[:, 1], orders[:, 2].astype(np.int64)
+        order = np.lexsort((-prices if descending else prices, type_ids))
+        type_ids, prices, volumes = type_ids[order], prices[order], volumes[order]
+
+        unique_ids, starts = np.unique(type_ids, return_index=True)
+        indptr = np.append(starts, len(type_ids)).astype(np.int64)
+        cum_volume = np.concatenate([[0], np.cumsum(volumes)]).astype(np.int64)
+        # Cumulated over the whole book and then rebased to the start of each segment. The running total is kept in
+        # extended precision, so the cost of cheap items is not swamped by the value of the whole book
+        cum_values = np.concatenate([[0], np.cumsum(prices * volumes, dtype=np.longdouble)])
+        segments = np.searchsorted(indptr, np.arange(len(prices)), side="right") - 1
+        cum_cost = (cum_values[:-1] - cum_values[indptr[segments]]).astype(np.float64)
+        return {"type_ids": unique_ids, "indptr": indptr, "prices": prices, "cum_volume": cum_volume, "cum_cost": cum_cost}
+
+    @classmethod
+    def from_orders(cls, pages: Iterable[list[dict]], system_id: int | None = None) -> "OrderBook":
+        """
+        Build an order book from pages of ESI market orders, as yielded by stream_market_orders().
+        Each page is reduced to a small array as soon as it arrives
+
+        Args:
+            pages (Iterable[list[dict]]): Pages of orders
+            system_id (int): Only keep orders in this solar system (i.e. the market hub)
+
+        Returns:
+            OrderBook
+        """
+        fetched_at = time.time()
+        chunks = {True: [], False: []}
+        for page in pages:
+            rows = {True: [], False: []}
+            for order in page:
+                if system_id is not None and order["system_id"] != system_id:
+                    continue
+                rows[order["is_buy_order"]].append((order["type_id"], order["price"], order["volume_remain"]))
+            for is_buy, side_rows in rows.items():
+                if side_rows:
+                    chunks[is_buy].append(np.array(side_rows, dtype=np.float64))
+
+        sides = {}
+        for side, is_buy in [("sell", False), ("buy", True)]:
+            orders = np.concatenate(chunks[is_buy]) if chunks[is_buy] else np.empty((0, 3))
+            sides[side] = cls._build_side(orders, descending=is_buy)
+        return cls(sides, fetched_at)
+
+    def _locate(self, type_ids: np.ndarray, side: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns whether each type ID has orders on a side of the book, and the position of its segment
+        """
+        book_ids = self.sides[side]["type_ids"]
+        if not len(book_ids):
+            return np.zeros(len(type_ids), dtype=bool), np.zeros(len(type_ids), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(book_ids, type_ids), len(book_ids) - 1)
+        return book_ids[positions] == type_ids, positions
+
+    def fill_costs(self, type_ids: np.ndarray, quantities: np.ndarray, side: str = "sell") -> np.ndarray:
+        """
+        Returns the cost of buying (from the sell side) or the proceeds of selling (into the buy side) a quantity
+        of each type ID, walking the book from its best price. Quantities beyond the depth of the book cannot be
+        filled and get no cost
+
+        Args:
+            type_ids (np.ndarray): The type IDs to fill
+            quantities (np.ndarray): The quantity of each type ID
+            side (str): The side of the book to fill against, "sell" or "buy"
+
+        Returns:
+            np.ndarray of fill costs, NaN for type IDs without orders on that side or without enough depth
+        """
+        book = self.sides[side]
+        type_ids = np.asarray(type_ids, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.float64)
+        costs = np.full(len(type_ids), np.nan)
+        found, positions = self._locate(type_ids, side)
+        if not found.any():
+            return costs
+
+        starts = book["indptr"][positions[found]]
+        ends = book["indptr"][positions[found] + 1]
+        targets = book["cum_volume"][starts] + quantities[found]
+        # Order i covers the cumulative volume between cum_volume[i] and cum_volume[i + 1]
+        levels = np.clip(np.searchsorted(book["cum_volume"], targets, side="left") - 1, starts, ends - 1)
+        filled = book["cum_cost"][levels] + (targets - book["cum_volume"][levels]) * book["prices"][levels]
+        costs[found] = np.where(targets <= book["cum_volume"][ends], filled, np.nan)
+        return costs
+
+    def fill_cost(self, type_id: int, quantity: int, side: str = "sell") -> float | None:
+        cost = self.fill_costs([type_id], [quantity], side)[0]
+        return None if np.isnan(cost) else float(cost)
+
+    def get_depth(self, type_ids: np.ndarray, side: str = "sell") -> np.ndarray:
+        """
+        Returns the total volume of the orders of each type ID on a side of the book (0 without orders)
+        """
+        book = self.sides[side]
+        type_ids = np.asarray(type_ids, dtype=np.int64)
+        depth = np.zeros(len(type_ids), dtype=np.int64)
+        found, positions = self._locate(type_ids, side)
+        starts, ends = book["indptr"][positions[found]], book["indptr"][positions[found] + 1]
+        depth[found] = book["cum_volume"][ends] - book["cum_volume"][starts]
+        return depth
+
+
+class OrderBookStore():
+    """
+    Order books of every market hub, saved as one .npz file per hub so that books fetched by a Celery worker are
+    picked up by the web workers. Loaded books are kept in memory until their file changes
+
+    Args:
+        book_dir (str): Directory to store order books in. Defaults to settings.ORDER_BOOK_DIR
+        max_age (int): Seconds after which an order book is considered stale and ignored.
+            Defaults to settings.ORDER_BOOK_MAX_AGE
+
+    Functions:
+        save(hub, book): Save the order book of a hub
+        get(hub): Returns the order book of a hub, or None if there is no fresh book
+    """
+    def __init__(self, book_dir: str | None = None, max_age: int | None = None):
+        self.book_dir = book_dir or getattr(settings, "ORDER_BOOK_DIR", os.path.join(settings.BASE_DIR, "order_books"))
+        self.max_age = max_age if max_age is not None else getattr(settings, "ORDER_BOOK_MAX_AGE", 6 * 3600)
+        self._books = {} # hub -> (mtime, OrderBook)
+        self._lock = threading.Lock()
+
+    def _path(self, hub: str) -> str:
+        return os.path.join(self.book_dir, f"{hub.lower()}.npz")
+
+    def save(self, hub: str, book: OrderBook):
+        os.makedirs(self.book_dir, exist_ok=True)
+        arrays = {f"{side}_{name}": book.sides[side][name] for side in ORDER_SIDES for name in ORDER_BOOK_ARRAYS}
+        tmp_path = self._path(f"{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as file:
+            np.savez(file, fetched_at=np.float64(book.fetched_at), **arrays)
+        os.replace(tmp_path, self._path(hub))
+        with self._lock:
+            self._books.pop(hub, None)
+
+    def get(self, hub: str) -> OrderBook | None:
+        try:
+            mtime = os.path.getmtime(self._path(hub))
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._books.get(hub)
+            if cached is None or cached[0] != mtime:
+                with np.load(self._path(hub)) as data:
+                    sides = {side: {name: data[f"{side}_{name}"] for name in ORDER_BOOK_ARRAYS} for side in ORDER_SIDES}
+                    cached = self._books[hub] = (mtime, OrderBook(sides, float(data["fetched_at"])))
+        book = cached[1]
+        if time.time() - book.fetched_at > self.max_age:
+            return None
+        return book
+
+
+order_books = OrderBookStore()
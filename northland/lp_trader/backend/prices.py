@@ -0,0 +1,284 @@
+from django.conf import settings
+from django.db.models import Count, Max
+from typing import *
+
+from ..models import *
+
+import numpy as np
+
+PRICE_TYPES = ["buy", "split", "sell"]
+
+
+def get_market_hubs() -> dict[str, int]:
+    """
+    Returns the market hubs to ingest prices for, keyed by hub name. The first hub is the primary hub,
+    whose prices are also stored in Item.market_price
+    """
+    return dict(getattr(settings, "MARKET_HUBS", {"Jita": 30000142}))
+
+
+class PriceIndex():
+    """
+    In-memory index of item prices keyed by type ID, loaded from the Item table in a single query.
+
+    Lookups against the index never hit the database, so a full ranking pass over every LP store
+    only costs one query to load the index (and one cheap staleness check per corp).
+    Type IDs that are not present in the Item table (i.e. blueprints filtered out of the SDE) are
+    kept in a negative cache, so they are only reported once per load.
+
+    Functions:
+        load(): (Re)load all prices from the Item table
+        ensure_fresh(): Reload the index if the Item table has changed since the last load
+        invalidate(): Drop the index, forcing a reload on the next lookup
+        update(prices): Write new prices through to the index without reloading
+        get(type_id): Returns the buy/split/sell prices of an item, or None if the item does not exist
+    """
+    def __init__(self):
+        self._prices = None
+        self._missing = set()
+        self._stamp = None
+
+    @staticmethod
+    def _get_db_stamp() -> tuple:
+        stamp = Item.objects.aggregate(count=Count("id"), last_updated=Max("last_updated"))
+        return stamp["count"], stamp["last_updated"]
+
+    @property
+    def loaded(self) -> bool:
+        return self._prices is not None
+
+    @property
+    def missing(self) -> set[int]:
+        return self._missing
+
+    @property
+    def last_updated(self):
+        """
+        The last_updated timestamp of the newest price in the index
+        """
+        return self._stamp[1] if self._stamp else None
+
+    def load(self):
+        """
+        Load the prices of every item in the Item table into the index
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._stamp = self._get_db_stamp()
+        self._prices = {
+            int(item_id): market_price for item_id, market_price in Item.objects.values_list("item_id", "market_price")
+        }
+        self._missing = set()
+
+    def ensure_fresh(self):
+        """
+        Reload the index if it has not been loaded yet, or if the Item table was modified since it was loaded
+        (e.g. by an SDE/price refresh running in another process)
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if not self.loaded or self._get_db_stamp() != self._stamp:
+            self.load()
+
+    def invalidate(self):
+        """
+        Drop the index. The next lookup will reload it from the database
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._prices = None
+        self._missing = set()
+        self._stamp = None
+
+    def update(self, prices: dict):
+        """
+        Write new prices through to the index, so that it does not have to be reloaded after a price refresh
+
+        Args:
+            prices (dict): Prices keyed by type ID, in the format returned by get_item_prices()
+
+        Returns:
+            None
+        """
+        if not self.loaded:
+            return
+        for type_id, price in prices.items():
+            type_id = int(type_id)
+            if type_id in self._prices:
+                self._prices[type_id] = price
+        self._stamp = self._get_db_stamp()
+
+    def get(self, type_id: int) -> dict | None:
+        """
+        Returns the buy, split and sell prices of an item
+
+        Args:
+            type_id (int): The type ID of the item
+
+        Returns:
+            The market_price dict of the item, or None if the item does not exist in the DB
+        """
+        if not self.loaded:
+            self.load()
+        type_id = int(type_id)
+        if type_id in self._missing:
+            return None
+        try:
+            return self._prices[type_id]
+        except KeyError:
+            # Item probably doesnt exist (i.e. blueprints) due to SDE filtering
+            print(f"Item ID {type_id} skipped as item is not found in DB")
+            self._missing.add(type_id)
+            return None
+
+
+price_index = PriceIndex()
+
+
+class HubPriceMatrix():
+    """
+    Prices of every item in every market hub, held as a single float64 array of shape (hubs, price types, type IDs)
+    and loaded from Item.hub_prices in a single query. Items priced before multi-hub ingestion fall back to their
+    Item.market_price in the primary hub. Prices that are not available are NaN.
+
+    Functions:
+        load(): (Re)load all hub prices from the Item table
+        ensure_fresh(): Reload the matrix if the Item table has changed since the last load
+        update(hub_prices): Write new hub prices through to the matrix without reloading
+        get_prices(type_ids, price_type): Returns a (hubs x type IDs) matrix of one price type
+        get_best_price(type_id, price_type, cheapest): Returns the highest (or lowest) price of an item across all hubs
+    """
+    def __init__(self):
+        self.hubs = []
+        self.type_ids = None
+        self.prices = None
+        self._stamp = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.prices is not None
+
+    @property
+    def last_updated(self):
+        """
+        The last_updated timestamp of the newest price in the matrix, i.e. the version of the prices it holds
+        """
+        return self._stamp[1] if self._stamp else None
+
+    def load(self):
+        """
+        Load the hub prices of every item in the Item table into the matrix
+
+        Args:
+            None
+
+        Returns:
+            HubPriceMatrix (self)
+        """
+        self._stamp = PriceIndex._get_db_stamp()
+        self.hubs = list(get_market_hubs())
+        rows = sorted(Item.objects.values_list("item_id", "market_price", "hub_prices"))
+        self.type_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.prices = np.full((len(self.hubs), len(PRICE_TYPES), len(rows)), np.nan)
+        for column, (_, market_price, hub_prices) in enumerate(rows):
+            if not hub_prices and market_price:
+                hub_prices = {self.hubs[0]: market_price}
+            for hub_index, hub in enumerate(self.hubs):
+                price = hub_prices.get(hub)
+                if price:
+                    self.prices[hub_index, :, column] = [price.get(price_type, np.nan) for price_type in PRICE_TYPES]
+        return self
+
+    def ensure_fresh(self):
+        if not self.loaded or PriceIndex._get_db_stamp() != self._stamp or list(get_market_hubs()) != self.hubs:
+            self.load()
+
+    def update(self, hub_prices: dict):
+        """
+        Write new prices through to the matrix, so that it does not have to be reloaded after a price refresh
+
+        Args:
+            hub_prices (dict): The new Item.hub_prices of each updated item, keyed by type ID
+
+        Returns:
+            None
+        """
+        if not self.loaded or not len(self.type_ids):
+            return
+        for type_id, prices in hub_prices.items():
+            position = min(np.searchsorted(self.type_ids, int(type_id)), len(self.type_ids) - 1)
+            if self.type_ids[position] != int(type_id):
+                continue
+            self.prices[:, :, position] = np.nan
+            for hub_index, hub in enumerate(self.hubs):
+                if prices.get(hub):
+                    self.prices[hub_index, :, position] = [prices[hub].get(price_type, np.nan) for price_type in PRICE_TYPES]
+        self._stamp = PriceIndex._get_db_stamp()
+
+    def get_prices(self, type_ids: np.ndarray, price_type: str = "sell") -> np.ndarray:
+        """
+        Returns the prices of a list of items in every hub
+
+        Args:
+            type_ids (np.ndarray): The type IDs of the items
+            price_type (str): The price to use, one of "buy", "split" or "sell"
+
+        Returns:
+            np.ndarray of shape (hubs, type IDs), NaN for items that are not priced in a hub (or missing from the DB)
+        """
+        if not self.loaded:
+            self.load()
+        type_ids = np.asarray(type_ids, dtype=np.int64)
+        prices = np.full((len(self.hubs), len(type_ids)), np.nan)
+        if not len(self.type_ids):
+            return prices
+        positions = np.minimum(np.searchsorted(self.type_ids, type_ids), len(self.type_ids) - 1)
+        found = self.type_ids[positions] == type_ids
+        prices[:, found] = self.prices[:, PRICE_TYPES.index(price_type), positions[found]]
+        return prices
+
+    def get_best_price(self, type_id: int, price_type: str = "sell", cheapest: bool = False) -> float | None:
+        prices, _ = select_hub_prices(self.get_prices([type_id], price_type), cheapest=cheapest)
+        return None if np.isnan(prices[0]) else float(prices[0])
+
+
+def select_hub_prices(prices: np.ndarray, cheapest: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Picks the best (highest, or lowest if cheapest) price of every item across all hubs. Fuzzworks reports a price
+    of 0 for items without orders in a hub, so a hub only wins with a price above 0 (unless no hub has one)
+
+    Args:
+        prices (np.ndarray): A (hubs x items) price matrix, as returned by HubPriceMatrix.get_prices()
+        cheapest (bool): Pick the lowest price instead of the highest
+
+    Returns:
+        A tuple of the picked prices (NaN if no hub has a price) and the index of the picked hub (-1 if none)
+    """
+    if not len(prices):
+        return np.full(prices.shape[1], np.nan), np.full(prices.shape[1], -1)
+    priced = ~np.isnan(prices)
+    unpriced = ~priced.any(axis=0)
+    with np.errstate(invalid="ignore"):
+        has_orders = prices > 0
+    filled = np.where(has_orders, prices, np.inf if cheapest else -np.inf)
+    hub_index = np.argmin(filled, axis=0) if cheapest else np.argmax(filled, axis=0)
+    no_orders = ~has_orders.any(axis=0)
+    hub_index[no_orders] = np.argmax(priced[:, no_orders], axis=0)
+    selected = np.take_along_axis(prices, hub_index[None, :], axis=0)[0]
+    hub_index[unpriced] = -1
+    return selected, hub_index
+
+
+hub_price_matrix = HubPriceMatrix()
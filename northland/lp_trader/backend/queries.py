@@ -0,0 +1,109 @@
+from django.db.models import Case, Exists, F, FloatField, IntegerField, OuterRef, QuerySet, Subquery, Sum, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Coalesce
+
+from ..models import *
+
+"""
+SQL-side queries over the normalized Offer/OfferInput tables. ISK/LP rates are calculated in the database
+with the same rules as LPConverter.calculate_isk_per_lp, so offers can be ranked and filtered without
+deserializing the Corp.offers blobs in Python
+"""
+
+def _get_price_subquery(type_id_ref: str, price_type: str = "sell") -> Subquery:
+    # Prices are truncated to integers, same as calculate_isk_per_lp
+    return Subquery(
+        Item.objects.filter(item_id=OuterRef(type_id_ref)).annotate(
+            price=Cast(Cast(KeyTextTransform(price_type, "market_price"), FloatField()), IntegerField())
+        ).values("price")[:1]
+    )
+
+
+def annotate_isk_per_lp(queryset: QuerySet, price_type: str = "sell") -> QuerySet:
+    """
+    Annotates an Offer queryset with input_cost, profit, isk_per_lp and has_unpriced_inputs. Inputs without a
+    price (missing from the DB, or not priced yet) zero the input cost of the whole offer like in the offer engine,
+    and are flagged by has_unpriced_inputs, as their NULL price would otherwise be left out of the input cost sum
+
+    Args:
+        queryset (QuerySet): The Offer queryset to annotate
+        price_type (str): The price to use, one of "buy", "split" or "sell"
+
+    Returns:
+        QuerySet
+    """
+    input_costs = OfferInput.objects.filter(offer=OuterRef("pk")).annotate(
+        cost=F("quantity") * _get_price_subquery("type_id", price_type)
+    ).values("offer").annotate(total=Sum("cost")).values("total")
+    # A single input missing from the DB (i.e. blueprints) or without a price zeroes the input cost of the whole offer
+    unpriced_inputs = OfferInput.objects.filter(offer=OuterRef("pk")).annotate(
+        price=_get_price_subquery("type_id", price_type)
+    ).filter(price__isnull=True)
+
+    return queryset.annotate(
+        has_unpriced_inputs=Exists(unpriced_inputs),
+        input_cost=Case(
+            When(has_unpriced_inputs=True, then=Value(0.0)),
+            default=Coalesce(Subquery(input_costs), Value(0.0), output_field=FloatField()),
+            output_field=FloatField()
+        ),
+        profit=Coalesce(F("quantity") * _get_price_subquery("type_id", price_type), Value(0.0), output_field=FloatField()),
+        isk_per_lp=Case(
+            When(lp_cost=0, then=Value(-1.0)),
+            default=(F("profit") - F("input_cost") - F("isk_cost")) / (F("lp_cost") / F("corp__lp_exchange_rate")),
+            output_field=FloatField()
+        )
+    )
+
+
+def get_best_offers(
+    limit: int = 10,
+    price_type: str = "sell",
+    corp_ids: list[int] | None = None,
+    exclude_unpriced: bool = False
+) -> QuerySet:
+    """
+    Returns the best offers by ISK/LP rate across all corps (or a list of corps)
+
+    Args:
+        limit (int): Max. number of offers to return
+        price_type (str): The price to use, one of "buy", "split" or "sell"
+        corp_ids (list[int]): Only consider offers from these corps (corp_id, not pk)
+        exclude_unpriced (bool): Leave out offers with unpriced inputs, whose rate is overstated
+
+    Returns:
+        QuerySet of Offer objects annotated with input_cost, profit, isk_per_lp and has_unpriced_inputs
+    """
+    queryset = Offer.objects.select_related("corp")
+    if corp_ids is not None:
+        queryset = queryset.filter(corp__corp_id__in=corp_ids)
+    queryset = annotate_isk_per_lp(queryset, price_type)
+    if exclude_unpriced:
+        queryset = queryset.filter(has_unpriced_inputs=False)
+    return queryset.order_by("-isk_per_lp", "pk")[:limit]
+
+
+def get_offers_using_item(type_id: int) -> QuerySet:
+    """
+    Returns every offer that requires an item as an input
+
+    Args:
+        type_id (int): The type ID of the item
+
+    Returns:
+        QuerySet of Offer objects
+    """
+    return Offer.objects.filter(inputs__type_id=type_id).select_related("corp").distinct()
+
+
+def get_offers_producing_item(type_id: int) -> QuerySet:
+    """
+    Returns every offer that pays out an item
+
+    Args:
+        type_id (int): The type ID of the item
+
+    Returns:
+        QuerySet of Offer objects
+    """
+    return Offer.objects.filter(type_id=type_id).select_related("corp")
@@ -0,0 +1,274 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from typing import *
+
+from ..models import *
+from .engine import *
+from .industry import *
+from .metrics import *
+from .orderbook import *
+from .prices import *
+
+import base64
+import datetime
+import numpy as np
+import time
+
+RANKINGS_VERSION_KEY = "lp_trader_rankings_version"
+
+
+class CompiledOffers():
+    """
+    The OfferEngine compiled from every LP store, kept in memory between ranking passes together with the Offer
+    primary key of each compiled offer. Offers only change on loyalty store refreshes, so price refreshes can
+    re-rank without recompiling every Corp.offers blob
+
+    Functions:
+        get(): Returns the compiled engine and Offer primary keys, recompiling if the Offer table has changed
+        invalidate(): Drop the compiled engine, forcing a recompile on the next call
+    """
+    def __init__(self):
+        self.engine = None
+        self.offer_pks = None # (corp_id, offer_id) -> (Offer pk, Corp pk)
+        self._stamp = None
+
+    @staticmethod
+    def _get_db_stamp() -> tuple:
+        # Loyalty store refreshes recreate the Offer rows of a corp, which always changes the max. primary key
+        stamp = Offer.objects.aggregate(count=Count("id"), last_id=Max("id"))
+        return stamp["count"], stamp["last_id"]
+
+    def get(self) -> Tuple[OfferEngine, dict]:
+        stamp = self._get_db_stamp()
+        if self.engine is None or stamp != self._stamp:
+            self.engine = OfferEngine().compile()
+            self.offer_pks = {
+                (corp_id, offer_id): (pk, corp_pk)
+                for pk, corp_pk, corp_id, offer_id in Offer.objects.values_list("id", "corp_id", "corp__corp_id", "offer_id")
+            }
+            self._stamp = stamp
+        return self.engine, self.offer_pks
+
+    def invalidate(self):
+        self.engine, self.offer_pks, self._stamp = None, None, None
+
+
+compiled_offers = CompiledOffers()
+
+
+def rebuild_rankings(price_type: str = "sell") -> int:
+    """
+    Recalculates the ISK/LP rate of every offer with the OfferEngine and replaces the contents of the Ranking table.
+    Offers are rated across every market hub, buying required inputs at the cheapest hub and selling the received
+    item at the best one. Once order books have been fetched (see update_order_books()), offers are rated at the
+    price of filling their quantities against the books instead of the top-of-book price.
+    Should be called once after each full price, order book or loyalty store refresh
+
+    Args:
+        price_type (str): The price to use, one of "buy", "split" or "sell"
+
+    Returns:
+        int: Number of ranking rows written
+    """
+    print("Rebuilding offer rankings...")
+    start = time.time()
+    computed_at = timezone.now()
+    with count_queries() as queries:
+        engine, offer_pks = compiled_offers.get()
+        rankings = _compute_rankings(engine, offer_pks, price_type, computed_at, build_cost_engine.load())
+        with transaction.atomic():
+            Ranking.objects.all().delete()
+            Ranking.objects.bulk_create(rankings, batch_size=1000)
+    runtime = time.time() - start
+    metrics.observe("lp_trader_ranking_duration_seconds", runtime, mode="full")
+    metrics.observe("lp_trader_ranking_queries", queries["count"], buckets=QUERY_BUCKETS, mode="full")
+    metrics.inc("lp_trader_ranking_rows_total", len(rankings), mode="full")
+    # Cached API responses are keyed by this version, so bumping it invalidates all of them
+    cache.set(RANKINGS_VERSION_KEY, computed_at.isoformat(), None)
+    print(f"{len(rankings)} offers ranked! (runtime: {runtime})")
+    return len(rankings)
+
+
+def update_rankings(type_ids: Iterable[int], price_type: str = "sell") -> int:
+    """
+    Recalculates only the offers affected by a price change of some items, and replaces just their rows of the
+    Ranking table. Affected offers are found with the reverse index of the OfferEngine (offers consuming or
+    producing the items), plus the offers paying out blueprints whose value depends on the items
+
+    Args:
+        type_ids (Iterable[int]): The type IDs of the items whose prices changed
+        price_type (str): The price to use, one of "buy", "split" or "sell"
+
+    Returns:
+        int: Number of ranking rows written
+    """
+    start = time.time()
+    computed_at = timezone.now()
+    with count_queries() as queries:
+        engine, offer_pks = compiled_offers.get()
+        build_cost_engine.ensure_loaded()
+        type_ids = {int(type_id) for type_id in type_ids}
+        rows = engine.get_dependent_offers(type_ids | build_cost_engine.get_dependent_blueprints(type_ids))
+        print(f"Updating rankings of {len(rows)} offers...")
+        if not len(rows):
+            return 0
+
+        rankings = _compute_rankings(engine.subset(rows), offer_pks, price_type, computed_at, build_cost_engine)
+        offer_ids = [ranking.offer_id for ranking in rankings]
+        # Replacing the affected rows is much cheaper than a bulk_update(), which sends one CASE per row and field
+        with transaction.atomic():
+            for i in range(0, len(offer_ids), 1000):
+                Ranking.objects.filter(offer_id__in=offer_ids[i:i + 1000]).delete()
+            Ranking.objects.bulk_create(rankings, batch_size=1000)
+    runtime = time.time() - start
+    metrics.observe("lp_trader_ranking_duration_seconds", runtime, mode="incremental")
+    metrics.observe("lp_trader_ranking_queries", queries["count"], buckets=QUERY_BUCKETS, mode="incremental")
+    metrics.inc("lp_trader_ranking_rows_total", len(rankings), mode="incremental")
+    cache.set(RANKINGS_VERSION_KEY, computed_at.isoformat(), None)
+    print(f"{len(rankings)} offer rankings updated! (runtime: {runtime})")
+    return len(rankings)
+
+
+def _compute_rankings(
+    engine: OfferEngine,
+    offer_pks: dict,
+    price_type: str,
+    computed_at: datetime.datetime,
+    blueprints: BuildCostEngine
+) -> list[Ranking]:
+    input_prices, received_prices, received_hubs = engine.build_hub_price_vectors(
+        price_type = price_type,
+        blueprints = blueprints
+    )
+    hubs = hub_price_matrix.hubs
+    # The version of the prices that were just read, as the matrix may be refreshed by the time rows are written
+    price_snapshot = hub_price_matrix.last_updated
+    received_hubs = received_hubs[engine.received_type]
+    books = [order_books.get(hub) for hub in hubs]
+    if any(book is not None for book in books):
+        isk_per_lp, depth_hubs = engine.evaluate_depth(
+            books,
+            input_prices,
+            received_prices,
+            redemptions = getattr(settings, "ORDER_BOOK_REDEMPTIONS", 1)
+        )
+        received_hubs = np.where(depth_hubs >= 0, depth_hubs, received_hubs)
+    else:
+        isk_per_lp = engine.evaluate(input_prices, received_prices)
+
+    rankings = []
+    for row, offer_id in enumerate(engine.offer_ids):
+        key = (int(engine.corp_ids[engine.offer_corp[row]]), int(offer_id))
+        if key not in offer_pks:
+            continue
+        offer_pk, corp_pk = offer_pks[key]
+        hub_index = received_hubs[row]
+        rankings.append(Ranking(
+            offer_id = offer_pk,
+            corp_id = corp_pk,
+            isk_per_lp = float(isk_per_lp[row]),
+            hub = hubs[hub_index] if hub_index >= 0 else "",
+            computed_at = computed_at,
+            price_snapshot = price_snapshot
+        ))
+    return rankings
+
+
+def get_most_used_inputs(limit: int = 500) -> list[int]:
+    """
+    Returns the items required as an input by the most offers, i.e. the prices that move the most rankings.
+    Used to pick the items of frequent partial price refreshes
+
+    Args:
+        limit (int): Max. number of type IDs to return
+
+    Returns:
+        list[int] of type IDs, most used first
+    """
+    engine, _ = compiled_offers.get()
+    usage = engine.get_input_usage()
+    columns = np.argsort(-usage, kind="stable")[:limit]
+    return [int(engine.type_ids[column]) for column in columns if usage[column] > 0]
+
+
+def get_rankings_version() -> datetime.datetime | None:
+    """
+    Returns the time the Ranking table was last rebuilt, which is used as the version of cached ranking responses
+
+    Args:
+        None
+
+    Returns:
+        datetime | None: None if no rankings have been computed yet
+    """
+    version = cache.get(RANKINGS_VERSION_KEY)
+    if version is None:
+        computed_at = Ranking.objects.aggregate(computed_at=Max("computed_at"))["computed_at"]
+        if computed_at is None:
+            return None
+        version = computed_at.isoformat()
+        cache.set(RANKINGS_VERSION_KEY, version, None)
+    return datetime.datetime.fromisoformat(version)
+
+
+def encode_cursor(ranking: dict) -> str:
+    # Keyed on the Offer primary key rather than the Ranking ID, as Ranking rows are recreated on every rebuild
+    return base64.urlsafe_b64encode(f"{ranking['isk_per_lp']!r}:{ranking['offer_pk']}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Decodes a pagination cursor returned by encode_cursor()
+
+    Raises:
+        ValueError: The cursor is malformed
+    """
+    isk_per_lp, offer_pk = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split(":")
+    return float(isk_per_lp), int(offer_pk)
+
+
+def get_ranking_page(limit: int = 50, cursor: str | None = None, corp_id: int | None = None) -> Tuple[list[dict], str | None]:
+    """
+    Returns a page of the Ranking table, best offers first, using keyset (cursor) pagination
+
+    Args:
+        limit (int): Max. number of offers to return
+        cursor (str): Cursor of the previous page's last offer, as returned by this function
+        corp_id (int): Only return offers of this corp (corp_id, not pk)
+
+    Returns:
+        A tuple of the ranked offers (as dicts) and the cursor for the next page (None on the last page)
+
+    Raises:
+        ValueError: The cursor is malformed
+    """
+    queryset = Ranking.objects.all()
+    if corp_id is not None:
+        queryset = queryset.filter(corp__corp_id=corp_id)
+    if cursor:
+        isk_per_lp, offer_pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(isk_per_lp__lt=isk_per_lp) | Q(isk_per_lp=isk_per_lp, offer_id__lt=offer_pk))
+    fields = {
+        "offer_id": "offer_pk",
+        "corp__corp_id": "corp_id",
+        "corp__corp_name": "corp_name",
+        "offer__offer_id": "offer_id",
+        "offer__type_id": "type_id",
+        "offer__quantity": "quantity",
+        "offer__lp_cost": "lp_cost",
+        "offer__isk_cost": "isk_cost",
+        "isk_per_lp": "isk_per_lp",
+        "hub": "hub",
+        "computed_at": "computed_at",
+        "price_snapshot": "price_snapshot"
+    }
+    rows = [
+        {fields[key]: value for key, value in row.items()}
+        for row in queryset.order_by("-isk_per_lp", "-offer_id").values(*fields.keys())[:limit + 1]
+    ]
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+from django.conf import settings
+from typing import *
+
+from .metrics import *
+
+import random
+import threading
+import time
+
+"""
+Process-wide scheduler for outbound ESI and Fuzzworks requests.
+
+Every request sent through a CachingHTTPAdapter takes a slot from the limiter of its host, which enforces a max.
+number of concurrent requests and a token-bucket rate limit. Limiters also track the ESI error limit from the
+X-ESI-Error-Limit-Remain/X-ESI-Error-Limit-Reset headers: requests are slowed down as the remaining error budget
+drains, and held back until the window resets once it is nearly used up. Transient errors (5xx and 420) are
+retried with jittered exponential backoff.
+"""
+
+RETRY_STATUSES = {420, 500, 502, 503, 504}
+DEFAULT_LIMITS = {"concurrency": 8, "rate": 20, "burst": 20}
+
+
+class HostLimiter():
+    """
+    Concurrency, rate and error budget limits of a single host
+
+    Args:
+        concurrency (int): Max. number of requests in flight
+        rate (float): Sustained requests per second (token refill rate)
+        burst (int): Max. number of requests sent back to back (bucket size)
+        error_slowdown (int): Remaining error budget below which requests are slowed down
+        error_stop (int): Remaining error budget at or below which requests wait for the error limit to reset
+        max_slowdown (float): Max. seconds of delay added per request while slowed down
+    """
+    def __init__(
+        self,
+        concurrency: int = 8,
+        rate: float = 20,
+        burst: int = 20,
+        error_slowdown: int = 50,
+        error_stop: int = 10,
+        max_slowdown: float = 2.0
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.error_slowdown = error_slowdown
+        self.error_stop = error_stop
+        self.max_slowdown = max_slowdown
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._refilled = time.monotonic()
+        self.error_remain = None
+        self.error_reset_at = None
+
+    def _take_token(self) -> float:
+        """
+        Takes a token from the bucket, returning the number of seconds to wait before the request can be sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def get_error_delay(self) -> float:
+        """
+        Returns the number of seconds to hold a request back for, based on the remaining ESI error budget
+        """
+        with self._lock:
+            if self.error_remain is None:
+                return 0
+            now = time.monotonic()
+            if self.error_reset_at is not None and now >= self.error_reset_at:
+                self.error_remain, self.error_reset_at = None, None
+                return 0
+            if self.error_remain <= self.error_stop:
+                return max(self.error_reset_at - now, 0) if self.error_reset_at is not None else self.max_slowdown
+            if self.error_remain < self.error_slowdown:
+                return self.max_slowdown * (1 - self.error_remain / self.error_slowdown)
+            return 0
+
+    def record_response(self, headers: Mapping):
+        remain, reset = headers.get("X-ESI-Error-Limit-Remain"), headers.get("X-ESI-Error-Limit-Reset")
+        if remain is None:
+            return
+        with self._lock:
+            self.error_remain = int(remain)
+            if reset is not None:
+                self.error_reset_at = time.monotonic() + int(reset)
+
+    @contextmanager
+    def slot(self):
+        """
+        Context manager holding a request slot, waiting for concurrency, rate and error budget limits first
+
+        Yields:
+            float: Seconds spent waiting
+        """
+        start = time.monotonic()
+        delay = self._take_token() + self.get_error_delay()
+        if delay > 0:
+            time.sleep(delay)
+        with self._slots:
+            yield time.monotonic() - start
+
+
+class RequestScheduler():
+    """
+    Process-wide registry of host limiters, and the retry policy for transient errors
+
+    Args:
+        limits (dict): HostLimiter arguments keyed by host. Defaults to settings.REQUEST_SCHEDULER_LIMITS.
+            Hosts without an entry use the "default" entry (or DEFAULT_LIMITS)
+        max_retries (int): Max. number of retries of a request
+        backoff_base (float): Base delay of the exponential backoff in seconds
+        backoff_cap (float): Max. delay of the exponential backoff in seconds
+
+    Functions:
+        slot(host): Context manager holding a request slot of a host
+        record_response(host, response): Update the error budget of a host from a response
+        get_retry_delay(host, response, attempt): Returns the delay before retrying a response, or None if it should not be retried
+    """
+    def __init__(self, limits: dict | None = None, max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 30):
+        self.limits = limits if limits is not None else getattr(settings, "REQUEST_SCHEDULER_LIMITS", {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, host: str) -> HostLimiter:
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(**self.limits.get(host, self.limits.get("default", DEFAULT_LIMITS)))
+            return self._limiters[host]
+
+    @contextmanager
+    def slot(self, host: str):
+        with self.get_limiter(host).slot() as waited:
+            metrics.observe("lp_trader_scheduler_wait_seconds", waited, host=host)
+            yield
+
+    def record_response(self, host: str, response):
+        self.get_limiter(host).record_response(response.headers)
+
+    def get_retry_delay(self, host: str, response, attempt: int) -> float | None:
+        if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        # Full jitter, so that concurrent workers retrying the same failure spread out
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if response.status_code == 420:
+            # Error limited: nothing gets through until the error limit window resets
+            delay += int(response.headers.get("X-ESI-Error-Limit-Reset", 60))
+        return delay
+
+
+scheduler = RequestScheduler()
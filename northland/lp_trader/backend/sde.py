@@ -0,0 +1,165 @@
+from django.conf import settings
+from typing import *
+
+import csv
+import json
+import numpy as np
+import os
+import threading
+import uuid
+
+CACHE_FORMAT_VERSION = 1
+
+
+class OfflineSDE():
+    """
+    Offline source of the static data (type IDs and names), read from a local dump instead of Fuzzworks.
+
+    The dump can be the data.json snapshot bundled with the repo (a list of {"typeID", "typeName"} records) or a local
+    copy of Fuzzworks' invTypes.csv. On first load the dump is compiled into a binary cache: a sorted int64 array of type
+    IDs, an int64 array of offsets into a UTF-8 name table, and the name table itself. Later loads memory-map these files
+    instead of parsing the dump again. The cache is rebuilt whenever the size or modification time of the dump changes.
+
+    Args:
+        source (str): Path of the dump. Defaults to settings.SDE_SNAPSHOT_PATH
+        cache_dir (str): Directory to store the binary cache in. Defaults to settings.SDE_CACHE_DIR
+
+    Functions:
+        load(): Loads the binary cache, compiling the dump first if needed
+        compile(): (Re)builds the binary cache from the dump
+        get_name(type_id): Returns the name of a type ID
+        stream_static_data(): Streams the static data as rows, in the format of endpoints.stream_static_data()
+    """
+    def __init__(self, source: str | None = None, cache_dir: str | None = None):
+        self.source = str(source or getattr(settings, "SDE_SNAPSHOT_PATH", os.path.join(settings.BASE_DIR.parent, "data.json")))
+        self.cache_dir = str(cache_dir or getattr(settings, "SDE_CACHE_DIR", os.path.join(settings.BASE_DIR, "sde_cache")))
+        self.type_ids = None
+        self.name_offsets = None
+        self.names = None
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _get_source_stamp(self) -> dict:
+        stat = os.stat(self.source)
+        return {
+            "version": CACHE_FORMAT_VERSION,
+            "source": os.path.abspath(self.source),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns
+        }
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(self._path("meta.json"), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _read_source(self) -> Iterator[Tuple[int, str]]:
+        if self.source.endswith(".csv"):
+            with open(self.source, "r", encoding="utf-8", newline="") as file:
+                for row in csv.DictReader(file):
+                    # Matches the online source, which skips unpublished items
+                    if row.get("published", "1") in ("0", "False"):
+                        continue
+                    yield int(row["typeID"]), row["typeName"]
+        else:
+            with open(self.source, "r", encoding="utf-8") as file:
+                for row in json.load(file):
+                    yield int(row["typeID"]), row["typeName"]
+
+    def _save(self, name: str, content: bytes | np.ndarray):
+        tmp_path = self._path(f"{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as file:
+            if isinstance(content, np.ndarray):
+                np.save(file, content)
+            else:
+                file.write(content)
+        os.replace(tmp_path, self._path(name))
+
+    def compile(self):
+        """
+        Compiles the dump into the binary cache
+
+        Args:
+            None
+
+        Returns:
+            OfflineSDE (self)
+        """
+        print(f"Compiling SDE dump {self.source}...")
+        records = sorted({type_id: name for type_id, name in self._read_source()}.items())
+        encoded = [(name if isinstance(name, str) else "").encode("utf-8") for _, name in records]
+        type_ids = np.fromiter((type_id for type_id, _ in records), dtype=np.int64, count=len(records))
+        name_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._save("type_ids.npy", type_ids)
+        self._save("name_offsets.npy", name_offsets)
+        self._save("names.bin", b"".join(encoded))
+        # The metadata is written last, so an interrupted compile is never mistaken for a valid cache
+        self._save("meta.json", json.dumps({**self._get_source_stamp(), "count": len(records)}).encode("utf-8"))
+        return self
+
+    def load(self):
+        """
+        Loads the binary cache, compiling the dump first if the cache is missing or out of date
+
+        Args:
+            None
+
+        Returns:
+            OfflineSDE (self)
+        """
+        with self._lock:
+            meta = self._read_meta()
+            if meta is None or any(meta.get(key) != value for key, value in self._get_source_stamp().items()):
+                self.compile()
+            self.type_ids = np.load(self._path("type_ids.npy"), mmap_mode="r")
+            self.name_offsets = np.load(self._path("name_offsets.npy"), mmap_mode="r")
+            if os.path.getsize(self._path("names.bin")):
+                self.names = np.memmap(self._path("names.bin"), dtype=np.uint8, mode="r")
+            else:
+                self.names = np.empty(0, dtype=np.uint8)
+        return self
+
+    def ensure_loaded(self):
+        if self.type_ids is None:
+            self.load()
+
+    def __len__(self) -> int:
+        self.ensure_loaded()
+        return len(self.type_ids)
+
+    def _get_name_at(self, index: int) -> str:
+        return bytes(self.names[self.name_offsets[index]:self.name_offsets[index + 1]]).decode("utf-8")
+
+    def get_name(self, type_id: int) -> str | None:
+        """
+        Returns the name of a type ID, or None if it is not in the dump
+        """
+        self.ensure_loaded()
+        index = int(np.searchsorted(self.type_ids, type_id))
+        if index < len(self.type_ids) and self.type_ids[index] == type_id:
+            return self._get_name_at(index)
+        return None
+
+    def stream_static_data(self) -> Iterator[dict]:
+        """
+        Streams the static data row by row, without any network access
+
+        Args:
+            None
+
+        Returns:
+            An iterator of dict rows with "typeID" and "typeName"
+        """
+        self.ensure_loaded()
+        for index, type_id in enumerate(self.type_ids.tolist()):
+            yield {"typeID": type_id, "typeName": self._get_name_at(index)}
+
+
+offline_sde = OfflineSDE()
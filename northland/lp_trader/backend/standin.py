@@ -0,0 +1,288 @@
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import glob
+import hashlib
+import json
+import os
+import random
+import requests
+import threading
+import time
+import uuid
+
+"""
+Local stand-in for ESI and Fuzzworks, used to load-test the refresh pipeline offline and reproducibly.
+
+Every upstream is served under its own path prefix (see UPSTREAMS), so pointing the app at the stand-in only needs
+the base URL settings to be changed, e.g. for a stand-in on port 8089:
+
+    ESI_API_URL = 'http://localhost:8089/esi/'
+    FUZZWORK_DUMP_URL = 'http://localhost:8089/fuzzwork/dump/latest'
+    FUZZWORK_MARKET_URL = 'http://localhost:8089/market'
+
+In record mode, requests are forwarded to the real upstream and the responses are saved to the recordings directory.
+In replay mode, recorded responses are served instead, with optional latency, injected errors and emulation of the
+ESI error limit (X-ESI-Error-Limit-Remain/X-ESI-Error-Limit-Reset headers, and 420s once the limit is used up).
+"""
+
+UPSTREAMS = {
+    "esi": "https://esi.evetech.net",
+    "fuzzwork": "https://www.fuzzwork.co.uk",
+    "market": "https://market.fuzzwork.co.uk"
+}
+# Response headers kept in recordings
+RECORDED_HEADERS = {"content-type", "cache-control", "etag", "expires", "last-modified", "x-pages"}
+
+
+class RecordingStore():
+    """
+    Recorded responses on disk, keyed by upstream, method, path, query and body.
+    Each recording is a JSON metadata file and a body file sharing the same key
+
+    Args:
+        recordings_dir (str): Directory to store recordings in
+    """
+    def __init__(self, recordings_dir: str):
+        self.recordings_dir = str(recordings_dir)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(upstream: str, method: str, path: str, query: str, body: bytes = b"") -> str:
+        query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+        return hashlib.sha1(f"{upstream} {method} {path}?{query}".encode("utf-8") + body).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.recordings_dir, f"{key}.{suffix}")
+
+    def _write(self, path: str, data: bytes):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, key: str, meta: dict, body: bytes):
+        with self._lock:
+            os.makedirs(self.recordings_dir, exist_ok=True)
+            self._write(self._path(key, "body"), body)
+            self._write(self._path(key, "json"), json.dumps(meta, indent=2).encode("utf-8"))
+
+    def load(self, key: str) -> Tuple[dict, bytes] | None:
+        try:
+            with open(self._path(key, "json"), "r") as file:
+                meta = json.load(file)
+            with open(self._path(key, "body"), "rb") as file:
+                return meta, file.read()
+        except OSError:
+            return None
+
+    def find(self, key: str, upstream: str, method: str, path: str, query: str = "", body: bytes = b"") -> Tuple[dict, bytes] | None:
+        """
+        Returns the recording of a request. Requests without a query or body fall back to the most recent recording
+        of the same method and path if there is no exact match. Requests with one never do, as a recording of
+        another query (e.g. another page or type ID) would be served as a wrong but valid-looking response
+        """
+        recording = self.load(key)
+        if recording is not None or query or body:
+            return recording
+        matches = []
+        for meta_path in glob.glob(os.path.join(self.recordings_dir, "*.json")):
+            try:
+                with open(meta_path, "r") as file:
+                    meta = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if (meta["upstream"], meta["method"], meta["path"]) == (upstream, method, path):
+                matches.append((meta["recorded_at"], meta_path[:-len(".json")]))
+        if not matches:
+            return None
+        return self.load(os.path.basename(max(matches)[1]))
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server replaying (or recording) ESI and Fuzzworks responses
+
+    Args:
+        address (tuple): Host and port to listen on
+        store (RecordingStore): Recordings to replay from or record to
+        record (bool): Forward requests upstream and record the responses instead of replaying
+        latency (float): Seconds of latency added to every response
+        jitter (float): Max. seconds of random latency added on top of latency
+        error_rate (float): Fraction of requests answered with an injected 5xx error
+        error_limit (int): Number of ESI errors allowed per error limit window
+        error_limit_window (int): Length of the ESI error limit window in seconds
+        seed (int): Seed for latency jitter and error injection, for reproducible runs
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        store: RecordingStore,
+        record: bool = False,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        error_limit: int = 100,
+        error_limit_window: int = 60,
+        seed: int | None = None
+    ):
+        super().__init__(address, StandinRequestHandler)
+        self.store = store
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_limit = error_limit
+        self.error_limit_window = error_limit_window
+        self.upstream_session = requests.Session()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._errors_remaining = error_limit
+        self._window_reset = time.time() + error_limit_window
+
+    def get_delay(self) -> float:
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def should_inject_error(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def get_error_limit(self, is_error: bool = False) -> Tuple[int, int]:
+        """
+        Returns the remaining ESI errors and seconds until the error limit window resets, counting an error if is_error
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self._window_reset:
+                self._errors_remaining = self.error_limit
+                self._window_reset = now + self.error_limit_window
+            if is_error:
+                self._errors_remaining = max(self._errors_remaining - 1, 0)
+            return self._errors_remaining, max(int(self._window_reset - now), 0)
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    server: StandinServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args):
+        # Access logs would dominate the output of a load test
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def _send(self, status: int, headers: dict, body: bytes):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict, headers: dict | None = None):
+        self._send(status, {"Content-Type": "application/json; charset=utf-8", **(headers or {})}, json.dumps(data).encode("utf-8"))
+
+    def handle_request(self):
+        url = urlsplit(self.path)
+        upstream, _, path = url.path.lstrip("/").partition("/")
+        path = f"/{path}"
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if upstream not in UPSTREAMS:
+            self._send_json(404, {"error": f"Unknown upstream {upstream}"})
+            return
+
+        time.sleep(self.server.get_delay())
+        is_esi = upstream == "esi"
+        if is_esi:
+            remaining, reset = self.server.get_error_limit()
+            if remaining == 0:
+                self._send_json(420, {"error": "This software has exceeded the error limit for ESI."}, {
+                    "X-ESI-Error-Limit-Remain": "0",
+                    "X-ESI-Error-Limit-Reset": str(reset)
+                })
+                return
+        if self.server.should_inject_error():
+            self._send_error(502 if is_esi else 503, "Injected stand-in error", is_esi)
+            return
+
+        key = RecordingStore.get_key(upstream, self.command, path, url.query, body)
+        if self.server.record:
+            recording = self._record(key, upstream, path, url.query, body)
+        else:
+            recording = self.server.store.find(key, upstream, self.command, path, url.query, body)
+        if recording is None:
+            self._send_error(404, f"No recording for {self.command} {upstream}{path}", is_esi)
+            return
+
+        meta, response_body = recording
+        headers = self._get_replay_headers(meta)
+        if upstream == "esi" and path.endswith("swagger.json"):
+            response_body = self._rewrite_spec(response_body)
+        if is_esi:
+            remaining, reset = self.server.get_error_limit(is_error=meta["status"] >= 400)
+            headers.update({"X-ESI-Error-Limit-Remain": str(remaining), "X-ESI-Error-Limit-Reset": str(reset)})
+        if meta["status"] == 200 and headers.get("ETag") and self.headers.get("If-None-Match") == headers["ETag"]:
+            self._send(304, {name: value for name, value in headers.items() if name != "Content-Type"}, b"")
+            return
+        self._send(meta["status"], headers, response_body)
+
+    def _send_error(self, status: int, message: str, is_esi: bool):
+        headers = {}
+        if is_esi:
+            remaining, reset = self.server.get_error_limit(is_error=True)
+            headers = {"X-ESI-Error-Limit-Remain": str(remaining), "X-ESI-Error-Limit-Reset": str(reset)}
+        self._send_json(status, {"error": message}, headers)
+
+    def _record(self, key: str, upstream: str, path: str, query: str, body: bytes) -> Tuple[dict, bytes] | None:
+        target = f"{UPSTREAMS[upstream]}{path}" + (f"?{query}" if query else "")
+        headers = {name: value for name, value in self.headers.items() if name.lower() in {"content-type", "authorization", "accept"}}
+        try:
+            response = self.server.upstream_session.request(self.command, target, data=body or None, headers=headers, timeout=60)
+        except requests.RequestException as e:
+            print(f"Recording {target} failed: {e}")
+            return None
+        meta = {
+            "upstream": upstream,
+            "method": self.command,
+            "path": path,
+            "query": query,
+            "status": response.status_code,
+            "headers": {name: value for name, value in response.headers.items() if name.lower() in RECORDED_HEADERS},
+            "expires_in": self._get_expires_in(response.headers),
+            "recorded_at": time.time()
+        }
+        self.server.store.save(key, meta, response.content)
+        print(f"Recorded {self.command} {target} ({response.status_code})")
+        return meta, response.content
+
+    @staticmethod
+    def _get_expires_in(headers: Mapping) -> int | None:
+        try:
+            return int(parsedate_to_datetime(headers["Expires"]).timestamp() - parsedate_to_datetime(headers["Date"]).timestamp())
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _get_replay_headers(self, meta: dict) -> dict:
+        headers = {name.title().replace("Etag", "ETag"): value for name, value in meta["headers"].items()}
+        # Recorded expiry times are in the past, so they are shifted to be relative to the time of replay
+        if meta.get("expires_in") is not None:
+            headers["Expires"] = formatdate(time.time() + meta["expires_in"], usegmt=True)
+        return headers
+
+    def _rewrite_spec(self, body: bytes) -> bytes:
+        # The ESI client builds request URLs from the host and base path in the spec, which have to point back here
+        spec = json.loads(body)
+        spec["host"] = self.headers.get("Host", f"{self.server.server_address[0]}:{self.server.server_address[1]}")
+        spec["schemes"] = ["http"]
+        spec["basePath"] = "/esi" + spec.get("basePath", "")
+        return json.dumps(spec).encode("utf-8")
@@ -0,0 +1,105 @@
+from django.core.cache import cache
+from django.utils import timezone
+from esi.models import Token
+from typing import *
+
+import datetime
+import threading
+import time
+
+
+class AccessTokenCache():
+    """
+    Process-wide cache of ESI access tokens, replacing per-call Token.valid_access_token() lookups.
+
+    An access token is reused until refresh_margin seconds before it expires, and is then refreshed proactively,
+    so it never expires in the middle of a batch of requests. SSO rotates the refresh token on every refresh, so
+    refreshes of the same token are serialized: within a process by a per-token lock, and across the web and Celery
+    workers by a lock in the Django cache. Processes that lose the race pick up the new access token from the database.
+
+    Args:
+        refresh_margin (int): Seconds before expiry at which a token is refreshed
+        lock_timeout (int): Max. seconds to wait for a refresh running in another process
+
+    Functions:
+        get(token): Returns a valid access token for a Token
+        invalidate(token): Drops the cached access token of a Token
+    """
+    def __init__(self, refresh_margin: int = 60, lock_timeout: int = 30):
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+        self.access_tokens = {} # Token pk -> (access token, expiry)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get_lock(self, token: Token) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(token.pk, threading.Lock())
+
+    def _is_fresh(self, expires: datetime.datetime) -> bool:
+        return expires - datetime.timedelta(seconds=self.refresh_margin) > timezone.now()
+
+    def _get_cached(self, token: Token) -> str | None:
+        cached = self.access_tokens.get(token.pk)
+        if cached is not None and self._is_fresh(cached[1]):
+            return cached[0]
+        return None
+
+    def get(self, token: Token) -> str:
+        """
+        Returns a valid access token for a Token, refreshing it through SSO only if it is about to expire
+
+        Args:
+            token (Token): The token to get an access token for
+
+        Returns:
+            str
+
+        Raises:
+            TokenExpiredError: The token expired and cannot be refreshed
+            TokenInvalidError: The refresh was rejected by SSO
+        """
+        access_token = self._get_cached(token)
+        if access_token is not None:
+            return access_token
+
+        with self._get_lock(token):
+            # Another thread may have refreshed the token while this one waited for the lock
+            access_token = self._get_cached(token)
+            if access_token is not None:
+                return access_token
+            if token.pk is not None:
+                token.refresh_from_db(fields=["access_token", "refresh_token", "created"])
+            if not self._is_fresh(token.expires):
+                self._refresh(token)
+            self.access_tokens[token.pk] = (token.access_token, token.expires)
+            return token.access_token
+
+    def _refresh(self, token: Token):
+        lock_key = f"lp_trader_token_refresh_{token.pk}"
+        if cache.add(lock_key, True, self.lock_timeout):
+            try:
+                token.refresh()
+            finally:
+                cache.delete(lock_key)
+            return
+
+        # Another process is refreshing this token, so wait for the new access token to show up in the database
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.5)
+            token.refresh_from_db(fields=["access_token", "refresh_token", "created"])
+            if self._is_fresh(token.expires):
+                return
+        # The other refresh did not finish in time, fall back to the old behaviour
+        token.valid_access_token()
+
+    def invalidate(self, token: Token):
+        self.access_tokens.pop(token.pk, None)
+
+
+access_tokens = AccessTokenCache()
+
+
+def get_access_token(token: Token) -> str:
+    return access_tokens.get(token)
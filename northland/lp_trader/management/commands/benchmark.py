@@ -0,0 +1,161 @@
+from contextlib import ExitStack, redirect_stdout
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from unittest import mock
+
+from lp_trader.backend import convert, data, endpoints, history, orderbook, rankings, sde
+from lp_trader.models import *
+
+import gc
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+"""
+Benchmarks the conversion and refresh hot paths against synthetic fixtures, reporting wall time, query count and
+peak (Python) memory of each. The network layer (Fuzzworks SDE dump and price aggregates) is stubbed, and everything
+runs against a throwaway test database and temporary cache directories (HTTP cache, SDE cache, price history and
+order books), so neither the real database nor the on-disk caches are touched.
+
+Usage:
+    python manage.py benchmark              # 40k items, 100 corps, 1000 offers each
+    python manage.py benchmark --scale 10   # 400k items, 100 corps, 10000 offers each
+"""
+
+ITEMS = 40000
+CORPS = 100
+OFFERS_PER_CORP = 1000
+INPUTS_PER_OFFER = 2
+
+
+class Command(BaseCommand):
+    help = "Benchmarks calculate_isk_per_lp, get_profitable_trades, update_sde, update_sde_prices and rankings on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=1, help="Multiplier for the number of items and offers per corp")
+        parser.add_argument("--items", type=int, default=None, help=f"Number of items (default {ITEMS} x scale)")
+        parser.add_argument("--corps", type=int, default=CORPS, help="Number of corps")
+        parser.add_argument("--offers", type=int, default=None, help=f"Number of offers per corp (default {OFFERS_PER_CORP} x scale)")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic fixtures")
+
+    def handle(self, *args, **options):
+        n_items = options["items"] or ITEMS * options["scale"]
+        n_offers = options["offers"] or OFFERS_PER_CORP * options["scale"]
+        n_corps = options["corps"]
+        self.verbose = options["verbosity"] > 1
+        self.rng = random.Random(options["seed"])
+        self.stdout.write(f"Benchmarking with {n_items} items, {n_corps} corps, {n_offers} offers per corp")
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir, ExitStack() as stack:
+                self.isolate_caches(stack, tmp_dir)
+                self.run_benchmarks(n_items, n_corps, n_offers)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def isolate_caches(self, stack: ExitStack, tmp_dir: str):
+        """
+        Points the Django cache and every on-disk cache at throwaway locations for the duration of the run.
+        The module-level singletons read their directory from the settings when they are created, so they are
+        patched as well
+        """
+        dirs = {name: os.path.join(tmp_dir, name) for name in ["http_cache", "sde_cache", "price_history", "order_books"]}
+        stack.enter_context(override_settings(
+            CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+            HTTP_CACHE_DIR = dirs["http_cache"],
+            SDE_CACHE_DIR = dirs["sde_cache"],
+            PRICE_HISTORY_DIR = dirs["price_history"],
+            ORDER_BOOK_DIR = dirs["order_books"]
+        ))
+        for adapter in endpoints.session.adapters.values():
+            stack.enter_context(mock.patch.object(adapter.cache, "cache_dir", dirs["http_cache"]))
+        stack.enter_context(mock.patch.object(sde.offline_sde, "cache_dir", dirs["sde_cache"]))
+        stack.enter_context(mock.patch.object(history.price_history, "history_dir", dirs["price_history"]))
+        stack.enter_context(mock.patch.object(orderbook.order_books, "book_dir", dirs["order_books"]))
+
+    def _get_sde_rows(self, n_items: int) -> list[dict]:
+        return [{"typeID": type_id, "groupID": type_id % 1000, "typeName": f"Item {type_id}"} for type_id in range(1, n_items + 1)]
+
+    def _get_item_prices(self, type_ids: list[int], regionId: int = 30000142):
+        # Deterministic stand-in for the Fuzzworks aggregates endpoint
+        res = {}
+        for type_id in type_ids:
+            buy = float(type_id % 9973 * 1000 + 100)
+            sell = buy * 1.1
+            res[str(type_id)] = {"buy": buy, "split": (buy + sell) / 2, "sell": sell}
+        return 200, res
+
+    def _get_changed_item_prices(self, type_ids: list[int], regionId: int = 30000142):
+        status, res = self._get_item_prices(type_ids, regionId)
+        return status, {key: {price_type: price * 1.05 for price_type, price in value.items()} for key, value in res.items()}
+
+    def create_fixtures(self, n_items: int, n_corps: int, n_offers: int) -> Character:
+        corps = []
+        for corp_index in range(n_corps):
+            offers = {}
+            for offer_index in range(n_offers):
+                offers[str(corp_index * n_offers + offer_index + 1)] = {
+                    "isk_cost": self.rng.randrange(0, 10_000_000, 1000),
+                    "lp_cost": self.rng.choice([0, 100, 500, 1000, 2500, 5000, 10000]),
+                    "required_items": [
+                        {"quantity": self.rng.randint(1, 10), "type_id": self.rng.randint(1, n_items)}
+                        for _ in range(self.rng.randint(0, INPUTS_PER_OFFER))
+                    ],
+                    "received_items": {"quantity": self.rng.randint(1, 5), "type_id": self.rng.randint(1, n_items)}
+                }
+            corps.append(Corp(corp_name=f"Corp {corp_index}", corp_id=1000000 + corp_index, offers=offers))
+        Corp.objects.bulk_create(corps)
+        data.update_offer_tables(list(Corp.objects.all()))
+        return Character.objects.create(
+            char_name = "Benchmark",
+            char_id = 1,
+            wallet = {},
+            loyalty_points = {"CONCORD": 1000000},
+            last_updated = timezone.now()
+        )
+
+    def measure(self, label: str, func, *args, **kwargs):
+        gc.collect()
+        output = io.StringIO() if not self.verbose else self.stdout
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries, redirect_stdout(output):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f"{label:<40} {wall:>10.3f} {len(queries):>10} {peak / 2 ** 20:>12.1f}")
+
+    def run_benchmarks(self, n_items: int, n_corps: int, n_offers: int):
+        start = time.perf_counter()
+        char = self.create_fixtures(n_items, n_corps, n_offers)
+        self.stdout.write(f"Fixtures created in {time.perf_counter() - start:.2f}s\n")
+        self.stdout.write(f"{'hot path':<40} {'wall (s)':>10} {'queries':>10} {'peak (MiB)':>12}")
+
+        sde_rows = self._get_sde_rows(n_items)
+        with mock.patch.object(data, "stream_static_data", lambda: iter(sde_rows)), \
+                mock.patch.object(data, "update_sde_prices"):
+            self.measure("update_sde (initial import)", data.update_sde, offline=False)
+            self.measure("update_sde (no changes)", data.update_sde, offline=False)
+            sde_rows[::10] = [{**row, "typeName": row["typeName"] + " II"} for row in sde_rows[::10]]
+            self.measure("update_sde (10% changed)", data.update_sde, offline=False)
+
+        with mock.patch.object(data, "get_item_prices", self._get_item_prices):
+            self.measure("update_sde_prices", data.update_sde_prices)
+        self.measure("rebuild_rankings", rankings.rebuild_rankings)
+        with mock.patch.object(data, "get_item_prices", self._get_changed_item_prices):
+            hot_type_ids = rankings.get_most_used_inputs(500)
+            self.measure("update_sde_prices (500 most used inputs)", data.update_sde_prices, type_ids=hot_type_ids)
+
+        converter = convert.LPConverter(char)
+        corps = list(Corp.objects.all())
+        self.measure("calculate_isk_per_lp (one corp)", converter.calculate_isk_per_lp, corps[0])
+        self.measure("calculate_isk_per_lp (all corps)", lambda: [converter.calculate_isk_per_lp(corp) for corp in corps])
+        self.measure("get_profitable_trades", converter.get_profitable_trades)
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lp_trader.backend.standin import RecordingStore, StandinServer
+
+import os
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in server that records or replays ESI and Fuzzworks responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+        parser.add_argument("--port", type=int, default=8089, help="Port to listen on")
+        parser.add_argument(
+            "--dir",
+            default=getattr(settings, "STANDIN_RECORDINGS_DIR", os.path.join(settings.BASE_DIR, "standin_recordings")),
+            help="Directory to store recordings in"
+        )
+        parser.add_argument("--record", action="store_true", help="Forward requests upstream and record the responses")
+        parser.add_argument("--latency", type=float, default=0, help="Milliseconds of latency added to every response")
+        parser.add_argument("--jitter", type=float, default=0, help="Max. milliseconds of random latency on top of --latency")
+        parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with an injected 5xx error")
+        parser.add_argument("--error-limit", type=int, default=100, help="Number of ESI errors allowed per error limit window")
+        parser.add_argument("--error-limit-window", type=int, default=60, help="Length of the ESI error limit window in seconds")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for latency jitter and error injection")
+
+    def handle(self, *args, **options):
+        server = StandinServer(
+            (options["host"], options["port"]),
+            RecordingStore(options["dir"]),
+            record = options["record"],
+            latency = options["latency"] / 1000,
+            jitter = options["jitter"] / 1000,
+            error_rate = options["error_rate"],
+            error_limit = options["error_limit"],
+            error_limit_window = options["error_limit_window"],
+            seed = options["seed"]
+        )
+        mode = "Recording" if options["record"] else "Replaying"
+        base_url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f"{mode} {options['dir']} on {base_url}")
+        self.stdout.write(f"  ESI_API_URL = '{base_url}/esi/'")
+        self.stdout.write(f"  FUZZWORK_DUMP_URL = '{base_url}/fuzzwork/dump/latest'")
+        self.stdout.write(f"  FUZZWORK_MARKET_URL = '{base_url}/market'")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
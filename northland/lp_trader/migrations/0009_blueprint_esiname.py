@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0008_corp_lp_exchange_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blueprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_name', models.CharField(max_length=300)),
+                ('item_id', models.IntegerField()),
+                ('baseME', models.IntegerField(default=0)),
+                ('baseTE', models.IntegerField(default=0)),
+                ('input_materials', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EsiName',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('esi_id', models.IntegerField(unique=True)),
+                ('name', models.CharField(db_index=True, max_length=300)),
+                ('category', models.CharField(max_length=50)),
+            ],
+        ),
+    ]
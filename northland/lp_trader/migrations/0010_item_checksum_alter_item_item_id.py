@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0009_blueprint_esiname'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='checksum',
+            field=models.CharField(default='', max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='item_id',
+            field=models.IntegerField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_offers(apps, schema_editor):
+    Corp = apps.get_model("lp_trader", "Corp")
+    Offer = apps.get_model("lp_trader", "Offer")
+    OfferInput = apps.get_model("lp_trader", "OfferInput")
+    for corp in Corp.objects.all():
+        for offer_id, details in corp.offers.items():
+            offer = Offer.objects.create(
+                corp=corp,
+                offer_id=int(offer_id),
+                lp_cost=details["lp_cost"],
+                isk_cost=details["isk_cost"],
+                type_id=details["received_items"]["type_id"],
+                quantity=details["received_items"]["quantity"]
+            )
+            OfferInput.objects.bulk_create([
+                OfferInput(offer=offer, type_id=entry["type_id"], quantity=entry["quantity"])
+                for entry in details["required_items"]
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0010_item_checksum_alter_item_item_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Offer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offer_id', models.IntegerField(db_index=True)),
+                ('lp_cost', models.IntegerField()),
+                ('isk_cost', models.BigIntegerField()),
+                ('type_id', models.IntegerField(db_index=True)),
+                ('quantity', models.IntegerField()),
+                ('corp', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lp_trader.corp')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OfferInput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_id', models.IntegerField(db_index=True)),
+                ('quantity', models.IntegerField()),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inputs', to='lp_trader.offer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='offer',
+            constraint=models.UniqueConstraint(fields=('corp', 'offer_id'), name='unique_corp_offer'),
+        ),
+        migrations.RunPython(populate_offers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0011_offer_offerinput_offer_unique_corp_offer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ranking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('isk_per_lp', models.FloatField(db_index=True)),
+                ('computed_at', models.DateTimeField(verbose_name='Computed At')),
+                ('price_snapshot', models.DateTimeField(null=True, verbose_name='Price Snapshot')),
+                ('corp', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lp_trader.corp')),
+                ('offer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ranking', to='lp_trader.offer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['corp', '-isk_per_lp'], name='ranking_corp_isk_per_lp_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0013_refreshjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blueprint',
+            name='product_id',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blueprint',
+            name='product_quantity',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='blueprint',
+            name='item_id',
+            field=models.IntegerField(db_index=True),
+        ),
+    ]
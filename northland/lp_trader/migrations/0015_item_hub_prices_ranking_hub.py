@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0014_blueprint_product_id_blueprint_product_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='hub_prices',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='hub',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
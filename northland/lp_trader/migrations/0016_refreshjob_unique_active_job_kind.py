@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    # Keep only the newest queued or running job of each kind, so the constraint can be added
+    RefreshJob = apps.get_model("lp_trader", "RefreshJob")
+    seen = set()
+    duplicates = []
+    for job in RefreshJob.objects.filter(status__in=["queued", "running"]).order_by("-created_at"):
+        if job.kind in seen:
+            duplicates.append(job.pk)
+        seen.add(job.kind)
+    RefreshJob.objects.filter(pk__in=duplicates).update(status="failed", error="Duplicate job")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lp_trader', '0015_item_hub_prices_ranking_hub'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='refreshjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('kind',), name='unique_active_job_kind'),
+        ),
+    ]
@@ -1,7 +1,9 @@
+from django.core.cache import cache
 from django.db import models
 from django.utils import timezone
 
 import datetime
+import uuid
 
 # Create your models here.
 class Corp(models.Model):
@@ -53,11 +55,15 @@ class Item(models.Model):
     Django model for Item object
     """
     item_name = models.CharField(max_length=300)
-    item_id = models.IntegerField()
+    item_id = models.IntegerField(db_index=True)
+    checksum = models.CharField(max_length=40, default="") # Checksum of the item's SDE row, used to diff SDE updates
     # JSON will contain Jita buy, split and sell values of item
     # e.g. 
     # plex = Item(item_name="PLEX", item_id="44992", market_price={"buy": 4500000, "split": 4750000, "sell": 5000000})
     market_price = models.JSONField() 
+    # Buy, split and sell values of the item in every hub of settings.MARKET_HUBS, keyed by hub name
+    # e.g. {"Jita": {"buy": 4500000, "split": 4750000, "sell": 5000000}, "Amarr": {...}}
+    hub_prices = models.JSONField(default=dict)
 
     last_updated = models.DateTimeField("Last Updated")
     pull_data = models.BooleanField(default=True)
@@ -83,12 +89,146 @@ class Blueprint(models.Model):
     Django model for Blueprint object
     """
     item_name = models.CharField(max_length=300)
-    item_id = models.IntegerField()
+    item_id = models.IntegerField(db_index=True)
 
     baseME = models.IntegerField(default=0)
     baseTE = models.IntegerField(default=0)
 
-    input_materials = models.JSONField()
+    # Manufacturing output of a single run
+    product_id = models.IntegerField(null=True, db_index=True)
+    product_quantity = models.IntegerField(default=1)
+
+    input_materials = models.JSONField() # Material type ID -> quantity per run
+
+    def __str__(self):
+        return self.item_name
+
+class EsiName(models.Model):
+    """
+    Django model for a cached ID to name resolution from ESI. Corp and type names never change,
+    so cached entries never expire
+    """
+    esi_id = models.IntegerField(unique=True)
+    name = models.CharField(max_length=300, db_index=True)
+    category = models.CharField(max_length=50)
+
+    def __str__(self):
+        return self.name
+
+
+class Offer(models.Model):
+    """
+    Django model for a single LP store offer, normalized out of Corp.offers so that offers can be indexed and ranked in SQL
+    """
+    corp = models.ForeignKey(Corp, on_delete=models.CASCADE)
+    offer_id = models.IntegerField(db_index=True)
+    lp_cost = models.IntegerField()
+    isk_cost = models.BigIntegerField()
+
+    # Received item
+    type_id = models.IntegerField(db_index=True)
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["corp", "offer_id"], name="unique_corp_offer")
+        ]
+
+    def __str__(self):
+        return f"{self.corp} offer {self.offer_id}"
+
+
+class OfferInput(models.Model):
+    """
+    Django model for an item required by an LP store offer
+    """
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name="inputs")
+    type_id = models.IntegerField(db_index=True)
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.quantity}x {self.type_id}"
+
+
+class Ranking(models.Model):
+    """
+    Django model for the precomputed ISK/LP rate of an LP store offer. The table is rebuilt after every
+    price or loyalty store refresh, so rankings can be read without recalculating them
+    """
+    offer = models.OneToOneField(Offer, on_delete=models.CASCADE, related_name="ranking")
+    corp = models.ForeignKey(Corp, on_delete=models.CASCADE)
+    isk_per_lp = models.FloatField(db_index=True)
+    hub = models.CharField(max_length=100, blank=True, default="") # Market hub the received item sells best in
+
+    computed_at = models.DateTimeField("Computed At")
+    price_snapshot = models.DateTimeField("Price Snapshot", null=True) # last_updated of the newest price used
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["corp", "-isk_per_lp"], name="ranking_corp_isk_per_lp_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.offer}: {self.isk_per_lp}"
+
+
+
+class RefreshJob(models.Model):
+    """
+    Django model for a background refresh job (see lp_trader.tasks). Only one job of each kind can be
+    queued or running at a time
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCESS, "Success"),
+        (FAILED, "Failed")
+    ]
+    ACTIVE_STATUSES = [QUEUED, RUNNING]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    kind = models.CharField(max_length=50, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField("Created At", auto_now_add=True)
+    updated_at = models.DateTimeField("Updated At", auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_active_job_kind"
+            )
+        ]
+
+    def get_heartbeat_key(self) -> str:
+        return f"lp_trader_job_heartbeat_{self.job_id}"
+
+    def is_active(self) -> bool:
+        """
+        Checks if the job is queued or running, and has reported in within the last hour, either by saving the
+        job or through the heartbeat its worker keeps in the cache while running it (jobs of crashed workers are
+        considered stale after that). The heartbeat keeps a job with a single long stage active, as the job itself
+        is only saved at stage boundaries
+
+        Args:
+            None
+
+        Returns:
+            bool: Job is still active
+        """
+        if self.status not in (self.QUEUED, self.RUNNING):
+            return False
+        cutoff = timezone.now() - datetime.timedelta(hours=1)
+        heartbeat = cache.get(self.get_heartbeat_key())
+        return cutoff <= self.updated_at or (heartbeat is not None and cutoff.timestamp() <= heartbeat)
 
     def __str__(self):
-        return self.item_name
\ No newline at end of file
+        return f"{self.kind} ({self.job_id}): {self.status}"
@@ -0,0 +1,81 @@
+from celery import shared_task
+from django.conf import settings
+
+from .backend import data, jobs
+from .models import *
+
+
+@shared_task
+def refresh_characters(job_id: str | None = None):
+    with jobs.run_job("characters", job_id) as job:
+        if job is None:
+            return
+        data.update_characters(force=True, progress=jobs.ProgressReporter(job))
+
+@shared_task
+def refresh_corps(job_id: str | None = None):
+    with jobs.run_job("corps", job_id) as job:
+        if job is None:
+            return
+        corp_ids = Corp.objects.values_list("corp_id", flat=True)
+        data.update_corp_loyalty_stores(list(corp_ids), progress=jobs.ProgressReporter(job))
+
+@shared_task
+def refresh_items(job_id: str | None = None):
+    with jobs.run_job("items", job_id) as job:
+        if job is None:
+            return
+        data.update_sde(progress=jobs.ProgressReporter(job))
+
+@shared_task
+def refresh_prices(job_id: str | None = None):
+    with jobs.run_job("prices", job_id) as job:
+        if job is None:
+            return
+        data.update_sde_prices(progress=jobs.ProgressReporter(job))
+
+@shared_task
+def refresh_hot_prices(job_id: str | None = None):
+    with jobs.run_job("hot_prices", job_id) as job:
+        if job is None:
+            return
+        type_ids = data.get_most_used_inputs(getattr(settings, "HOT_PRICE_REFRESH_SIZE", 500))
+        data.update_sde_prices(progress=jobs.ProgressReporter(job), type_ids=type_ids)
+
+@shared_task
+def refresh_order_books(job_id: str | None = None):
+    with jobs.run_job("orders", job_id) as job:
+        if job is None:
+            return
+        data.update_order_books(progress=jobs.ProgressReporter(job))
+
+
+JOB_TASKS = {
+    "characters": refresh_characters,
+    "corps": refresh_corps,
+    "items": refresh_items,
+    "prices": refresh_prices,
+    "hot_prices": refresh_hot_prices,
+    "orders": refresh_order_books
+}
+
+def enqueue_job(kind: str) -> RefreshJob:
+    """
+    Queues a background refresh job, or returns the already active job of the same kind
+
+    Args:
+        kind (str): The kind of job, one of "characters", "corps", "items", "prices", "hot_prices" or "orders"
+
+    Returns:
+        RefreshJob
+    """
+    job, created = jobs.create_job(kind)
+    if created:
+        try:
+            JOB_TASKS[kind].apply_async(kwargs={"job_id": str(job.job_id)}, task_id=str(job.job_id))
+        except Exception as e:
+            job.status = RefreshJob.FAILED
+            job.error = str(e)
+            job.save(update_fields=["status", "error", "updated_at"])
+            raise e
+    return job
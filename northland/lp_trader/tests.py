@@ -1,3 +1,1020 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from unittest import mock
 
-# Create your tests here.
+from . import tasks, views
+from .backend import convert, data, endpoints, history, industry, jobs, names, orderbook, prices, queries, rankings, sde, standin, tokens
+from .backend import metrics as metrics_module
+from .backend import scheduler as scheduler_module
+from .backend.engine import OfferEngine
+from .backend.cache import *
+from .models import *
+
+import io
+import itertools
+import json
+import multiprocessing
+import numpy as np
+import os
+import re
+import requests
+import tempfile
+import threading
+import time
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def _price(value: float) -> dict:
+    return {"buy": value, "split": value, "sell": value}
+
+
+def _corp(corp_id: int, offers: dict) -> Corp:
+    corp = Corp.objects.create(corp_name=f"Corp {corp_id}", corp_id=corp_id, lp_exchange_rate=1, offers=offers)
+    data.update_offer_tables([corp])
+    return corp
+
+
+def _response(body: bytes, headers: dict | None = None, status_code: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def _offer(lp_cost: int, isk_cost: int, received: tuple, inputs: list[tuple] = ()) -> dict:
+    return {
+        "isk_cost": isk_cost,
+        "lp_cost": lp_cost,
+        "required_items": [{"quantity": quantity, "type_id": type_id} for type_id, quantity in inputs],
+        "received_items": {"quantity": received[1], "type_id": received[0]}
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LoyaltyStoreUpdateTests(TestCase):
+    def test_unresolved_corp_names_only_skip_their_stores(self):
+        offers = {1: {"1": _offer(100, 0, (34, 1))}, 2: {"2": _offer(100, 0, (35, 1))}}
+        with mock.patch.object(data, "get_loyalty_store_offers", lambda corp_id: offers[corp_id]), \
+                mock.patch.object(data, "resolve_ids_to_names", lambda ids: {1: "Resolved Corp"}), \
+                mock.patch.object(data, "rebuild_rankings") as rebuild_rankings:
+            success = data.update_corp_loyalty_stores([1, 2])
+
+        self.assertFalse(success)
+        self.assertEqual(list(Corp.objects.values_list("corp_id", flat=True)), [1])
+        self.assertEqual(Offer.objects.count(), 1)
+        rebuild_rankings.assert_called_once()
+
+    def test_ranking_failures_are_not_reported_as_store_failures(self):
+        with mock.patch.object(data, "get_loyalty_store_offers", lambda corp_id: {"1": _offer(100, 0, (34, 1))}), \
+                mock.patch.object(data, "resolve_ids_to_names", lambda ids: {1: "Corp"}), \
+                mock.patch.object(data, "rebuild_rankings", side_effect=RuntimeError("ranking failed")):
+            with self.assertRaises(RuntimeError):
+                data.update_corp_loyalty_stores([1])
+        self.assertEqual(Corp.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LoyaltyPointNameTests(TestCase):
+    def test_named_loyalty_points_use_the_name_cache(self):
+        EsiName.objects.create(esi_id=1000125, name="CONCORD", category="corporation")
+        esi = mock.MagicMock()
+        esi.client.Loyalty.get_characters_character_id_loyalty_points.return_value.results.return_value = [
+            {"corporation_id": 1000125, "loyalty_points": 500}
+        ]
+        with mock.patch.object(endpoints, "esi", esi), \
+                mock.patch.object(endpoints, "get_access_token", lambda token: "access token"), \
+                mock.patch.object(names, "post_ids_to_names", side_effect=AssertionError("cache miss")):
+            loyalty_points = endpoints.get_loyalty_points(mock.Mock(character_id=1), raw=False)
+        self.assertEqual(loyalty_points, {"CONCORD": 500})
+
+    def test_unresolved_corp_names_keep_their_ids(self):
+        EsiName.objects.create(esi_id=1000125, name="CONCORD", category="corporation")
+        esi = mock.MagicMock()
+        esi.client.Loyalty.get_characters_character_id_loyalty_points.return_value.results.return_value = [
+            {"corporation_id": 1000125, "loyalty_points": 500}, {"corporation_id": 98000001, "loyalty_points": 20}
+        ]
+        with mock.patch.object(endpoints, "esi", esi), \
+                mock.patch.object(endpoints, "get_access_token", lambda token: "access token"), \
+                mock.patch.object(names, "post_ids_to_names", return_value=[]):
+            loyalty_points = endpoints.get_loyalty_points(mock.Mock(character_id=1), raw=False)
+        self.assertEqual(loyalty_points, {"CONCORD": 500, 98000001: 20})
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.session = requests.Session()
+        self.session.mount("https://", CachingHTTPAdapter(ResponseCache(cache_dir.name)))
+
+    def _get(self, network_send, *args, **kwargs) -> requests.Response:
+        with mock.patch.object(HTTPAdapter, "send", network_send):
+            return self.session.get(*args, **kwargs)
+
+    def test_authorized_requests_are_not_cached(self):
+        network_send = mock.Mock(side_effect=lambda *args, **kwargs: _response(b"{}", {"Cache-Control": "max-age=60"}))
+        for token in ["a", "b"]:
+            response = self._get(network_send, "https://esi.test/wallet", headers={"Authorization": f"Bearer {token}"})
+            self.assertFalse(response.from_cache)
+        self.assertEqual(network_send.call_count, 2)
+
+    def test_vary_headers_must_match(self):
+        headers = {"Cache-Control": "max-age=60", "Vary": "Accept-Language"}
+        network_send = mock.Mock(side_effect=lambda *args, **kwargs: _response(b"{}", headers))
+        self._get(network_send, "https://esi.test/types", headers={"Accept-Language": "en"})
+        self.assertTrue(self._get(network_send, "https://esi.test/types", headers={"Accept-Language": "en"}).from_cache)
+        self.assertFalse(self._get(network_send, "https://esi.test/types", headers={"Accept-Language": "de"}).from_cache)
+        self.assertEqual(network_send.call_count, 2)
+
+    def test_revalidated_responses_are_closed(self):
+        network_send = mock.Mock(return_value=_response(b"[1]", {"ETag": "v1"}))
+        self._get(network_send, "https://esi.test/prices")
+        not_modified = _response(b"", {"Cache-Control": "max-age=60"}, status_code=304)
+        network_send.return_value = not_modified
+        response = self._get(network_send, "https://esi.test/prices")
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.json(), [1])
+        self.assertTrue(not_modified.raw.closed)
+
+    def test_static_data_is_streamed_from_disk(self):
+        body = (
+            "typeID,groupID,typeName,description,published\n"
+            '34,18,Tritanium,"The main building block\nin space structures",1\n'
+            '35,18,Pyerite,"",0\n'
+            '36,18,Mexallon,"Very flexible\n\nmetallic",1\n'
+        ).encode("utf-8")
+        network_send = mock.Mock(side_effect=lambda *args, **kwargs: _response(body, {"Cache-Control": "max-age=60"}))
+        with mock.patch.object(endpoints, "session", self.session), mock.patch.object(HTTPAdapter, "send", network_send):
+            for _ in range(2):
+                rows = list(endpoints.stream_static_data())
+                self.assertEqual(rows, [
+                    {"typeID": 34, "groupID": 18, "typeName": "Tritanium"},
+                    {"typeID": 36, "groupID": 18, "typeName": "Mexallon"}
+                ])
+        self.assertEqual(network_send.call_count, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobDeduplicationTests(TestCase):
+    def test_duplicate_enqueue_returns_the_active_job(self):
+        task = mock.Mock()
+        with mock.patch.dict(tasks.JOB_TASKS, {"items": task}):
+            first = tasks.enqueue_job("items")
+            second = tasks.enqueue_job("items")
+        self.assertEqual(first.job_id, second.job_id)
+        task.apply_async.assert_called_once()
+
+    def test_concurrent_create_falls_back_to_the_winning_job(self):
+        winner = RefreshJob.objects.create(kind="items")
+        # The first check misses the winner, as if it was inserted right after it
+        with mock.patch.object(jobs, "get_active_job", side_effect=[None, winner]):
+            job, created = jobs.create_job("items")
+        self.assertFalse(created)
+        self.assertEqual(job, winner)
+        self.assertEqual(RefreshJob.objects.filter(kind="items").count(), 1)
+
+    def test_active_jobs_are_unique_per_kind(self):
+        RefreshJob.objects.create(kind="items")
+        RefreshJob.objects.create(kind="items", status=RefreshJob.SUCCESS)
+        with self.assertRaises(IntegrityError):
+            RefreshJob.objects.create(kind="items", status=RefreshJob.RUNNING)
+
+    def test_stale_jobs_do_not_block_new_jobs(self):
+        stale = RefreshJob.objects.create(kind="items")
+        RefreshJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=2))
+        job, created = jobs.create_job("items")
+        self.assertTrue(created)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, RefreshJob.FAILED)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobHeartbeatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _age(self, job: RefreshJob):
+        RefreshJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=2))
+        job.refresh_from_db()
+
+    def test_long_running_stage_stays_active(self):
+        with jobs.run_job("items") as job:
+            # A single stage running for longer than the staleness window
+            self._age(job)
+            self.assertTrue(job.is_active())
+            duplicate, created = jobs.create_job("items")
+            self.assertFalse(created)
+            self.assertEqual(duplicate, job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.SUCCESS)
+
+    def test_job_without_heartbeat_goes_stale(self):
+        job = RefreshJob.objects.create(kind="items", status=RefreshJob.RUNNING)
+        with jobs._heartbeat(job):
+            self._age(job)
+            self.assertTrue(job.is_active())
+        # The worker crashed without marking the job as failed, and its heartbeat expired
+        cache.delete(job.get_heartbeat_key())
+        self.assertFalse(job.is_active())
+
+    def test_heartbeat_repeats_until_the_job_exits(self):
+        job = RefreshJob.objects.create(kind="items", status=RefreshJob.RUNNING)
+        with mock.patch.object(jobs.time, "time", side_effect=itertools.count()):
+            with jobs._heartbeat(job, interval=0.01):
+                time.sleep(0.1)
+            last_beat = cache.get(job.get_heartbeat_key())
+            time.sleep(0.05)
+            self.assertGreater(last_beat, 1)
+            self.assertEqual(cache.get(job.get_heartbeat_key()), last_beat)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobStreamTests(TestCase):
+    async def _stream(self, job: RefreshJob) -> str:
+        response = await self.async_client.get(reverse("lp_trader:stream_job", args=[job.job_id]))
+        return "".join([chunk.decode("utf-8") async for chunk in response.streaming_content])
+
+    async def test_stream_of_running_job_is_capped(self):
+        job = await RefreshJob.objects.acreate(kind="items", status=RefreshJob.RUNNING)
+        with mock.patch.object(views, "JOB_STREAM_DURATION", 0.1):
+            content = await self._stream(job)
+        self.assertIn('"status": "running"', content)
+        self.assertTrue(content.endswith(f"retry: {views.JOB_STREAM_RETRY}\n\n"))
+
+    async def test_stream_of_finished_job_ends_with_done(self):
+        job = await RefreshJob.objects.acreate(kind="items", status=RefreshJob.SUCCESS)
+        self.assertIn("event: done", await self._stream(job))
+
+    async def test_stream_picks_up_status_changes(self):
+        job = await RefreshJob.objects.acreate(kind="items", status=RefreshJob.RUNNING)
+
+        async def finish_job(interval):
+            await RefreshJob.objects.filter(pk=job.pk).aupdate(status=RefreshJob.SUCCESS)
+
+        with mock.patch.object(views.asyncio, "sleep", side_effect=finish_job) as sleep:
+            with mock.patch.object(views.time, "time", side_effect=range(0, 100, 2)):
+                content = await self._stream(job)
+        self.assertIn('"status": "running"', content)
+        self.assertIn("event: done", content)
+        sleep.assert_called_once()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RankingTestCase(TestCase):
+    """
+    Base class for tests of the ranking pipeline, which resets its module-level in-memory singletons
+    """
+    def setUp(self):
+        for singleton, attribute in [(orderbook.order_books, "book_dir"), (history.price_history, "history_dir")]:
+            tmp_dir = tempfile.TemporaryDirectory()
+            self.addCleanup(tmp_dir.cleanup)
+            patcher = mock.patch.object(singleton, attribute, tmp_dir.name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        rankings.compiled_offers.invalidate()
+        prices.price_index.invalidate()
+        prices.hub_price_matrix.__init__()
+        industry.build_cost_engine.__init__()
+
+    def _item(self, type_id: int, price: dict):
+        Item.objects.create(item_name=f"Item {type_id}", item_id=type_id, market_price=price, last_updated=timezone.now())
+
+
+class RankingPaginationTests(RankingTestCase):
+    def _get_page(self, cursor: str | None) -> dict:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = self.client.get(reverse("lp_trader:api_rankings"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_survives_rankings_updates(self):
+        self._item(34, _price(10))
+        self._item(35, _price(10))
+        # Every offer has the same ISK/LP rate, so pages are only ordered by the cursor's tie-breaker
+        _corp(1, {str(offer_id): _offer(10, 0, (34 if offer_id % 2 else 35, 1)) for offer_id in range(1, 7)})
+        rankings.rebuild_rankings()
+        expected = list(Ranking.objects.order_by("-offer_id").values_list("offer__offer_id", flat=True))
+
+        seen, cursor = [], None
+        while True:
+            page = self._get_page(cursor)
+            seen.extend(row["offer_id"] for row in page["results"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+            # Recreates the Ranking rows of half the offers, with new IDs
+            rankings.update_rankings([35])
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_is_rejected(self):
+        response = self.client.get(reverse("lp_trader:api_rankings"), {"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class PriceSmoothingTests(RankingTestCase):
+    def test_top_offers_can_rank_against_rolling_prices(self):
+        self._item(34, _price(1000))
+        _corp(1, {"1": _offer(10, 0, (34, 1))})
+        # A one-off spike to 1000 ISK after two snapshots at 100 ISK
+        for timestamp, value in [(1, 100), (2, 100), (3, 1000)]:
+            history.price_history.append({"34": _price(value)}, timestamp=timestamp)
+        converter = convert.LPConverter(mock.Mock(loyalty_points={"CONCORD": 0}))
+        with mock.patch.object(convert, "check_for_item_update", lambda: False):
+            current = converter.get_top_offers(smoothing_window=0)
+            smoothed = converter.get_top_offers(smoothing_window=3)
+            with self.settings(PRICE_SMOOTHING_WINDOW=3):
+                default = converter.get_top_offers()
+        self.assertEqual(current[0].isk_per_lp, 100)
+        self.assertEqual(smoothed[0].isk_per_lp, 10)
+        self.assertEqual(default[0].isk_per_lp, 10)
+
+
+class UnpricedItemTests(RankingTestCase):
+    def test_offline_import_then_rebuild_rankings(self):
+        sde_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(sde_dir.cleanup)
+        source = os.path.join(sde_dir.name, "data.json")
+        with open(source, "w") as file:
+            json.dump([{"typeID": 34, "typeName": "Tritanium"}, {"typeID": 35, "typeName": "Pyerite"}, {"typeID": 36, "typeName": "Mexallon"}], file)
+        self._item(36, _price(100))
+        corp = _corp(1, {
+            "1": _offer(10, 0, (35, 1), [(34, 1)]),
+            "2": _offer(10, 0, (36, 1)),
+            "3": _offer(10, 0, (36, 1), [(34, 1)])
+        })
+
+        with mock.patch.object(data, "offline_sde", sde.OfflineSDE(source, os.path.join(sde_dir.name, "cache"))):
+            data.update_sde(offline=True)
+        # Items new to the SDE are stored without prices
+        self.assertEqual(Item.objects.get(item_id=34).market_price, {})
+
+        self.assertEqual(rankings.rebuild_rankings(), 3)
+        isk_per_lp = dict(Ranking.objects.values_list("offer__offer_id", "isk_per_lp"))
+        # Unpriced items are worth nothing, and zero the input cost of their offer like items missing from the DB
+        self.assertEqual(isk_per_lp, {1: 0, 2: 10, 3: 10})
+        with mock.patch.object(convert, "check_for_item_update", lambda: False):
+            ranked = convert.LPConverter(mock.Mock(loyalty_points={"CONCORD": 0})).calculate_isk_per_lp(corp)
+        self.assertEqual(ranked[0], {"2": 10})
+
+
+class OfferEngineTests(RankingTestCase):
+    def setUp(self):
+        super().setUp()
+        for type_id, value in [(34, 5), (35, 10), (36, 1), (100, 500)]:
+            self._item(type_id, _price(value))
+        self.corps = [
+            _corp(1, {
+                "1": _offer(100, 0, (100, 2), [(34, 10), (34, 1)]),
+                "2": _offer(10, 50, (35, 1)),
+                "3": _offer(10, 0, (35, 1), [(999, 1)]), # Input missing from the DB
+                "4": _offer(0, 0, (36, 1))
+            }),
+            _corp(2, {"7": _offer(10, 0, (34, 1), [(100, 1)]), "8": _offer(20, 0, (100, 1), [(36, 3)])})
+        ]
+        self.engine = OfferEngine().compile()
+
+    def test_matches_calculate_isk_per_lp(self):
+        ranked = self.engine.rank_per_corp(self.engine.evaluate(self.engine.build_price_vector()))
+        converter = convert.LPConverter(mock.Mock(loyalty_points={"CONCORD": 0}))
+        with mock.patch.object(convert, "check_for_item_update", lambda: False):
+            expected = [converter.calculate_isk_per_lp(corp) for corp in self.corps]
+        self.assertEqual(ranked, expected)
+
+    def test_top_k_filters(self):
+        prices = self.engine.build_price_vector()
+        top = self.engine.top_k(prices, k=2)
+        self.assertEqual([(record.corp_id, record.offer_id) for record in top], [(2, 8), (1, 1)])
+        self.assertEqual(top[0].input_cost, 3)
+        self.assertEqual(top[0].profit, 500)
+        without_36 = self.engine.top_k(prices, k=10, exclude_inputs=[36])
+        self.assertNotIn(8, [record.offer_id for record in without_36])
+        self.assertEqual([record.offer_id for record in self.engine.top_k(prices, corp_ids=[2])], [8, 7])
+
+    def test_subset_of_dependent_offers_matches_full_evaluation(self):
+        rows = self.engine.get_dependent_offers([34])
+        self.assertEqual(sorted(int(self.engine.offer_ids[row]) for row in rows), [1, 7])
+        subset = self.engine.subset(rows)
+        np.testing.assert_array_equal(
+            subset.evaluate(subset.build_price_vector()),
+            self.engine.evaluate(self.engine.build_price_vector())[rows]
+        )
+
+
+@override_settings(MARKET_HUBS={"Jita": 30000142})
+class IncrementalSyncTests(RankingTestCase):
+    def _sync(self, rows: list[dict]):
+        with mock.patch.object(data, "stream_static_data", lambda: iter(rows)), mock.patch.object(data, "update_sde_prices"):
+            data.update_sde(offline=False)
+
+    def test_sde_sync_only_writes_changes(self):
+        rows = [{"typeID": type_id, "groupID": 18, "typeName": f"Item {type_id}"} for type_id in [34, 35, 36]]
+        self._sync(rows)
+        Item.objects.filter(item_id=35).update(market_price=_price(10))
+        untouched = Item.objects.get(item_id=34).last_updated
+
+        self._sync([rows[0], {**rows[1], "typeName": "Pyerite"}, {"typeID": 37, "groupID": 18, "typeName": "Isogen"}])
+        items = {item.item_id: item for item in Item.objects.all()}
+        self.assertEqual(sorted(items), [34, 35, 37])
+        self.assertEqual(items[35].item_name, "Pyerite")
+        # Renamed items keep their prices, and unchanged rows are not rewritten
+        self.assertEqual(items[35].market_price, _price(10))
+        self.assertEqual(items[34].last_updated, untouched)
+
+    def test_partial_price_refresh_matches_full_rebuild(self):
+        for type_id in [34, 35, 36, 100]:
+            self._item(type_id, _price(type_id))
+        _corp(1, {
+            "1": _offer(100, 0, (100, 2), [(34, 10)]),
+            "2": _offer(10, 0, (35, 1), [(36, 1)]),
+            "3": _offer(10, 0, (36, 1))
+        })
+        rankings.rebuild_rankings()
+        unaffected = Ranking.objects.get(offer__offer_id=1).id
+
+        new_prices = {"36": _price(50)}
+        with mock.patch.object(data, "get_item_prices", lambda type_ids, regionId: (200, {
+            key: value for key, value in new_prices.items() if int(key) in type_ids
+        })):
+            data.update_sde_prices(type_ids=[36])
+        partial = dict(Ranking.objects.values_list("offer__offer_id", "isk_per_lp"))
+        # Only the offers using or paying out the repriced item are rewritten
+        self.assertEqual(Ranking.objects.get(offer__offer_id=1).id, unaffected)
+
+        rankings.rebuild_rankings()
+        self.assertEqual(partial, dict(Ranking.objects.values_list("offer__offer_id", "isk_per_lp")))
+        self.assertEqual(partial[3], 5)
+
+
+@override_settings(MARKET_HUBS={"Jita": 30000142, "Amarr": 30002187})
+class PriceChunkFailureTests(RankingTestCase):
+    def test_failed_chunks_keep_the_prices_of_the_rest(self):
+        for type_id in [34, 35, 36]:
+            Item.objects.create(
+                item_name=f"Item {type_id}", item_id=type_id, market_price=_price(1),
+                hub_prices={"Jita": _price(1), "Amarr": _price(2)}, last_updated=timezone.now()
+            )
+
+        def get_item_prices(type_ids, regionId):
+            if regionId == 30002187 and 35 in type_ids:
+                raise requests.ConnectionError("Connection reset")
+            return 200, {str(type_id): _price(type_id + regionId % 10) for type_id in type_ids}
+
+        with mock.patch.object(data, "get_item_prices", get_item_prices):
+            res = data.update_sde_prices(chunk_size=1)
+        self.assertEqual(sorted(res), ["34", "35", "36"])
+        items = {item.item_id: item for item in Item.objects.all()}
+        self.assertEqual(items[34].hub_prices, {"Jita": _price(36), "Amarr": _price(41)})
+        self.assertEqual(items[36].hub_prices, {"Jita": _price(38), "Amarr": _price(43)})
+        # The failed chunk keeps the last price of its hub
+        self.assertEqual(items[35].hub_prices, {"Jita": _price(37), "Amarr": _price(2)})
+        self.assertEqual(items[35].market_price, _price(37))
+
+
+class FakeClock():
+    """
+    Stand-in for the time module of the scheduler, where sleeping advances the clock
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RequestSchedulerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(scheduler_module, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_allows_bursts_then_refills_at_rate(self):
+        limiter = scheduler_module.HostLimiter(rate=10, burst=2)
+        self.assertEqual([limiter._take_token() for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(limiter._take_token(), 0.1)
+        self.clock.now += 1
+        # The bucket refills up to its burst size only
+        self.assertEqual([limiter._take_token() for _ in range(2)], [0, 0])
+        self.assertGreater(limiter._take_token(), 0)
+
+    def test_slot_sleeps_until_a_token_is_available(self):
+        limiter = scheduler_module.HostLimiter(rate=4, burst=1)
+        with limiter.slot():
+            pass
+        with limiter.slot() as waited:
+            self.assertAlmostEqual(waited, 0.25)
+        self.assertEqual(self.clock.slept, [0.25])
+
+    def test_error_budget_slows_down_then_stops(self):
+        limiter = scheduler_module.HostLimiter(error_slowdown=50, error_stop=10, max_slowdown=2.0)
+        limiter.record_response({"X-ESI-Error-Limit-Remain": "100", "X-ESI-Error-Limit-Reset": "30"})
+        self.assertEqual(limiter.get_error_delay(), 0)
+        limiter.record_response({"X-ESI-Error-Limit-Remain": "25", "X-ESI-Error-Limit-Reset": "30"})
+        self.assertAlmostEqual(limiter.get_error_delay(), 1.0)
+        limiter.record_response({"X-ESI-Error-Limit-Remain": "5", "X-ESI-Error-Limit-Reset": "30"})
+        self.assertAlmostEqual(limiter.get_error_delay(), 30)
+        self.clock.now += 30
+        self.assertEqual(limiter.get_error_delay(), 0)
+
+    def test_retries_are_jittered_and_bounded(self):
+        requests_scheduler = scheduler_module.RequestScheduler(limits={}, max_retries=2, backoff_base=0.5, backoff_cap=30)
+        with mock.patch.object(scheduler_module.random, "uniform", side_effect=lambda low, high: high) as uniform:
+            self.assertEqual(requests_scheduler.get_retry_delay("esi", _response(b"", status_code=503), 0), 0.5)
+            self.assertEqual(requests_scheduler.get_retry_delay("esi", _response(b"", status_code=502), 1), 1.0)
+            error_limited = _response(b"", {"X-ESI-Error-Limit-Reset": "12"}, status_code=420)
+            self.assertEqual(requests_scheduler.get_retry_delay("esi", error_limited, 0), 12.5)
+        # Full jitter: every delay is drawn from 0 up to the backoff
+        self.assertTrue(all(call.args[0] == 0 for call in uniform.call_args_list))
+        self.assertIsNone(requests_scheduler.get_retry_delay("esi", _response(b"", status_code=503), 2))
+        self.assertIsNone(requests_scheduler.get_retry_delay("esi", _response(b"", status_code=404), 0))
+
+
+class HostConcurrencyTests(TestCase):
+    def test_concurrent_requests_are_capped_per_host(self):
+        requests_scheduler = scheduler_module.RequestScheduler(limits={"esi": {"concurrency": 2, "rate": 1000, "burst": 1000}})
+        in_flight, peak, lock = [0], [0], threading.Lock()
+
+        def request(host: str):
+            with requests_scheduler.slot(host):
+                with lock:
+                    in_flight[0] += 1
+                    peak[0] = max(peak[0], in_flight[0])
+                time.sleep(0.02)
+                with lock:
+                    in_flight[0] -= 1
+
+        threads = [threading.Thread(target=request, args=("esi",)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertIsNot(requests_scheduler.get_limiter("esi"), requests_scheduler.get_limiter("fuzzwork"))
+
+
+class EsiClientRetryTests(TestCase):
+    def test_esi_futures_leave_retries_to_the_scheduler(self):
+        future = mock.Mock(future="future", response_adapter="adapter", operation="operation", request_config="config")
+        wrapped = endpoints._request_without_client_retries(lambda *args, **kwargs: future, {"url": "https://esi.test"})
+        self.assertIsInstance(wrapped, endpoints.SchedulerRetryHttpFuture)
+        with mock.patch.object(endpoints.CachingHttpFuture, "_result_with_retries", return_value=(None, None)) as result:
+            wrapped._result_with_retries(retries=3)
+        result.assert_called_once_with(retries=0)
+
+
+@override_settings(MARKET_HUBS={"Jita": 30000142})
+class PriceSnapshotTests(RankingTestCase):
+    def test_rankings_record_the_prices_they_were_computed_from(self):
+        for type_id in [34, 35]:
+            self._item(type_id, _price(type_id))
+        _corp(1, {"1": _offer(10, 0, (34, 1)), "2": _offer(10, 0, (35, 1))})
+        # A fresh worker: nothing but the ranking pass has loaded any prices
+        rankings.rebuild_rankings()
+        priced_at = Item.objects.order_by("-last_updated").values_list("last_updated", flat=True)[0]
+        self.assertEqual(set(Ranking.objects.values_list("price_snapshot", flat=True)), {priced_at})
+
+        with mock.patch.object(data, "get_item_prices", lambda type_ids, regionId: (200, {"35": _price(50)})):
+            data.update_sde_prices(type_ids=[35])
+        repriced_at = Item.objects.get(item_id=35).last_updated
+        self.assertGreater(repriced_at, priced_at)
+        self.assertEqual(Ranking.objects.get(offer__offer_id=2).price_snapshot, repriced_at)
+        self.assertEqual(Ranking.objects.get(offer__offer_id=1).price_snapshot, priced_at)
+
+
+def _token(pk: int, expires_in: int, access_token: str = "access") -> mock.Mock:
+    token = mock.Mock(pk=pk, character_id=pk, character_name=f"Character {pk}", access_token=access_token)
+    token.expires = timezone.now() + timezone.timedelta(seconds=expires_in)
+    return token
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AccessTokenCacheTests(TestCase):
+    def setUp(self):
+        self.access_tokens = tokens.AccessTokenCache(refresh_margin=60, lock_timeout=5)
+        # Refresh locks live in the Django cache, which is shared between tests
+        tokens.cache.clear()
+        self.addCleanup(tokens.cache.clear)
+
+    def _refresh_to(self, token: mock.Mock, access_token: str):
+        def refresh(*args, **kwargs):
+            token.access_token = access_token
+            token.expires = timezone.now() + timezone.timedelta(minutes=20)
+        return refresh
+
+    def test_fresh_tokens_are_reused_without_refreshing(self):
+        token = _token(1, 1200)
+        self.assertEqual(self.access_tokens.get(token), "access")
+        self.assertEqual(self.access_tokens.get(token), "access")
+        token.refresh.assert_not_called()
+        token.refresh_from_db.assert_called_once()
+
+    def test_tokens_are_refreshed_before_they_expire(self):
+        token = _token(1, 30)
+        token.refresh.side_effect = self._refresh_to(token, "refreshed")
+        self.assertEqual(self.access_tokens.get(token), "refreshed")
+        token.refresh.assert_called_once()
+        # Once refreshed, the new access token is served from the cache
+        self.assertEqual(self.access_tokens.get(token), "refreshed")
+        token.refresh.assert_called_once()
+
+    def test_refresh_running_in_another_process_is_waited_for(self):
+        token = _token(1, 30)
+        tokens.cache.add(f"lp_trader_token_refresh_{token.pk}", True, 30)
+        # The first reload happens under the lock, the second after another process stored its refresh
+        token.refresh_from_db.side_effect = [None, self._refresh_to(token, "from other process")()]
+        with mock.patch.object(tokens.time, "sleep"):
+            self.assertEqual(self.access_tokens.get(token), "from other process")
+        token.refresh.assert_not_called()
+
+    def test_invalidate_drops_the_cached_token(self):
+        token = _token(1, 1200)
+        self.access_tokens.get(token)
+        self.access_tokens.invalidate(token)
+        self.access_tokens.get(token)
+        self.assertEqual(token.refresh_from_db.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CharacterUpdateTests(TestCase):
+    def test_batched_pass_updates_every_character_it_can(self):
+        stale = timezone.now() - timezone.timedelta(hours=2)
+        Character.objects.create(char_name="Character 1", char_id=1, wallet=0, loyalty_points={}, last_updated=stale)
+        loyalty_points = {
+            1: [{"corporation_id": 1000125, "loyalty_points": 500}],
+            2: [{"corporation_id": 98000001, "loyalty_points": 20}]
+        }
+
+        def get_wallet(token, char_id):
+            if char_id == 3:
+                raise RuntimeError("ESI error")
+            return 1000 * char_id
+
+        with mock.patch.object(data, "get_character_wallet_balance", get_wallet), \
+                mock.patch.object(data, "get_loyalty_points", lambda token, raw: loyalty_points.get(token.character_id, [])), \
+                mock.patch.object(data, "resolve_ids_to_names", return_value={1000125: "CONCORD"}) as resolve_ids_to_names:
+            success = data.update_characters([_token(1, 1200), _token(2, 1200), _token(3, 1200)])
+
+        self.assertFalse(success)
+        # Corp names of every character are resolved in a single call
+        resolve_ids_to_names.assert_called_once()
+        self.assertEqual(sorted(resolve_ids_to_names.call_args.args[0]), [1000125, 98000001])
+        characters = {char.char_id: char for char in Character.objects.all()}
+        self.assertEqual(sorted(characters), [1, 2])
+        self.assertEqual(characters[1].wallet, 1000)
+        self.assertEqual(characters[1].loyalty_points, {"CONCORD": 500})
+        self.assertEqual(characters[2].loyalty_points, {"98000001": 20})
+
+
+def _append_history(history_dir: str, worker: int):
+    store = history.PriceHistory(history_dir)
+    for snapshot in range(5):
+        store.append({str(1000 * worker + type_id): _price(worker) for type_id in range(snapshot * 10, snapshot * 10 + 10)}, timestamp=1)
+
+
+class PriceHistoryTests(TestCase):
+    def setUp(self):
+        history_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(history_dir.cleanup)
+        self.history_dir = history_dir.name
+        self.store = history.PriceHistory(self.history_dir)
+
+    def test_appends_in_the_same_second_are_kept(self):
+        self.store.append({"34": _price(1)}, timestamp=100)
+        self.store.append({"34": _price(2)}, timestamp=100)
+        self.store.append({"34": _price(3)}, timestamp=100.5)
+        timestamps, type_ids, matrix = self.store.load("sell")
+        self.assertEqual(timestamps, [100, 100, 100])
+        self.assertEqual(matrix[:, 0].tolist(), [1, 2, 3])
+
+    def test_concurrent_appends_keep_the_column_layout(self):
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=_append_history, args=(self.history_dir, worker)) for worker in range(1, 7)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertTrue(all(worker.exitcode == 0 for worker in workers))
+
+        _, type_ids, matrix = self.store.load("sell")
+        self.assertEqual(sorted(type_ids.tolist()), sorted(1000 * w + t for w in range(1, 7) for t in range(50)))
+        self.assertEqual(len(matrix), 30)
+        # Every price landed in the column of its own type ID
+        for column, type_id in enumerate(type_ids.tolist()):
+            values = matrix[:, column]
+            self.assertEqual(set(values[~np.isnan(values)].tolist()), {type_id // 1000})
+
+
+class StandinTests(TestCase):
+    def setUp(self):
+        recordings_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(recordings_dir.cleanup)
+        self.store = standin.RecordingStore(recordings_dir.name)
+
+    def _serve(self, record: bool) -> standin.StandinServer:
+        server = standin.StandinServer(("127.0.0.1", 0), self.store, record=record)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def _get(self, server: standin.StandinServer, path: str) -> requests.Response:
+        return requests.get(f"http://127.0.0.1:{server.server_address[1]}{path}", timeout=5)
+
+    def _record(self, path: str, body: bytes):
+        server = self._serve(record=True)
+        upstream_response = _response(body, {"Content-Type": "application/json", "X-Pages": "2", "Set-Cookie": "a=b"})
+        with mock.patch.object(server.upstream_session, "request", return_value=upstream_response) as request:
+            self.assertEqual(self._get(server, path).content, body)
+        return request
+
+    def test_recorded_responses_are_replayed(self):
+        request = self._record("/esi/latest/markets/10000002/orders/?page=2&datasource=tranquility", b"[1, 2]")
+        self.assertEqual(request.call_args.args[:2], ("GET", "https://esi.evetech.net/latest/markets/10000002/orders/?page=2&datasource=tranquility"))
+
+        response = self._get(self._serve(record=False), "/esi/latest/markets/10000002/orders/?datasource=tranquility&page=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [1, 2])
+        self.assertEqual(response.headers["X-Pages"], "2")
+        self.assertNotIn("Set-Cookie", response.headers)
+        self.assertIn("X-ESI-Error-Limit-Remain", response.headers)
+
+    def test_request_with_unrecorded_query_is_not_replayed(self):
+        self._record("/market/aggregates/?region=10000002&types=34", b'{"34": {}}')
+        response = self._get(self._serve(record=False), "/market/aggregates/?region=10000002&types=35")
+        self.assertEqual(response.status_code, 404)
+
+    def test_request_without_query_falls_back_to_the_same_path(self):
+        self._record("/fuzzwork/dump/latest/invTypes.csv?v=1", b"typeID,typeName")
+        response = self._get(self._serve(record=False), "/fuzzwork/dump/latest/invTypes.csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"typeID,typeName")
+
+
+def _order(type_id: int, price: float, volume: int, is_buy: bool = False, system_id: int = 30000142) -> dict:
+    return {"type_id": type_id, "price": price, "volume_remain": volume, "is_buy_order": is_buy, "system_id": system_id}
+
+
+class OrderBookTests(TestCase):
+    def setUp(self):
+        self.book = orderbook.OrderBook.from_orders([
+            [_order(34, 6, 10), _order(34, 5, 10), _order(35, 100, 1), _order(34, 7, 5, system_id=1)],
+            [_order(34, 4, 20, is_buy=True), _order(34, 3, 5, is_buy=True), _order(36, 1, 1000)]
+        ], system_id=30000142)
+
+    def test_partial_fills_walk_the_book(self):
+        self.assertEqual(self.book.fill_cost(34, 4), 20)
+        self.assertEqual(self.book.fill_cost(34, 15), 50 + 30)
+        self.assertEqual(self.book.fill_cost(34, 22, "buy"), 80 + 6)
+
+    def test_fill_of_exact_depth(self):
+        self.assertEqual(self.book.fill_cost(34, 20), 110)
+        self.assertEqual(self.book.fill_cost(35, 1), 100)
+        self.assertEqual(self.book.fill_cost(34, 25, "buy"), 95)
+
+    def test_shortfall_is_unfillable(self):
+        np.testing.assert_array_equal(
+            self.book.fill_costs([34, 35, 36, 37], [21, 2, 1001, 1]),
+            [np.nan, np.nan, np.nan, np.nan]
+        )
+        self.assertIsNone(self.book.fill_cost(34, 26, "buy"))
+        np.testing.assert_array_equal(self.book.get_depth([34, 35, 37]), [20, 1, 0])
+
+    def test_cumulative_costs_are_per_segment(self):
+        rng = np.random.default_rng(0)
+        orders = np.column_stack([rng.integers(0, 50, 2000), rng.uniform(1, 1e9, 2000).round(2), rng.integers(1, 1000, 2000)])
+        side = orderbook.OrderBook._build_side(orders)
+        for start, end in zip(side["indptr"][:-1], side["indptr"][1:]):
+            values = side["prices"][start:end] * np.diff(side["cum_volume"][start:end + 1])
+            np.testing.assert_allclose(side["cum_cost"][start:end], np.concatenate([[0], np.cumsum(values[:-1])]), rtol=1e-12)
+
+
+class DepthRankingTests(RankingTestCase):
+    def setUp(self):
+        super().setUp()
+        for type_id, value in [(34, 5), (35, 10), (100, 500)]:
+            self._item(type_id, _price(value))
+        _corp(1, {"1": _offer(100, 0, (100, 1), [(34, 10)]), "2": _offer(100, 0, (35, 1), [(34, 30)])})
+        self.engine = OfferEngine().compile()
+        self.prices = self.engine.build_price_vector()
+
+    def test_offers_beyond_the_depth_of_every_hub_are_unfillable(self):
+        jita = orderbook.OrderBook.from_orders([[_order(34, 5, 20), _order(100, 600, 1, is_buy=True), _order(35, 50, 1, is_buy=True)]])
+        amarr = orderbook.OrderBook.from_orders([[_order(34, 4, 5)]])
+        isk_per_lp, received_hubs = self.engine.evaluate_depth([jita, amarr, None], self.prices)
+        self.assertEqual(isk_per_lp.tolist(), [(600 - 50) / 100, -1])
+        self.assertEqual(received_hubs.tolist(), [0, 0])
+
+    def test_items_without_orders_fall_back_to_prices(self):
+        isk_per_lp, received_hubs = self.engine.evaluate_depth([orderbook.OrderBook()], self.prices)
+        self.assertEqual(isk_per_lp.tolist(), [(500 - 50) / 100, (10 - 150) / 100])
+        self.assertEqual(received_hubs.tolist(), [-1, -1])
+
+
+class OfferQueryTests(RankingTestCase):
+    def setUp(self):
+        super().setUp()
+        for type_id, value in [(34, 5), (100, 500)]:
+            self._item(type_id, _price(value))
+        Item.objects.create(item_name="Unpriced", item_id=35, market_price={}, last_updated=timezone.now())
+        _corp(1, {
+            "1": _offer(100, 0, (100, 1), [(34, 10)]),
+            "2": _offer(100, 0, (100, 1), [(35, 1), (34, 10)]), # Unpriced input
+            "3": _offer(0, 0, (34, 1))
+        })
+
+    def test_rates_match_the_offer_engine(self):
+        engine = OfferEngine().compile()
+        expected = dict(zip(engine.offer_ids.tolist(), engine.evaluate(engine.build_price_vector()).tolist()))
+        offers = queries.get_best_offers()
+        self.assertEqual({offer.offer_id: offer.isk_per_lp for offer in offers}, expected)
+        self.assertEqual([offer.offer_id for offer in offers], [2, 1, 3])
+
+    def test_unpriced_inputs_are_flagged_and_can_be_excluded(self):
+        flagged = {offer.offer_id: offer.has_unpriced_inputs for offer in queries.get_best_offers()}
+        self.assertEqual(flagged, {1: False, 2: True, 3: False})
+        self.assertEqual([offer.offer_id for offer in queries.get_best_offers(exclude_unpriced=True)], [1, 3])
+
+    def test_best_offers_api(self):
+        response = self.client.get(reverse("lp_trader:api_best_offers"), {"limit": 1, "exclude_unpriced": 1})
+        self.assertEqual(response.json()["results"], [{
+            "corp_id": 1, "corp_name": "Corp 1", "offer_id": 1, "type_id": 100, "quantity": 1, "lp_cost": 100,
+            "isk_cost": 0, "isk_per_lp": 4.5, "has_unpriced_inputs": False
+        }])
+        self.assertEqual(self.client.get(reverse("lp_trader:api_best_offers"), {"price_type": "median"}).status_code, 400)
+
+    def test_item_offers_api(self):
+        body = self.client.get(reverse("lp_trader:api_item_offers", args=[34])).json()
+        self.assertEqual([offer["offer_id"] for offer in body["used_by"]], [2, 1])
+        self.assertEqual([offer["offer_id"] for offer in body["produced_by"]], [3])
+
+
+class BuildCostEngineTests(TestCase):
+    def _blueprint(self, bp_id: int, product_id: int, materials: dict, product_quantity: int = 1):
+        Blueprint.objects.create(
+            item_name=f"Blueprint {bp_id}", item_id=bp_id, product_id=product_id, product_quantity=product_quantity,
+            input_materials={str(material_id): quantity for material_id, quantity in materials.items()}
+        )
+
+    def test_material_efficiency_rounds_up_per_run(self):
+        self._blueprint(1000, 100, {34: 1, 35: 10, 36: 15})
+        prices = {34: 1, 35: 10, 36: 100, 100: 5000}
+        engine = industry.BuildCostEngine(material_efficiency=10).load()
+        # 1 stays 1, 10 becomes 9 and 15 becomes ceil(13.5) = 14
+        self.assertEqual(engine.get_blueprint_values([1000], prices.get), {1000: 5000 - (1 + 90 + 1400)})
+        self.assertEqual(industry.BuildCostEngine().load().get_blueprint_values([1000], prices.get), {1000: 5000 - (1 + 100 + 1500)})
+
+    def test_nested_components_use_the_cheaper_of_buying_and_building(self):
+        self._blueprint(1000, 100, {200: 2, 201: 1}) # Product needing two components
+        self._blueprint(2000, 200, {34: 10}, product_quantity=2) # Cheaper to build than to buy
+        self._blueprint(2010, 201, {34: 1000}) # Cheaper to buy
+        prices = {34: 2, 200: 50, 201: 30, 100: 1000}
+        engine = industry.BuildCostEngine().load()
+        self.assertEqual(engine.get_unit_build_costs([200, 201, 100], prices.get), {200: 10, 201: 30, 100: 50})
+        self.assertEqual(engine.get_blueprint_values([1000], prices.get), {1000: 1000 - (2 * 10 + 30)})
+
+    def test_cycles_are_cut_without_depending_on_evaluation_order(self):
+        # 300 is built from 301, 301 from 302 (or bought), and 302 from 300, closing the cycle
+        self._blueprint(3000, 300, {301: 1})
+        self._blueprint(3010, 301, {302: 1})
+        self._blueprint(3020, 302, {300: 1})
+        prices = {301: 100, 302: 1000}
+        engine = industry.BuildCostEngine().load()
+        expected = {300: 100, 301: 100, 302: 100}
+        for order in ([300, 301, 302], [302, 301, 300], [301, 300, 302]):
+            costs = engine.get_unit_build_costs(order, prices.get)
+            self.assertEqual(costs, expected, order)
+        self.assertEqual(engine.get_unit_build_costs([400], prices.get), {400: None})
+
+
+@override_settings(MARKET_HUBS={"Jita": 30000142, "Amarr": 30002187})
+class HubPriceTests(RankingTestCase):
+    def _hub_item(self, type_id: int, hub_prices: dict, market_price: dict | None = None):
+        Item.objects.create(
+            item_name=f"Item {type_id}", item_id=type_id, hub_prices=hub_prices,
+            market_price=market_price or {}, last_updated=timezone.now()
+        )
+
+    def test_select_hub_prices(self):
+        hub_prices = np.array([
+            [10, 5, 0, np.nan, np.nan],
+            [20, 3, np.nan, 0, np.nan],
+            [15, np.nan, np.nan, np.nan, np.nan]
+        ])
+        best, best_hubs = prices.select_hub_prices(hub_prices)
+        np.testing.assert_array_equal(best, [20, 5, 0, 0, np.nan])
+        self.assertEqual(best_hubs.tolist(), [1, 0, 0, 1, -1])
+        cheapest, cheapest_hubs = prices.select_hub_prices(hub_prices, cheapest=True)
+        np.testing.assert_array_equal(cheapest, [10, 3, 0, 0, np.nan])
+        self.assertEqual(cheapest_hubs.tolist(), [0, 1, 0, 1, -1])
+
+    def test_matrix_falls_back_to_the_primary_hub_price(self):
+        self._hub_item(34, {"Jita": _price(5), "Amarr": _price(4)})
+        self._hub_item(35, {"Amarr": _price(7)})
+        self._hub_item(36, {}, market_price=_price(9)) # Priced before multi-hub ingestion
+        matrix = prices.HubPriceMatrix().load()
+        self.assertEqual(matrix.hubs, ["Jita", "Amarr"])
+        np.testing.assert_array_equal(matrix.get_prices([34, 35, 36, 37]), [[5, np.nan, 9, np.nan], [4, 7, np.nan, np.nan]])
+        self.assertEqual(matrix.get_best_price(34, cheapest=True), 4)
+        self.assertEqual(matrix.get_best_price(35), 7)
+        self.assertIsNone(matrix.get_best_price(37))
+
+    def test_rankings_use_the_best_hub_of_each_offer(self):
+        self._hub_item(34, {"Jita": _price(5), "Amarr": _price(4)})
+        self._hub_item(100, {"Jita": _price(500), "Amarr": _price(600)})
+        self._hub_item(101, {"Jita": _price(300)})
+        _corp(1, {
+            "1": _offer(100, 0, (100, 1), [(34, 10)]), # Sells best in Amarr, inputs are cheapest in Amarr
+            "2": _offer(100, 0, (101, 1), [(34, 10)]), # Only priced in Jita
+            "3": _offer(100, 0, (102, 1)) # Not priced anywhere
+        })
+        rankings.rebuild_rankings()
+        ranked = {offer_id: (isk_per_lp, hub) for offer_id, isk_per_lp, hub in Ranking.objects.values_list("offer__offer_id", "isk_per_lp", "hub")}
+        self.assertEqual(ranked, {1: ((600 - 40) / 100, "Amarr"), 2: ((300 - 40) / 100, "Jita"), 3: (0, "")})
+
+
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(?:,|$)')
+
+
+def _parse_exposition(text: str) -> tuple[dict, dict]:
+    """
+    Parses the Prometheus text format into the type of every metric and its samples, keyed by
+    (sample name, sorted labels)
+    """
+    types, samples = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if line.startswith("#"):
+            continue
+        match = SAMPLE_PATTERN.match(line)
+        if match is None:
+            raise ValueError(f"Malformed sample: {line}")
+        name, labels, value = match.groups()
+        parsed_labels = LABEL_PATTERN.findall(labels or "")
+        if labels and "".join(f'{key}="{value}",' for key, value in parsed_labels)[:-1] != labels:
+            raise ValueError(f"Malformed labels: {line}")
+        if not any(name == family or name.startswith(f"{family}_") for family in types):
+            raise ValueError(f"Sample without a TYPE: {line}")
+        samples[(name, tuple(sorted(parsed_labels)))] = float(value)
+    return types, samples
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_render_merges_processes(self):
+        web, worker = metrics_module.MetricsRegistry(), metrics_module.MetricsRegistry()
+        with mock.patch.object(metrics_module.os, "getpid", return_value=1):
+            web.inc("lp_trader_http_requests_total", host="esi.evetech.net", endpoint="/markets/", status=200)
+            web.observe("lp_trader_refresh_duration_seconds", 0.3, refresh="prices")
+            web.flush(force=True)
+        with mock.patch.object(metrics_module.os, "getpid", return_value=2):
+            worker.inc("lp_trader_http_requests_total", 2, host="esi.evetech.net", endpoint="/markets/", status=200)
+            worker.inc("lp_trader_http_requests_total", host='a "quoted" host', endpoint="/", status=502)
+            worker.observe("lp_trader_refresh_duration_seconds", 7, refresh="prices")
+            worker.observe("lp_trader_ranking_queries", 3, buckets=metrics_module.QUERY_BUCKETS, mode="full")
+            text = worker.render()
+
+        types, samples = _parse_exposition(text)
+        self.assertEqual(types["lp_trader_http_requests_total"], "counter")
+        self.assertEqual(types["lp_trader_refresh_duration_seconds"], "histogram")
+        self.assertEqual(samples[("lp_trader_http_requests_total", (("endpoint", "/markets/"), ("host", "esi.evetech.net"), ("status", "200")))], 3)
+        self.assertEqual(samples[("lp_trader_http_requests_total", (("endpoint", "/"), ("host", 'a \\"quoted\\" host'), ("status", "502")))], 1)
+
+        buckets = {
+            dict(labels)["le"]: value for (name, labels), value in samples.items()
+            if name == "lp_trader_refresh_duration_seconds_bucket"
+        }
+        self.assertEqual(len(buckets), len(metrics_module.DEFAULT_BUCKETS) + 1)
+        self.assertEqual((buckets["0.25"], buckets["0.5"], buckets["5"], buckets["10"], buckets["+Inf"]), (0, 1, 1, 2, 2))
+        self.assertEqual(sorted(buckets.values()), [buckets[metrics_module._format_value(bound)] for bound in metrics_module.DEFAULT_BUCKETS] + [2])
+        self.assertEqual(samples[("lp_trader_refresh_duration_seconds_sum", (("refresh", "prices"),))], 7.3)
+        self.assertEqual(samples[("lp_trader_refresh_duration_seconds_count", (("refresh", "prices"),))], 2)
+        self.assertEqual(samples[("lp_trader_ranking_queries_bucket", (("le", "5"), ("mode", "full")))], 1)
+
+    def test_metrics_view(self):
+        metrics.inc("lp_trader_api_cache_total", result="hit")
+        response = self.client.get(reverse("lp_trader:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        types, samples = _parse_exposition(response.content.decode("utf-8"))
+        self.assertEqual(types["lp_trader_api_cache_total"], "counter")
+        self.assertGreaterEqual(samples[("lp_trader_api_cache_total", (("result", "hit"),))], 1)
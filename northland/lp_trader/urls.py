@@ -11,5 +11,12 @@ urlpatterns = [
     path("auth/update/corp", views.update_corp, name="update_corp"),
     path("auth/update/item", views.update_item, name="update_item"),
     path("endpoints/get/loyalty", views.view_loyalty, name="view_loyalty"),
-    path("endpoints/get/corp_wallet", views.view_corp_wallets, name="view_corp_wallet")
+    path("endpoints/get/corp_wallet", views.view_corp_wallets, name="view_corp_wallet"),
+    path("endpoints/get/job/<uuid:job_id>", views.view_job, name="view_job"),
+    path("endpoints/stream/job/<uuid:job_id>", views.stream_job, name="stream_job"),
+    path("api/rankings", views.api_rankings, name="api_rankings"),
+    path("api/rankings/corp/<int:corp_id>", views.api_rankings, name="api_corp_rankings"),
+    path("api/offers", views.api_best_offers, name="api_best_offers"),
+    path("api/items/<int:type_id>/offers", views.api_item_offers, name="api_item_offers"),
+    path("metrics", views.view_metrics, name="metrics")
 ]
\ No newline at end of file
@@ -1,17 +1,35 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
-from django.shortcuts import HttpResponse, HttpResponseRedirect, render
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import HttpResponse, HttpResponseRedirect, aget_object_or_404, get_object_or_404, render
 from django.urls import reverse
+from django.views.decorators.http import condition
 from esi.decorators import token_required
 from esi.models import Token
 from esi.managers import TokenQueryset
 
-from .backend import data, endpoints
+from . import tasks
+from .backend import data, endpoints, jobs, metrics, prices, queries, rankings
 from .models import *
 from northland.settings import ESI_SCOPES
 
+import asyncio
+import hashlib
+import json
+import time
+
+RANKING_FIELDS = ["corp_id", "corp_name", "offer_id", "type_id", "quantity", "lp_cost", "isk_cost", "isk_per_lp", "hub", "computed_at", "price_snapshot"]
+RANKING_PAGE_SIZE = 50
+RANKING_MAX_PAGE_SIZE = 500
+# Max. seconds a job progress stream stays open, and milliseconds until the client reconnects
+JOB_STREAM_DURATION = 60
+JOB_STREAM_RETRY = 1000
+
 # Create your views here.
 def index(request):
-    return render(request, "lp_trader/index.html")
+    active_jobs = [job for job in RefreshJob.objects.filter(status__in=[RefreshJob.QUEUED, RefreshJob.RUNNING]) if job.is_active()]
+    return render(request, "lp_trader/index.html", {"jobs": active_jobs})
 
 @token_required(new=True, scopes=ESI_SCOPES)
 def login(request, token):
@@ -23,21 +41,64 @@ def force_update_warning(request):
     return render(request, "lp_trader/force_update.html")
 
 def update_char(request):
-    tokens = Token.objects.all()
-    for token in tokens:
-        data.update_character_db(token, force=True)
+    job = tasks.enqueue_job("characters")
+    messages.success(request, f"Character DB update queued (job {job.job_id})")
     return HttpResponseRedirect(reverse("lp_trader:index"))
 
 def update_corp(request):
-    corps = Corp.objects.all()
-    for corp in corps:
-        data.update_corp_loyalty_store(corp_id=corp.corp_id)
+    job = tasks.enqueue_job("corps")
+    messages.success(request, f"Corp DB update queued (job {job.job_id})")
     return HttpResponseRedirect(reverse("lp_trader:index"))
 
 def update_item(request):
-    data.update_sde()
+    job = tasks.enqueue_job("items")
+    messages.success(request, f"Item DB update queued (job {job.job_id})")
     return HttpResponseRedirect(reverse("lp_trader:index"))
 
+def view_job(request, job_id):
+    job = get_object_or_404(RefreshJob, job_id=job_id)
+    return JsonResponse({
+        "job_id": str(job.job_id),
+        "kind": job.kind,
+        "status": job.status,
+        "progress": jobs.get_job_progress(job),
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at
+    })
+
+async def stream_job(request, job_id):
+    """
+    Streams the progress of a job as server-sent events. The view is async, so waiting between events does not
+    hold on to a worker thread; each connection is still capped and then asks the client to reconnect. Progress is
+    read from the cache, the job status is only re-read from the database every few seconds
+    """
+    job = await aget_object_or_404(RefreshJob, job_id=job_id)
+
+    async def event_stream(job, max_duration=JOB_STREAM_DURATION, interval=0.5, status_interval=2):
+        started = last_status_check = time.time()
+        last_event = None
+        while time.time() - started < max_duration:
+            if time.time() - last_status_check >= status_interval:
+                await job.arefresh_from_db(fields=["status", "progress", "error", "updated_at"])
+                last_status_check = time.time()
+            progress = await sync_to_async(jobs.get_job_progress)(job)
+            event = json.dumps({"status": job.status, "progress": progress, "error": job.error})
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event = event
+            if job.status in (RefreshJob.SUCCESS, RefreshJob.FAILED):
+                yield f"event: done\ndata: {event}\n\n"
+                return
+            await asyncio.sleep(interval)
+        # The client reconnects automatically after the retry delay
+        yield f"retry: {JOB_STREAM_RETRY}\n\n"
+
+    response = StreamingHttpResponse(event_stream(job), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 def view_loyalty(request):
     data.check_for_character_update()
     characters = Character.objects.filter(pull_data=True)
@@ -55,4 +116,110 @@ def view_corp_wallets(request):
         div_name = divisions[d - 1]["name"]
         remapped_wallets["Master Wallet" if div_name is None else div_name] = b
     messages.success(request, remapped_wallets)
-    return HttpResponseRedirect(reverse("lp_trader:index"))
\ No newline at end of file
+    return HttpResponseRedirect(reverse("lp_trader:index"))
+
+
+def _get_rankings_etag(request, corp_id=None):
+    version = rankings.get_rankings_version()
+    if version is None:
+        return None
+    return hashlib.md5(f"{version.isoformat()}|{request.get_full_path()}".encode("utf-8")).hexdigest()
+
+def _get_rankings_last_modified(request, corp_id=None):
+    return rankings.get_rankings_version()
+
+@condition(etag_func=_get_rankings_etag, last_modified_func=_get_rankings_last_modified)
+def api_rankings(request, corp_id=None):
+    """
+    JSON API for the global (or per-corp) LP offer rankings
+
+    Query parameters:
+        limit: Number of offers per page (default 50, max. 500)
+        cursor: The next_cursor value of the previous page
+        fields: Comma-separated list of fields to return (defaults to all fields)
+
+    Responses are cached until the rankings are rebuilt, and carry ETag/Last-Modified headers
+    so that unchanged pages can be answered with a 304
+    """
+    version = rankings.get_rankings_version()
+    cache_key = "lp_trader_api_rankings_" + hashlib.md5(f"{version}|{request.get_full_path()}".encode("utf-8")).hexdigest()
+    body = cache.get(cache_key)
+    metrics.metrics.inc("lp_trader_api_cache_total", result="miss" if body is None else "hit")
+    if body is None:
+        try:
+            limit = min(max(int(request.GET.get("limit", RANKING_PAGE_SIZE)), 1), RANKING_MAX_PAGE_SIZE)
+            fields = request.GET["fields"].split(",") if "fields" in request.GET else RANKING_FIELDS
+            invalid_fields = set(fields) - set(RANKING_FIELDS)
+            if invalid_fields:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(invalid_fields))}")
+            rows, next_cursor = rankings.get_ranking_page(limit=limit, cursor=request.GET.get("cursor"), corp_id=corp_id)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        body = {
+            "results": [{field: row[field] for field in fields} for row in rows],
+            "next_cursor": next_cursor,
+            "computed_at": version
+        }
+        cache.set(cache_key, body, 3600)
+    return JsonResponse(body)
+
+def _serialize_offer(offer: Offer) -> dict:
+    row = {
+        "corp_id": offer.corp.corp_id,
+        "corp_name": offer.corp.corp_name,
+        "offer_id": offer.offer_id,
+        "type_id": offer.type_id,
+        "quantity": offer.quantity,
+        "lp_cost": offer.lp_cost,
+        "isk_cost": offer.isk_cost
+    }
+    if hasattr(offer, "isk_per_lp"):
+        row.update(isk_per_lp=offer.isk_per_lp, has_unpriced_inputs=offer.has_unpriced_inputs)
+    return row
+
+def api_best_offers(request):
+    """
+    JSON API for the best LP offers at current prices, ranked in SQL
+
+    Query parameters:
+        limit: Number of offers to return (default 50, max. 500)
+        price_type: The price to use, one of "buy", "split" or "sell" (default "sell")
+        corp: Comma-separated list of corp IDs to rank offers of
+        exclude_unpriced: Leave out offers with unpriced inputs if set to 1
+    """
+    try:
+        limit = min(max(int(request.GET.get("limit", RANKING_PAGE_SIZE)), 1), RANKING_MAX_PAGE_SIZE)
+        corp_ids = [int(corp_id) for corp_id in request.GET["corp"].split(",")] if "corp" in request.GET else None
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    price_type = request.GET.get("price_type", "sell")
+    if price_type not in prices.PRICE_TYPES:
+        return JsonResponse({"error": f"Unknown price type {price_type}"}, status=400)
+    offers = queries.get_best_offers(
+        limit = limit,
+        price_type = price_type,
+        corp_ids = corp_ids,
+        exclude_unpriced = request.GET.get("exclude_unpriced") == "1"
+    )
+    return JsonResponse({"results": [_serialize_offer(offer) for offer in offers]})
+
+def api_item_offers(request, type_id):
+    """
+    JSON API for the LP offers that require an item as an input, and the offers that pay it out
+    """
+    price_type = request.GET.get("price_type", "sell")
+    if price_type not in prices.PRICE_TYPES:
+        return JsonResponse({"error": f"Unknown price type {price_type}"}, status=400)
+    consumers = queries.annotate_isk_per_lp(queries.get_offers_using_item(type_id), price_type).order_by("-isk_per_lp", "pk")
+    producers = queries.annotate_isk_per_lp(queries.get_offers_producing_item(type_id), price_type).order_by("-isk_per_lp", "pk")
+    return JsonResponse({
+        "type_id": type_id,
+        "used_by": [_serialize_offer(offer) for offer in consumers],
+        "produced_by": [_serialize_offer(offer) for offer in producers]
+    })
+
+def view_metrics(request):
+    """
+    Prometheus metrics of the refresh and ranking hot paths, merged across the web and Celery workers
+    """
+    return HttpResponse(metrics.metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,10 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "northland.settings")
+
+app = Celery("northland")
+# Settings use the old-style uppercase names (e.g. CELERYBEAT_SCHEDULE), so no namespace
+app.config_from_object("django.conf:settings")
+app.autodiscover_tasks()
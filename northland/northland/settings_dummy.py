@@ -132,8 +132,89 @@ ESI_SSO_CLIENT_SECRET = 'YOUR_CLIENT_SECRET'
 ESI_SSO_CALLBACK_URL = 'YOUR_CALLBACK_URL'
 ESI_SCOPES = ['publicData', 'esi-wallet.read_character_wallet.v1', 'esi-wallet.read_corporation_wallet.v1', 'esi-markets.structure_markets.v1', 'esi-corporations.read_structures.v1', 'esi-characters.read_loyalty.v1', 'esi-characters.read_opportunities.v1', 'esi-characters.read_chat_channels.v1', 'esi-characters.read_medals.v1', 'esi-characters.read_standings.v1', 'esi-characters.read_agents_research.v1', 'esi-industry.read_character_jobs.v1', 'esi-markets.read_character_orders.v1', 'esi-characters.read_blueprints.v1', 'esi-characters.read_corporation_roles.v1', 'esi-location.read_online.v1', 'esi-contracts.read_character_contracts.v1', 'esi-clones.read_implants.v1', 'esi-characters.read_fatigue.v1', 'esi-killmails.read_corporation_killmails.v1', 'esi-corporations.track_members.v1', 'esi-wallet.read_corporation_wallets.v1', 'esi-characters.read_notifications.v1', 'esi-corporations.read_divisions.v1', 'esi-corporations.read_contacts.v1', 'esi-assets.read_corporation_assets.v1', 'esi-corporations.read_titles.v1', 'esi-corporations.read_blueprints.v1', 'esi-bookmarks.read_corporation_bookmarks.v1', 'esi-contracts.read_corporation_contracts.v1', 'esi-corporations.read_standings.v1', 'esi-corporations.read_starbases.v1', 'esi-industry.read_corporation_jobs.v1', 'esi-markets.read_corporation_orders.v1', 'esi-corporations.read_container_logs.v1', 'esi-industry.read_character_mining.v1', 'esi-industry.read_corporation_mining.v1', 'esi-planets.read_customs_offices.v1', 'esi-corporations.read_facilities.v1', 'esi-corporations.read_medals.v1', 'esi-characters.read_titles.v1', 'esi-alliances.read_contacts.v1', 'esi-characters.read_fw_stats.v1', 'esi-corporations.read_fw_stats.v1', 'esi-characterstats.read.v1']
 
+# On-disk HTTP response cache for ESI and Fuzzworks requests
+HTTP_CACHE_DIR = BASE_DIR / 'http_cache'
+
+# Columnar store of price snapshots appended by every price refresh
+PRICE_HISTORY_DIR = BASE_DIR / 'price_history'
+# Number of snapshots LPConverter.get_top_offers() takes the rolling price of (0 ranks against current prices),
+# and whether the "mean" or "median" is taken
+PRICE_SMOOTHING_WINDOW = 0
+PRICE_SMOOTHING_METHOD = 'median'
+
+# Local SDE dump used by offline SDE loads, and the directory its compiled binary cache is kept in
+SDE_OFFLINE = False
+SDE_SNAPSHOT_PATH = BASE_DIR.parent / 'data.json'
+SDE_CACHE_DIR = BASE_DIR / 'sde_cache'
+
+# Upstream base URLs, which can be pointed at the stand-in server (manage.py standin) for offline load tests
+# ESI_API_URL = 'http://localhost:8089/esi/'
+FUZZWORK_DUMP_URL = 'https://www.fuzzwork.co.uk/dump/latest'
+FUZZWORK_MARKET_URL = 'https://market.fuzzwork.co.uk'
+STANDIN_RECORDINGS_DIR = BASE_DIR / 'standin_recordings'
+
+# Market hubs to ingest prices for, passed as the Fuzzworks region. The first hub is the primary hub
+MARKET_HUBS = {
+    'Jita': 30000142,
+    'Amarr': 30002187,
+    'Dodixie': 30002659,
+    'Rens': 30002510,
+}
+
+# Number of most used offer inputs refreshed (and re-ranked incrementally) between full price refreshes
+HOT_PRICE_REFRESH_SIZE = 500
+
+# Regions whose ESI order books are fetched for depth-aware pricing, keyed by market hub
+MARKET_HUB_REGIONS = {
+    'Jita': 10000002,
+    'Amarr': 10000043,
+    'Dodixie': 10000032,
+    'Rens': 10000030,
+}
+ORDER_BOOK_DIR = BASE_DIR / 'order_books'
+ORDER_BOOK_MAX_AGE = 6 * 3600
+# Number of redemptions of each offer that rankings size their order book fills for
+ORDER_BOOK_REDEMPTIONS = 1
+
+# Per-host limits of the outbound request scheduler (max. concurrent requests, requests per second and burst size)
+REQUEST_SCHEDULER_LIMITS = {
+    'esi.evetech.net': {'concurrency': 20, 'rate': 50, 'burst': 100},
+    'www.fuzzwork.co.uk': {'concurrency': 2, 'rate': 2, 'burst': 4},
+    'market.fuzzwork.co.uk': {'concurrency': 8, 'rate': 10, 'burst': 10},
+    'default': {'concurrency': 8, 'rate': 20, 'burst': 20},
+}
+
+BROKER_URL = 'redis://localhost:6379/0'
+
+# Shared cache for ESI responses and live refresh job progress, must be reachable from the web and Celery workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
 
 CELERYBEAT_SCHEDULE = {
+    'lp_trader_refresh_characters': {
+        'task': 'lp_trader.tasks.refresh_characters',
+        'schedule': crontab(minute='0')
+    },
+    'lp_trader_refresh_prices': {
+        'task': 'lp_trader.tasks.refresh_prices',
+        'schedule': crontab(minute='30')
+    },
+    'lp_trader_refresh_hot_prices': {
+        'task': 'lp_trader.tasks.refresh_hot_prices',
+        'schedule': crontab(minute='10,20,40,50')
+    },
+    'lp_trader_refresh_order_books': {
+        'task': 'lp_trader.tasks.refresh_order_books',
+        'schedule': crontab(minute='45')
+    },
+    'lp_trader_refresh_corps': {
+        'task': 'lp_trader.tasks.refresh_corps',
+        'schedule': crontab(hour='11', minute='15')
+    },
     'esi_cleanup_callbackredirect': {
         'task': 'esi.tasks.cleanup_callbackredirect',
         'schedule': crontab(minute='5')